@@ -4,25 +4,106 @@ SafeEats Backend API - Minimal FastAPI server for ingredient risk analysis.
 Run with: uvicorn app:app --reload
 """
 
+import asyncio
+import hashlib
 import json
+import os
 import re
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Annotated, AsyncIterator, NamedTuple, Optional
 
 import httpx
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field
 
-from db import init_db, get_cached_scan, cache_scan
-from rules import get_risk_with_source, get_overall_risk, get_rules_metadata, RULES_VERSION
+from db import (
+    init_db,
+    get_cached_scan_async,
+    get_hot_encoded_scan,
+    get_cached_scans_async,
+    get_fallback_scan_async,
+    cache_scan_async,
+    cache_scans_async,
+    get_local_product_async,
+    get_stored_product_async,
+    get_negative_scan_async,
+    cache_negative_scan_async,
+    get_cache_stats,
+    shutdown_executors,
+)
+from fuzzy import FuzzyIndex
+from hotcache import EncodedResponse, response_etag
+from matcher import build_substance_matcher, load_carcinogen_terms
+from rules import classify_many, get_risk_with_source, get_overall_risk, get_rules_metadata, RULES_VERSION, RISK_RULES
+from metrics import (
+    CACHE_LOOKUPS,
+    SCAN_SECONDS,
+    SCANS_IN_FLIGHT,
+    STAGE_SECONDS,
+    UPSTREAM_CIRCUIT_STATE,
+    UPSTREAM_HEDGES,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_REJECTED,
+    UPSTREAM_RESPONSE_BYTES,
+    UPSTREAM_RESPONSES,
+    UPSTREAM_RETRIES,
+    CIRCUIT_STATE_VALUES,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    render_metrics,
+    reset_metrics,
+)
+from maintenance import maintenance_loop, get_last_report, MAINTENANCE_INTERVAL_SECONDS
+from rescore import RescoreJob, RESCORE_ON_STARTUP
+from offjson import ProductFieldReader
+from singleflight import SingleFlight
+from resilience import UpstreamGuard, UpstreamUnavailable, backoff_delay, deadline_scope, remaining_budget
+from upstream import (
+    RETRYABLE_STATUSES,
+    UPSTREAM_STREAM_THRESHOLD,
+    start_http_client,
+    close_http_client,
+    get_http_client,
+    get_upstream_guard,
+    is_retryable_error,
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize the database on startup
+    # Initialize the database and the shared upstream HTTP client on startup
     init_db()
+    await start_http_client()
+    _stale_stats.update(served=0, refreshes=0, refresh_failures=0, fallbacks=0)
+    reset_metrics()
+    # Re-score stored products missing a verdict for the current rules
+    global _rescore_job
+    rescore_task = None
+    if RESCORE_ON_STARTUP:
+        _rescore_job = RescoreJob()
+        rescore_task = asyncio.get_running_loop().run_in_executor(None, _rescore_job.run)
+    # Expire, evict and vacuum the SQLite cache periodically
+    maintenance_task = None
+    if MAINTENANCE_INTERVAL_SECONDS > 0:
+        maintenance_task = asyncio.create_task(maintenance_loop(MAINTENANCE_INTERVAL_SECONDS))
     yield
-    # Clean up resources on shutdown if needed
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+        await asyncio.gather(maintenance_task, return_exceptions=True)
+    # Stop re-scoring after its current chunk (the next start resumes it);
+    # the job reports its own failures, so nothing here skips the teardown
+    if rescore_task is not None:
+        _rescore_job.stop()
+        await asyncio.gather(rescore_task, return_exceptions=True)
+    # Drop pending stale-entry refreshes
+    for task in list(_refresh_tasks):
+        task.cancel()
+    await asyncio.gather(*_refresh_tasks, return_exceptions=True)
+    # Close pooled upstream connections and drain database threads on shutdown
+    await close_http_client()
+    shutdown_executors()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -41,7 +122,67 @@ if INGREDIENT_MAP_PATH.exists():
     with open(INGREDIENT_MAP_PATH, "r") as f:
         INGREDIENT_MAP.update(json.load(f))
 
-OPEN_FOOD_FACTS_URL = "https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+# Finds known substances inside free-text ingredients, built once from the
+# ingredient map, the rule names and the app's carcinogen aliases
+SUBSTANCE_MATCHER = build_substance_matcher(INGREDIENT_MAP, RISK_RULES, load_carcinogen_terms())
+
+# Resolves misspelled ingredients ("aspartam") to the closest known name
+FUZZY_INDEX = FuzzyIndex({**INGREDIENT_MAP, **{name: name for name in RISK_RULES}})
+
+# Product API URL template; point it at a stand-in server for load tests
+OPEN_FOOD_FACTS_URL = os.environ.get(
+    "SAFEEATS_OPEN_FOOD_FACTS_URL", "https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+)
+
+# Product fields a scan reads, in order of preference within each group
+PRODUCT_FIELD_GROUPS = (("product_name", "product_name_en"), ("ingredients_text", "ingredients_text_en"))
+
+# Product fields requested from Open Food Facts (comma-separated; empty =
+# the full document, which is tens of kilobytes of images, nutriments and
+# translations the app never reads)
+OPEN_FOOD_FACTS_FIELDS = os.environ.get(
+    "SAFEEATS_OPEN_FOOD_FACTS_FIELDS", ",".join(field for group in PRODUCT_FIELD_GROUPS for field in group)
+)
+
+# Concurrent cache misses for the same barcode share one fetch + classification
+_inflight_scans = SingleFlight()
+
+# Outcomes remembered by the negative cache: 404 (not in Open Food Facts)
+# and 422 (no usable ingredients). Upstream failures (502) and refused
+# upstream calls (503) are not cached.
+NEGATIVE_CACHE_STATUSES = frozenset({404, 422})
+
+# Misses that fail with these statuses are answered from an expired cache
+# entry, if one is still stored
+UPSTREAM_UNAVAILABLE_STATUSES = frozenset({502, 503, 504})
+
+# End-to-end budget for one /scan (or one /scan/batch fetch); upstream
+# fetches get whatever is left of it. 0 = no deadline.
+SCAN_DEADLINE_SECONDS = float(os.environ.get("SAFEEATS_SCAN_DEADLINE_SECONDS", 10.0))
+
+# Startup re-scoring job, reported by /cache/stats
+_rescore_job: Optional[RescoreJob] = None
+
+# Background refreshes of stale cache entries (strong references so they
+# are not garbage collected mid-flight) and their counters; fallbacks are
+# expired entries served because upstream was unavailable
+_refresh_tasks: set[asyncio.Task] = set()
+_stale_stats = {"served": 0, "refreshes": 0, "refresh_failures": 0, "fallbacks": 0}
+
+# Batch scanning limits
+BATCH_MAX_SIZE = int(os.environ.get("SAFEEATS_BATCH_MAX_SIZE", 100))
+BATCH_FETCH_CONCURRENCY = int(os.environ.get("SAFEEATS_BATCH_FETCH_CONCURRENCY", 8))
+
+# Maximum barcodes being resolved at once by a streaming scan
+STREAM_WINDOW = int(os.environ.get("SAFEEATS_STREAM_WINDOW", 16))
+
+# Conditional GETs: clients may store responses but must revalidate them
+# (a 304 when the ETag still matches) before reuse
+SCAN_CACHE_CONTROL = "private, no-cache"
+RULES_METADATA_CACHE_CONTROL = "public, no-cache"
+RULES_METADATA_ETAG = '"' + hashlib.sha256(
+    json.dumps(get_rules_metadata(), sort_keys=True).encode()
+).hexdigest()[:32] + '"'
 
 
 class ScanRequest(BaseModel):
@@ -54,6 +195,9 @@ class IngredientResult(BaseModel):
     risk: str
     source: Optional[str] = None
     notes: Optional[str] = None
+    # 1.0 for exact and alias matches, below 1.0 for fuzzy matches,
+    # None when the ingredient matched no rule
+    confidence: Optional[float] = None
 
 
 class ScanResponse(BaseModel):
@@ -62,6 +206,23 @@ class ScanResponse(BaseModel):
     overall_risk: str
     cached: bool
     rules_version: str
+    # True when served past the cache TTL while a refresh runs in the background
+    stale: bool = False
+
+
+class BatchScanRequest(BaseModel):
+    barcodes: list[str] = Field(..., min_length=1, max_length=BATCH_MAX_SIZE)
+
+
+class BatchScanItem(BaseModel):
+    barcode: str
+    status: int
+    result: Optional[ScanResponse] = None
+    error: Optional[str] = None
+
+
+class BatchScanResponse(BaseModel):
+    results: list[BatchScanItem]
 
 
 
@@ -77,75 +238,341 @@ def normalize_ingredient(raw: str) -> str:
     return INGREDIENT_MAP.get(normalized, normalized)
 
 
+# Precompiled ingredient cleaning patterns. Bracket patterns match the
+# innermost group only and are re-applied per nesting level.
+_PARENTHETICAL_RE = re.compile(r"\([^()]*\)")
+_BRACKETED_RE = re.compile(r"\[[^\[\]]*\]")
+_PERCENTAGE_RE = re.compile(r"\d+\.?\d*\s*%")
+
+
+def _remove_groups(text: str, pattern: re.Pattern, opener: str) -> str:
+    """Replaces (possibly nested) bracket groups with a space, innermost first."""
+    while opener in text:
+        text, removed = pattern.subn(" ", text)
+        if not removed:
+            break  # only unbalanced brackets left
+    return text
+
+
+def find_substance(raw: str) -> Optional[str]:
+    """
+    Finds the riskiest known substance mentioned inside an ingredient,
+    e.g. "preservative: sodium benzoate" -> "sodium benzoate".
+    Returns the canonical name, or None if nothing matches.
+    """
+    matches = SUBSTANCE_MATCHER.find_all(raw.lower())
+    if not matches:
+        return None
+    candidates = [canonical for _, _, canonical in matches]
+    riskiest = get_overall_risk([get_risk_with_source(c)[0] for c in candidates])
+    return next(c for c in candidates if get_risk_with_source(c)[0] == riskiest)
+
+
+def find_fuzzy(normalized: str) -> Optional[tuple[str, float]]:
+    """
+    Resolves a misspelled ingredient to the closest known name with a rule,
+    e.g. "aspartam" -> ("aspartame", 0.889).
+    Returns (canonical name, similarity), or None if nothing is close enough.
+    """
+    match = FUZZY_INDEX.lookup(normalized)
+    if match is None or match[0] not in RISK_RULES:
+        return None
+    return match
+
+
+def resolve_ingredient(raw: str) -> tuple[str, Optional[float]]:
+    """
+    Maps a raw ingredient to its canonical name and match confidence.
+    Falls back to substance matching when the whole token has no rule,
+    then to fuzzy matching for misspellings; confidence is None when
+    nothing matched.
+    """
+    canonical = normalize_ingredient(raw)
+    if canonical in RISK_RULES:
+        return canonical, 1.0
+    substance = find_substance(raw)
+    if substance:
+        return substance, 1.0
+    fuzzy = find_fuzzy(canonical)
+    if fuzzy:
+        return fuzzy
+    return canonical, None
+
+
+def build_ingredient_result(
+    raw: str, canonical: str, confidence: Optional[float], rule_result: tuple[str, str, Optional[str]]
+) -> IngredientResult:
+    """Builds the response entry for a resolved ingredient and its (risk, source, notes)."""
+    risk, source, notes = rule_result
+    return IngredientResult(
+        raw=raw,
+        canonical=canonical,
+        risk=risk,
+        source=source if risk != "safe" else None,
+        notes=notes if risk != "safe" else None,
+        confidence=confidence
+    )
+
+
+def classify_ingredient(raw: str) -> IngredientResult:
+    """Maps a raw ingredient to its canonical name and risk."""
+    canonical, confidence = resolve_ingredient(raw)
+    return build_ingredient_result(raw, canonical, confidence, get_risk_with_source(canonical))
+
+
 def parse_ingredients(ingredients_text: Optional[str]) -> list[str]:
-    """Parses ingredient text into individual ingredients."""
+    """
+    Parses ingredient text into individual ingredients.
+    
+    Removes parenthetical/bracketed info (including nested groups) and
+    percentages, splits on commas, semicolons and periods, and drops
+    duplicates while keeping first-seen order.
+    """
     if not ingredients_text:
         return []
     
-    # Clean and split by common delimiters
     cleaned = ingredients_text.lower()
-    cleaned = re.sub(r"\([^)]*\)", " ", cleaned)  # Remove parenthetical info
-    cleaned = re.sub(r"\[[^\]]*\]", " ", cleaned)  # Remove bracketed info
-    cleaned = re.sub(r"\d+\.?\d*\s*%", "", cleaned)  # Remove percentages
+    cleaned = _remove_groups(cleaned, _PARENTHETICAL_RE, "(")  # Remove parenthetical info
+    cleaned = _remove_groups(cleaned, _BRACKETED_RE, "[")  # Remove bracketed info
+    if "%" in cleaned:
+        cleaned = _PERCENTAGE_RE.sub("", cleaned)  # Remove percentages
     
     # Split by comma, semicolon, or period
-    parts = re.split(r"[,;.]", cleaned)
+    parts = cleaned.replace(";", ",").replace(".", ",").split(",")
     
-    # Clean and filter
-    ingredients = []
-    for part in parts:
-        ingredient = part.strip()
-        if ingredient and len(ingredient) > 1:
-            ingredients.append(ingredient)
+    # Clean, remove duplicates (keeping order) and filter
+    return [i for i in dict.fromkeys(part.strip() for part in parts) if len(i) > 1]
+
+
+def product_url(barcode: str) -> str:
+    """The Open Food Facts URL for a barcode, asking only for OPEN_FOOD_FACTS_FIELDS."""
+    url = OPEN_FOOD_FACTS_URL.format(barcode=barcode)
+    if not OPEN_FOOD_FACTS_FIELDS:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}fields={OPEN_FOOD_FACTS_FIELDS}"
+
+
+class UpstreamReply(NamedTuple):
+    """An upstream response and, for a 200, its decoded product document."""
+
+    response: httpx.Response
+    data: Optional[dict]
+
+
+async def read_product_document(response: httpx.Response) -> dict:
+    """
+    Reads and decodes the body of a 200 product response.
     
-    return list(set(ingredients))  # Remove duplicates
+    Bodies known to be small (the usual fields-restricted answer) are
+    decoded in one go. Larger ones, or ones of unknown length, are fed to
+    ProductFieldReader as they download, and reading stops once the fields
+    a scan needs are known. The rest is still read when little of it is
+    left, so the connection can go back to the pool; otherwise closing the
+    response drops the connection. Raises httpx.DecodingError when the
+    body is not a product document.
+    """
+    length = response.headers.get("Content-Length")
+    size = int(length) if length is not None and length.isdigit() else None
+    try:
+        if size is not None and size < UPSTREAM_STREAM_THRESHOLD:
+            body = await response.aread()
+            with STAGE_SECONDS.time("decode"):
+                return json.loads(body)
+        reader = ProductFieldReader(PRODUCT_FIELD_GROUPS)
+        decode_seconds = 0.0
+        async for chunk in response.aiter_bytes():
+            if reader.done:
+                continue  # draining a short remainder
+            start = time.perf_counter()
+            reader.feed(chunk)
+            decode_seconds += time.perf_counter() - start
+            if reader.done and (size is None or size - response.num_bytes_downloaded > UPSTREAM_STREAM_THRESHOLD):
+                break
+        start = time.perf_counter()
+        data = reader.result()
+        STAGE_SECONDS.observe(decode_seconds + time.perf_counter() - start, "decode")
+    except ValueError as e:
+        raise httpx.DecodingError(f"Open Food Facts sent an unreadable product document: {e}", request=response.request)
+    return data
+
+
+async def send_upstream(client: httpx.AsyncClient, guard: UpstreamGuard, url: str) -> UpstreamReply:
+    """
+    Sends one request through the upstream guard and records its outcome:
+    transport errors, unreadable bodies, 5xx and 429 responses count as
+    breaker failures, and the latency of other responses feeds the hedge
+    delay. A 200 body is decoded here (see read_product_document), before
+    the request gives up its slot.
+    """
+    async with guard.slot():
+        UPSTREAM_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            with STAGE_SECONDS.time("fetch"):
+                response = await client.send(client.build_request("GET", url), stream=True)
+                try:
+                    if response.status_code == 200:
+                        data = await read_product_document(response)
+                    else:
+                        data = None
+                        await response.aread()
+                finally:
+                    await response.aclose()
+                    UPSTREAM_RESPONSE_BYTES.inc(amount=response.num_bytes_downloaded)
+        except httpx.HTTPError:
+            guard.breaker.record_failure()
+            UPSTREAM_RESPONSES.inc("error")
+            raise
+        finally:
+            UPSTREAM_IN_FLIGHT.dec()
+        UPSTREAM_RESPONSES.inc(str(response.status_code))
+        if response.status_code >= 500 or response.status_code == 429:
+            guard.breaker.record_failure()
+        else:
+            guard.breaker.record_success()
+            guard.latency.observe(time.perf_counter() - start)
+        return UpstreamReply(response, data)
+
+
+async def send_hedged(client: httpx.AsyncClient, guard: UpstreamGuard, url: str) -> UpstreamReply:
+    """
+    send_upstream, plus a second (hedged) request if the first has not
+    answered after the recent p95 latency. The hedge is only sent when the
+    guard would admit it without waiting and the retry budget has tokens to
+    spare beyond a reserve kept for retries. The first response wins (a
+    retryable 502/503/504 only if the other request fails too) and the
+    other request is cancelled.
+    """
+    p95 = guard.latency.percentile(0.95)
+    if p95 is None:
+        return await send_upstream(client, guard, url)
+    primary = asyncio.ensure_future(send_upstream(client, guard, url))
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=max(guard.retry_policy.hedge_min_delay, p95))
+        budget = guard.retry_budget
+        if not done and guard.has_spare_capacity() and budget.try_spend(keep=budget.max_tokens / 2):
+            guard.hedges += 1
+            UPSTREAM_HEDGES.inc("sent")
+            pending.add(asyncio.ensure_future(send_upstream(client, guard, url)))
+        failed = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().response.status_code not in RETRYABLE_STATUSES:
+                    if task is not primary:
+                        guard.hedge_wins += 1
+                        UPSTREAM_HEDGES.inc("won")
+                    return task.result()
+                failed.append(task)
+        # Every request failed: report the first failure as send_upstream would
+        return failed[0].result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def retry_pause(guard: UpstreamGuard, attempt: int) -> bool:
+    """
+    Waits out the jittered backoff before retry number attempt (0-based).
+    Returns False instead when the retries, the time left before the
+    deadline or the shared retry budget are used up.
+    """
+    policy = guard.retry_policy
+    if attempt >= policy.retries:
+        return False
+    delay = backoff_delay(attempt, policy.base_delay, policy.max_delay)
+    # Leave at least a typical request's worth of budget for the retry
+    remaining = remaining_budget()
+    if remaining is not None and remaining - delay <= (guard.latency.percentile(0.5) or 0.0):
+        return False
+    if not guard.retry_budget.try_spend():
+        return False
+    guard.retries += 1
+    UPSTREAM_RETRIES.inc()
+    await asyncio.sleep(delay)
+    return True
 
 
 async def fetch_product(barcode: str) -> dict:
-    """Fetches product from Open Food Facts API."""
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    """
+    Fetches product from Open Food Facts API using the shared pooled client.
+    
+    Only the fields a scan reads are requested (see product_url). The
+    request goes through the upstream guard and must finish within the
+    time left before the scan deadline (504 otherwise). Connection failures
+    and 502/503/504 responses are retried with jittered backoff; requests
+    refused by the guard (circuit open, rate limited, overloaded) raise 503
+    with Retry-After without calling upstream.
+    """
+    client = get_http_client()
+    guard = get_upstream_guard()
+    url = product_url(barcode)
+    send = send_hedged if guard.retry_policy.hedge else send_upstream
+    guard.retry_budget.record_request()
+    attempt = 0
+    while True:
+        error = None
+        remaining = remaining_budget()
         try:
-            response = await client.get(OPEN_FOOD_FACTS_URL.format(barcode=barcode))
-            response.raise_for_status()
-            return response.json()
+            if remaining is None:
+                reply = await send(client, guard, url)
+            else:
+                reply = await asyncio.wait_for(send(client, guard, url), max(remaining, 0))
+        except asyncio.TimeoutError:
+            guard.deadline_exceeded += 1
+            raise HTTPException(status_code=504, detail="Open Food Facts did not answer within the request deadline")
+        except UpstreamUnavailable as e:
+            UPSTREAM_REJECTED.inc(e.reason)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Open Food Facts temporarily unavailable ({e.reason})",
+                headers={"Retry-After": e.retry_after_header},
+            )
         except httpx.HTTPError as e:
+            error = e
+        
+        if error is not None:
+            retryable = is_retryable_error(error)
+        else:
+            retryable = reply.response.status_code in RETRYABLE_STATUSES
+        if retryable and await retry_pause(guard, attempt):
+            attempt += 1
+            continue
+        
+        if error is not None:
+            raise HTTPException(status_code=502, detail=f"Failed to fetch from Open Food Facts: {error}")
+        try:
+            reply.response.raise_for_status()
+        except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=502, detail=f"Failed to fetch from Open Food Facts: {e}")
+        return reply.data
 
 
-@app.post("/scan", response_model=ScanResponse)
-async def scan(request: ScanRequest) -> ScanResponse:
+async def get_product(barcode: str) -> dict:
     """
-    Scan a product barcode and return risk analysis.
+    Returns the Open Food Facts product document for a barcode.
     
-    - Validates barcode format (8-14 numeric digits)
-    - Returns cached result if available (<24h)
-    - Fetches from Open Food Facts if not cached
-    - Normalizes ingredients and applies risk rules
+    Looks in the offline product store first and only goes to the
+    network when the barcode has not been imported.
     """
-    barcode = request.barcode.strip()
-    
-    # 1. Validate barcode
-    if not validate_barcode(barcode):
-        raise HTTPException(status_code=400, detail="Invalid barcode: must be 8-14 digits")
+    product = await get_local_product_async(barcode)
+    if product is not None:
+        return product
     
-    # 2. Check cache
-    cached = get_cached_scan(barcode)
-    if cached:
-        cached["cached"] = True
-        # Ensure rules_version is present (for backward compatibility with old cache entries)
-        if "rules_version" not in cached:
-            cached["rules_version"] = RULES_VERSION
-        return ScanResponse(**cached)
-    
-    # 3. Fetch from Open Food Facts
     data = await fetch_product(barcode)
     
     if data.get("status") != 1 or not data.get("product"):
         raise HTTPException(status_code=404, detail="Product not found in Open Food Facts")
     
-    product = data["product"]
-    
-    # 4. Extract product name and ingredients
+    return data["product"]
+
+
+def extract_product_fields(product: dict) -> tuple[str, str]:
+    """
+    Returns (product name, ingredients text) from an Open Food Facts product.
+    Raises HTTPException 422 when the product has no ingredients.
+    """
     product_name = (
         product.get("product_name") or
         product.get("product_name_en") or
@@ -160,52 +587,555 @@ async def scan(request: ScanRequest) -> ScanResponse:
     if not ingredients_text:
         raise HTTPException(status_code=422, detail="Product has no ingredient information")
     
-    # 5. Parse and normalize ingredients
-    raw_ingredients = parse_ingredients(ingredients_text)
+    return product_name, ingredients_text
+
+
+def score_product(product_name: str, ingredients_text: str) -> dict:
+    """
+    Classifies a product's ingredients text under the current rules.
+    Returns the response data dict; raises HTTPException 422 if nothing parses.
+    """
+    # Parse and normalize ingredients
+    with STAGE_SECONDS.time("parse"):
+        raw_ingredients = parse_ingredients(ingredients_text)
     
     if not raw_ingredients:
         raise HTTPException(status_code=422, detail="Could not parse ingredients from product")
     
-    # 6. Apply risk rules
-    ingredient_results = []
-    risks = []
-    
-    for raw in raw_ingredients:
-        canonical = normalize_ingredient(raw)
-        risk, source, notes = get_risk_with_source(canonical)
-        risks.append(risk)
-        ingredient_results.append(IngredientResult(
-            raw=raw,
-            canonical=canonical,
-            risk=risk,
-            source=source if risk != "safe" else None,
-            notes=notes if risk != "safe" else None
-        ))
-    
-    overall_risk = get_overall_risk(risks)
-    
-    # 7. Build response
-    response_data = {
+    # Resolve names, then apply risk rules and the overall risk in one pass
+    with STAGE_SECONDS.time("classify"):
+        resolved = [resolve_ingredient(raw) for raw in raw_ingredients]
+        rule_results, overall_risk = classify_many(canonical for canonical, _ in resolved)
+        ingredient_results = [
+            build_ingredient_result(raw, canonical, confidence, rule_result)
+            for raw, (canonical, confidence), rule_result in zip(raw_ingredients, resolved, rule_results)
+        ]
+    
+    # Build response
+    return {
         "product_name": product_name,
         "ingredients": [i.model_dump() for i in ingredient_results],
         "overall_risk": overall_risk,
         "cached": False,
         "rules_version": RULES_VERSION
     }
+
+
+async def classify_product(barcode: str) -> tuple[dict, Optional[str]]:
+    """
+    Classifies a product (without caching).
     
-    # 8. Cache the result
-    cache_scan(barcode, response_data)
+    Recomputes the verdict from stored raw product data when it is still
+    fresh (e.g. after a rules change), otherwise fetches the product.
+    
+    Returns (response data, ingredients text to store); the text is None
+    when the stored raw data was used. Raises HTTPException for upstream
+    failures, unknown products and products without ingredients.
+    """
+    stored = await get_stored_product_async(barcode)
+    if stored is not None:
+        return score_product(stored["product_name"], stored["ingredients_text"]), None
+    
+    product = await get_product(barcode)
+    product_name, ingredients_text = extract_product_fields(product)
+    return score_product(product_name, ingredients_text), ingredients_text
+
+
+async def resolve_product(barcode: str) -> tuple[dict, Optional[str]]:
+    """
+    classify_product behind the negative cache: a recent 404/422 for the
+    barcode is raised again without calling upstream, and new 404/422
+    outcomes are recorded.
+    """
+    negative = await get_negative_scan_async(barcode)
+    if negative is not None:
+        status, detail = negative
+        raise HTTPException(status_code=status, detail=detail)
+    try:
+        return await classify_product(barcode)
+    except HTTPException as e:
+        if e.status_code in NEGATIVE_CACHE_STATUSES:
+            await cache_negative_scan_async(barcode, e.status_code, e.detail)
+        raise
+
+
+async def analyze_product(barcode: str) -> tuple[dict, Optional[str]]:
+    """
+    Classifies a product, then caches the verdict (and raw data if fetched).
+    Returns the same (response data, ingredients text) pair as
+    resolve_product, so /scan and /scan/batch can share in-flight work.
+    """
+    result = await resolve_product(barcode)
+    with STAGE_SECONDS.time("cache_write"):
+        await cache_scan_async(barcode, *result)
+    return result
+
+
+def cached_response(cached: dict) -> ScanResponse:
+    """Builds a ScanResponse from a cache entry."""
+    cached["cached"] = True
+    # Ensure rules_version is present (for backward compatibility with old cache entries)
+    if "rules_version" not in cached:
+        cached["rules_version"] = RULES_VERSION
+    return ScanResponse(**cached)
+
+
+def schedule_refresh(barcode: str) -> None:
+    """
+    Refreshes a stale cache entry in the background. Concurrent requests
+    for the same barcode share one refresh (and any in-flight scan).
+    """
+    _stale_stats["served"] += 1
+    if barcode in _inflight_scans:
+        return
+    
+    async def refresh():
+        try:
+            # A fresh budget: the request that scheduled this has already been answered
+            with deadline_scope(SCAN_DEADLINE_SECONDS):
+                await _inflight_scans.run(barcode, lambda: analyze_product(barcode))
+            _stale_stats["refreshes"] += 1
+        except HTTPException:
+            # Keep serving the stale entry; the next request retries
+            _stale_stats["refresh_failures"] += 1
+    
+    task = asyncio.create_task(refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip (gzip;q=0 refuses it)."""
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        params = params.strip().lower()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check (weak comparison, as RFC 9110 requires). The gzip
+    variant's tag counts as the same representation.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.removesuffix("-gzip") == opaque:
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def encoded_scan_response(
+    encoded: EncodedResponse,
+    accept_encoding: Optional[str],
+    headers: Optional[dict] = None,
+) -> Response:
+    """Sends a pre-serialized hot-cache hit, gzipped if the client accepts it."""
+    headers = {"ETag": encoded.etag, **(headers or {})}
+    if encoded.gzip_body is None:
+        return Response(encoded.body, media_type="application/json", headers=headers)
+    headers["Vary"] = "Accept-Encoding"
+    if accepts_gzip(accept_encoding):
+        # A different representation of the same result gets its own strong tag
+        headers["ETag"] = encoded.etag[:-1] + '-gzip"'
+        headers["Content-Encoding"] = "gzip"
+        return Response(encoded.gzip_body, media_type="application/json", headers=headers)
+    return Response(encoded.body, media_type="application/json", headers=headers)
+
+
+@app.post("/scan", response_model=ScanResponse)
+async def scan(
+    request: ScanRequest,
+    accept_encoding: Annotated[Optional[str], Header()] = None,
+    response: Response = None,
+) -> ScanResponse:
+    """
+    Scan a product barcode and return risk analysis.
+    
+    - Validates barcode format (8-14 numeric digits)
+    - Returns cached result if available (<24h); older entries up to
+      CACHE_MAX_STALE_HOURS past that are returned flagged stale and
+      refreshed in the background
+    - Hot-cache hits are sent as stored pre-serialized bytes (gzipped when
+      accepted) without rebuilding or re-validating the response
+    - Fetches from Open Food Facts if not cached (one fetch per barcode
+      no matter how many concurrent requests miss the cache)
+    - Normalizes ingredients and applies risk rules
+    - Sets a strong ETag identifying the result (see GET /scan/{barcode})
+    """
+    start = time.perf_counter()
+    barcode = request.barcode.strip()
+    encoded = get_hot_encoded_scan(barcode)
+    if encoded is not None:
+        CACHE_LOOKUPS.inc("hot")
+        hot_response = encoded_scan_response(encoded, accept_encoding)
+        SCAN_SECONDS.observe(time.perf_counter() - start, "hot")
+        return hot_response
+    result = await measured_resolve_scan(barcode, start)
+    if response is not None:
+        response.headers["ETag"] = response_etag(barcode, result.model_dump())
+    return result
+
+
+@app.get("/scan/{barcode}", response_model=ScanResponse)
+async def scan_conditional(
+    barcode: str,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+    accept_encoding: Annotated[Optional[str], Header()] = None,
+) -> Response:
+    """
+    Cacheable form of POST /scan.
+    
+    Returns 304 Not Modified with no body when If-None-Match carries the
+    current ETag, so clients rescanning a product they already have skip
+    the download.
+    """
+    start = time.perf_counter()
+    barcode = barcode.strip()
+    encoded = get_hot_encoded_scan(barcode)
+    if encoded is not None:
+        CACHE_LOOKUPS.inc("hot")
+        if etag_matches(if_none_match, encoded.etag):
+            hot_response = not_modified(encoded.etag, SCAN_CACHE_CONTROL)
+        else:
+            hot_response = encoded_scan_response(encoded, accept_encoding, {"Cache-Control": SCAN_CACHE_CONTROL})
+        SCAN_SECONDS.observe(time.perf_counter() - start, "hot")
+        return hot_response
+    
+    result = await measured_resolve_scan(barcode, start)
+    etag = response_etag(barcode, result.model_dump())
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, SCAN_CACHE_CONTROL)
+    return Response(
+        result.model_dump_json(),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": SCAN_CACHE_CONTROL},
+    )
+
+
+async def measured_resolve_scan(barcode: str, start: float) -> ScanResponse:
+    """resolve_scan, tracked by the in-flight gauge and the /scan latency histogram."""
+    SCANS_IN_FLIGHT.inc()
+    outcome = "error"
+    try:
+        result = await resolve_scan(barcode, hot_checked=True)
+        outcome = "stale" if result.stale else "hit" if result.cached else "miss"
+        return result
+    finally:
+        SCANS_IN_FLIGHT.dec()
+        SCAN_SECONDS.observe(time.perf_counter() - start, outcome)
+
+
+async def resolve_scan(barcode: str, hot_checked: bool = False) -> ScanResponse:
+    """
+    Runs the /scan pipeline for one barcode within SCAN_DEADLINE_SECONDS.
+    hot_checked means the caller already missed the hot cache.
+    Raises HTTPException on failure.
+    """
+    with deadline_scope(SCAN_DEADLINE_SECONDS):
+        return await resolve_scan_within_deadline(barcode, hot_checked)
+
+
+async def resolve_scan_within_deadline(barcode: str, hot_checked: bool = False) -> ScanResponse:
+    """The /scan pipeline; upstream fetches use the caller's deadline."""
+    # 1. Validate barcode
+    with STAGE_SECONDS.time("validate"):
+        valid = validate_barcode(barcode)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid barcode: must be 8-14 digits")
+    
+    # 2. Check cache (stale entries are served while they refresh)
+    with STAGE_SECONDS.time("cache_lookup"):
+        cached = await get_cached_scan_async(barcode, allow_stale=True, skip_hot=hot_checked)
+    if cached:
+        if cached.get("stale"):
+            CACHE_LOOKUPS.inc("stale")
+            schedule_refresh(barcode)
+        else:
+            CACHE_LOOKUPS.inc("hit")
+        return cached_response(cached)
+    CACHE_LOOKUPS.inc("miss")
+    
+    # 3. Fetch, classify and cache (coalesced per barcode); while upstream
+    # is failing, fall back to an expired entry rather than an error
+    try:
+        response_data, _ = await _inflight_scans.run(barcode, lambda: analyze_product(barcode))
+    except HTTPException as e:
+        if e.status_code not in UPSTREAM_UNAVAILABLE_STATUSES:
+            raise
+        fallback = await get_fallback_scan_async(barcode)
+        if fallback is None:
+            raise
+        _stale_stats["fallbacks"] += 1
+        return cached_response(fallback)
     
     return ScanResponse(**response_data)
 
 
+@app.post("/scan/batch", response_model=BatchScanResponse)
+async def scan_batch(request: BatchScanRequest) -> BatchScanResponse:
+    """
+    Scan up to BATCH_MAX_SIZE barcodes in one request.
+    
+    - Resolves all cache hits with a single bulk lookup
+    - Fetches misses concurrently (at most BATCH_FETCH_CONCURRENCY at a time)
+    - Writes new results to the cache in one transaction
+    - Answers misses upstream could not serve (502/503) from expired
+      cache entries when one is still stored
+    - Returns one item per requested barcode, in request order; a failing
+      barcode gets its own status/error without failing the batch
+    """
+    barcodes = [b.strip() for b in request.barcodes]
+    valid = list(dict.fromkeys(b for b in barcodes if validate_barcode(b)))
+    
+    with STAGE_SECONDS.time("cache_lookup"):
+        cached = await get_cached_scans_async(valid, allow_stale=True)
+    misses = [b for b in valid if b not in cached]
+    stale = [b for b, entry in cached.items() if entry.get("stale")]
+    for barcode in stale:
+        schedule_refresh(barcode)
+    CACHE_LOOKUPS.inc("hit", amount=len(cached) - len(stale))
+    CACHE_LOOKUPS.inc("stale", amount=len(stale))
+    CACHE_LOOKUPS.inc("miss", amount=len(misses))
+    
+    semaphore = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+    
+    async def resolve(barcode: str):
+        async with semaphore:
+            # Each fetch gets a full deadline once it has a slot, so time
+            # spent queued behind other barcodes is not counted against it
+            try:
+                with deadline_scope(SCAN_DEADLINE_SECONDS):
+                    return await _inflight_scans.run(barcode, lambda: resolve_product(barcode))
+            except HTTPException as e:
+                return e
+    
+    outcomes = dict(zip(misses, await asyncio.gather(*(resolve(b) for b in misses))))
+    classified = {b: r for b, r in outcomes.items() if isinstance(r, tuple)}
+    fresh = {b: response for b, (response, _) in classified.items()}
+    fetched = {b: text for b, (_, text) in classified.items() if text is not None}
+    if fresh:
+        with STAGE_SECONDS.time("cache_write"):
+            await cache_scans_async(fresh, fetched)
+    
+    # Answer barcodes upstream could not serve from expired entries
+    fallbacks = {}
+    for barcode, outcome in outcomes.items():
+        if isinstance(outcome, HTTPException) and outcome.status_code in UPSTREAM_UNAVAILABLE_STATUSES:
+            fallback = await get_fallback_scan_async(barcode)
+            if fallback is not None:
+                fallbacks[barcode] = fallback
+    _stale_stats["fallbacks"] += len(fallbacks)
+    
+    results = []
+    for barcode in barcodes:
+        if barcode in cached:
+            result = cached_response(dict(cached[barcode]))
+            results.append(BatchScanItem(barcode=barcode, status=200, result=result))
+        elif barcode in fresh:
+            results.append(BatchScanItem(barcode=barcode, status=200, result=ScanResponse(**fresh[barcode])))
+        elif barcode in fallbacks:
+            result = cached_response(dict(fallbacks[barcode]))
+            results.append(BatchScanItem(barcode=barcode, status=200, result=result))
+        elif barcode in outcomes:
+            error = outcomes[barcode]
+            results.append(BatchScanItem(barcode=barcode, status=error.status_code, error=error.detail))
+        else:
+            results.append(BatchScanItem(
+                barcode=barcode, status=400, error="Invalid barcode: must be 8-14 digits"
+            ))
+    
+    return BatchScanResponse(results=results)
+
+
+async def resolve_scan_item(barcode: str) -> BatchScanItem:
+    """Runs the /scan pipeline for one barcode and wraps the outcome."""
+    try:
+        result = await resolve_scan(barcode)
+    except HTTPException as e:
+        return BatchScanItem(barcode=barcode, status=e.status_code, error=e.detail)
+    return BatchScanItem(barcode=barcode, status=200, result=result)
+
+
+def _parse_stream_line(line: bytes) -> Optional[str]:
+    """Accepts a bare barcode or a JSON {"barcode": ...} object per line."""
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith(b"{"):
+        try:
+            return str(json.loads(line).get("barcode", "")).strip()
+        except (ValueError, AttributeError):
+            return line.decode("utf-8", "replace")
+    return line.decode("utf-8", "replace").strip('"')
+
+
+async def _iter_list(barcodes: list) -> AsyncIterator[str]:
+    for barcode in barcodes:
+        yield str(barcode).strip()
+
+
+async def _iter_body_lines(request: Request, body_done: asyncio.Event) -> AsyncIterator[str]:
+    """
+    Reads the request body incrementally, yielding one barcode per line.
+    Sets body_done once the body is exhausted (or the client went away).
+    """
+    buffer = b""
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                barcode = _parse_stream_line(line)
+                if barcode is not None:
+                    yield barcode
+    except ClientDisconnect:
+        return
+    finally:
+        body_done.set()
+    barcode = _parse_stream_line(buffer)
+    if barcode is not None:
+        yield barcode
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that can be sent while the request body is still
+    being read. Starlette's version listens for client disconnects by
+    calling receive() from the start, which would swallow body chunks the
+    endpoint has not read yet, so listening waits until the body is done.
+    """
+    
+    def __init__(self, content: AsyncIterator[bytes], body_done: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self._body_done = body_done
+    
+    async def listen_for_disconnect(self, receive) -> None:
+        await self._body_done.wait()
+        await super().listen_for_disconnect(receive)
+
+
+async def _next_or_none(source: AsyncIterator[str]) -> Optional[str]:
+    try:
+        return await source.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def stream_scan_results(barcodes: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """
+    Resolves barcodes with at most STREAM_WINDOW in flight and yields one
+    NDJSON line per barcode as soon as it is ready (completion order).
+    
+    New input is only pulled while the window has room, and the response
+    body is only produced as fast as the client reads it, so memory stays
+    flat regardless of how many barcodes are sent.
+    """
+    pending: set[asyncio.Task] = set()
+    next_barcode: Optional[asyncio.Task] = None
+    exhausted = False
+    try:
+        while True:
+            if not exhausted and next_barcode is None and len(pending) < STREAM_WINDOW:
+                next_barcode = asyncio.ensure_future(_next_or_none(barcodes))
+            waiting = pending | ({next_barcode} if next_barcode else set())
+            if not waiting:
+                break
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            
+            if next_barcode in done:
+                barcode = next_barcode.result()
+                if barcode is None:
+                    exhausted = True
+                else:
+                    pending.add(asyncio.ensure_future(resolve_scan_item(barcode)))
+                next_barcode = None
+            
+            for task in done & pending:
+                pending.discard(task)
+                yield task.result().model_dump_json().encode() + b"\n"
+    finally:
+        for task in pending | ({next_barcode} if next_barcode else set()):
+            task.cancel()
+
+
+@app.post("/scan/stream")
+async def scan_stream(request: Request) -> StreamingResponse:
+    """
+    Scan an unbounded list of barcodes and stream results as NDJSON.
+    
+    Accepts {"barcodes": [...]} as JSON, or a streamed body with one barcode
+    (or {"barcode": ...} object) per line. Each output line has the same
+    shape as a /scan/batch item and is written as soon as it resolves.
+    """
+    body_done = asyncio.Event()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        barcodes = body.get("barcodes") if isinstance(body, dict) else body
+        if not isinstance(barcodes, list):
+            raise HTTPException(status_code=422, detail="Expected a list of barcodes")
+        body_done.set()
+        source = _iter_list(barcodes)
+    else:
+        source = _iter_body_lines(request, body_done)
+    
+    return DuplexStreamingResponse(
+        stream_scan_results(source), body_done=body_done, media_type="application/x-ndjson"
+    )
+
+
 @app.get("/health")
 def health():
     """Health check endpoint."""
     return {"status": "ok", "rules_version": RULES_VERSION}
 
 
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Returns scan cache counters (hits, misses, evictions, size), the upstream
+    circuit breaker and admission counters, and re-scoring progress.
+    """
+    stats = get_cache_stats()
+    stats["stale"] = dict(_stale_stats)
+    stats["upstream"] = get_upstream_guard().stats()
+    stats["maintenance"] = get_last_report()
+    if _rescore_job is not None:
+        stats["rescore"] = _rescore_job.stats()
+    return stats
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    """Scan pipeline metrics (stage latencies, cache lookups, upstream statuses) in Prometheus text format."""
+    UPSTREAM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[get_upstream_guard().breaker.state])
+    # Passed as a header: media_type would get a second charset appended
+    return Response(render_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
 @app.get("/rules/metadata")
-def rules_metadata():
-    """Returns metadata about the risk classification rules."""
-    return get_rules_metadata()
\ No newline at end of file
+def rules_metadata(if_none_match: Annotated[Optional[str], Header()] = None) -> Response:
+    """Returns metadata about the risk classification rules (304 if unchanged)."""
+    if etag_matches(if_none_match, RULES_METADATA_ETAG):
+        return not_modified(RULES_METADATA_ETAG, RULES_METADATA_CACHE_CONTROL)
+    return JSONResponse(
+        get_rules_metadata(),
+        headers={"ETag": RULES_METADATA_ETAG, "Cache-Control": RULES_METADATA_CACHE_CONTROL},
+    )
\ No newline at end of file
@@ -0,0 +1 @@
+"""SafeEats Backend Benchmarks"""
@@ -0,0 +1,108 @@
+"""
+Benchmark: event-loop lag with sync vs async database access.
+
+Runs many concurrent "cache miss" workloads (SQLite read + write) against a
+temporary database while a ticker task measures how late the event loop
+wakes up. Blocking SQLite calls on the loop show up as large lag spikes.
+
+Run from the backend directory:
+    python benchmarks/bench_db_loop_lag.py --tasks 2000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import db  # noqa: E402
+
+TICK_S = 0.001
+
+RESPONSE = {
+    "product_name": "Benchmark Product",
+    "ingredients": [
+        {"raw": f"ingredient {i}", "canonical": f"ingredient {i}", "risk": "safe", "source": None, "notes": None}
+        for i in range(30)
+    ],
+    "overall_risk": "safe",
+    "cached": False,
+    "rules_version": "1.0.0",
+}
+
+
+async def measure_lag(stop: asyncio.Event, samples: list[float]) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_S)
+        samples.append(time.perf_counter() - start - TICK_S)
+
+
+async def sync_miss(barcode: str) -> None:
+    db.get_cached_scan(barcode)
+    db.cache_scan(barcode, RESPONSE)
+
+
+async def async_miss(barcode: str) -> None:
+    await db.get_cached_scan_async(barcode)
+    await db.cache_scan_async(barcode, RESPONSE)
+
+
+async def run(workload, tasks: int, concurrency: int, offset: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    lag: list[float] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            await workload(str(10000000 + offset + i))
+
+    ticker = asyncio.create_task(measure_lag(stop, lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(tasks)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    lag.sort()
+    return {
+        "ops_per_s": tasks / elapsed,
+        "lag_p50_ms": lag[len(lag) // 2] * 1000 if lag else 0.0,
+        "lag_p99_ms": lag[int(len(lag) * 0.99)] * 1000 if lag else 0.0,
+        "lag_max_ms": lag[-1] * 1000 if lag else 0.0,
+        "ticks": len(lag),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.DB_PATH = Path(path)
+    db.init_db()
+    try:
+        results = {
+            "sync (on event loop)": await run(sync_miss, args.tasks, args.concurrency, 0),
+            "async (db threads)": await run(async_miss, args.tasks, args.concurrency, args.tasks),
+        }
+    finally:
+        db.shutdown_executors()
+        os.remove(path)
+
+    print(f"{args.tasks} cache-miss workloads, concurrency {args.concurrency}")
+    for name, r in results.items():
+        print(
+            f"  {name:<22} {r['ops_per_s']:8.1f} ops/s  loop lag "
+            f"p50 {r['lag_p50_ms']:6.2f}ms  p99 {r['lag_p99_ms']:6.2f}ms  max {r['lag_max_ms']:6.2f}ms"
+            f"  ({r['ticks']} ticks)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark: fuzzy ingredient resolution.
+
+Times cold (uncached) and memoized lookups against the app's index over
+every ingredient in the corpus plus a set of common misspellings, and
+reports how many resolved fuzzily.
+
+Run from the backend directory:
+    python benchmarks/bench_fuzzy.py --repeat 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import FUZZY_INDEX, parse_ingredients  # noqa: E402
+from benchmarks.bench_parse_ingredients import load_corpus  # noqa: E402
+
+MISSPELLINGS = [
+    "aspartam",
+    "sodium benzoat",
+    "tartrazin",
+    "monosodium glutamat",
+    "high fructose corn syrop",
+    "sodium nitrit",
+    "potasium sorbate",
+    "carageenan",
+]
+
+
+def main(args: argparse.Namespace) -> None:
+    words = sorted({w for text in load_corpus() for w in parse_ingredients(text)} | set(MISSPELLINGS))
+    matched = [w for w in words if FUZZY_INDEX.lookup(w)]
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for word in words:
+            FUZZY_INDEX._lookup(word)
+    cold = (time.perf_counter() - start) / (args.repeat * len(words))
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for word in words:
+            FUZZY_INDEX.lookup(word)
+    warm = (time.perf_counter() - start) / (args.repeat * len(words))
+
+    # Worst single word, uncached
+    worst = max(
+        (min(_time_one(word) for _ in range(20)), word) for word in words
+    )
+
+    print(f"{len(FUZZY_INDEX)} indexed names, {len(words)} distinct words, {len(matched)} matched")
+    print(f"  uncached  {cold * 1e6:8.1f} us/lookup")
+    print(f"  memoized  {warm * 1e6:8.1f} us/lookup")
+    print(f"  worst     {worst[0] * 1e6:8.1f} us  ({worst[1]!r})")
+
+
+def _time_one(word: str) -> float:
+    start = time.perf_counter()
+    FUZZY_INDEX._lookup(word)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""
+Benchmark: /scan throughput for hot-cache hits.
+
+Warms the hot cache with scored products, then drives POST /scan through
+the ASGI app in-process at a fixed concurrency and reports requests per
+second and response bytes for:
+
+  model path      hit rebuilt as a dict, validated into ScanResponse and
+                  re-serialized by FastAPI (the path before pre-serialized
+                  bodies)
+  pre-serialized  stored body sent as-is
+  pre-serialized + gzip   stored gzip copy sent as-is
+
+Run from the backend directory:
+    python benchmarks/bench_hot_scan.py --requests 20000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx  # noqa: E402
+
+import app as app_module  # noqa: E402
+import db  # noqa: E402
+from benchmarks.bench_parse_ingredients import load_corpus  # noqa: E402
+from benchmarks.fake_off import SAMPLE_INGREDIENTS  # noqa: E402
+
+
+def warm_cache(products: int) -> list[str]:
+    """Caches one scored product per barcode and returns the barcodes."""
+    texts = [*load_corpus(), SAMPLE_INGREDIENTS]
+    barcodes = [str(10000000 + i) for i in range(products)]
+    for i, barcode in enumerate(barcodes):
+        db.cache_scan(barcode, app_module.score_product(f"Product {i}", texts[i % len(texts)]))
+    return barcodes
+
+
+async def run(barcodes: list[str], requests: int, concurrency: int, accept_encoding: str) -> dict:
+    transport = httpx.ASGITransport(app=app_module.app)
+    headers = {"Accept-Encoding": accept_encoding}
+    wire_bytes = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        async def worker(offset: int) -> None:
+            nonlocal wire_bytes
+            for i in range(offset, requests, concurrency):
+                response = await client.post("/scan", json={"barcode": barcodes[i % len(barcodes)]})
+                assert response.status_code == 200 and response.json()["cached"] is True
+                wire_bytes += int(response.headers["content-length"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(c) for c in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"req_per_s": requests / elapsed, "avg_bytes": wire_bytes / requests}
+
+
+async def main(args: argparse.Namespace) -> None:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.DB_PATH = Path(path)
+    db.init_db()
+    try:
+        barcodes = warm_cache(args.products)
+        fast_path = app_module.get_hot_encoded_scan
+        app_module.get_hot_encoded_scan = lambda barcode: None
+        results = {"model path": await run(barcodes, args.requests, args.concurrency, "identity")}
+        app_module.get_hot_encoded_scan = fast_path
+        results["pre-serialized"] = await run(barcodes, args.requests, args.concurrency, "identity")
+        results["pre-serialized + gzip"] = await run(barcodes, args.requests, args.concurrency, "gzip")
+    finally:
+        db.shutdown_executors()
+        os.remove(path)
+
+    print(f"{args.requests} hot-cache /scan requests over {args.products} products, concurrency {args.concurrency}")
+    baseline = results["model path"]["req_per_s"]
+    for name, r in results.items():
+        print(
+            f"  {name:<22} {r['req_per_s']:8.1f} req/s ({r['req_per_s'] / baseline:4.2f}x)"
+            f"  {r['avg_bytes']:6.0f} bytes/response"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--products", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
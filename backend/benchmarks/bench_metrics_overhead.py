@@ -0,0 +1,85 @@
+"""
+Benchmark: cost of the /scan pipeline metrics.
+
+Measures the instrumentation itself (what a hot-cache hit records, and a
+timed stage on the slower paths) in nanoseconds, then hot-cache /scan
+throughput with metrics recording on and off (SAFEEATS_METRICS=0).
+
+Run from the backend directory:
+    python benchmarks/bench_metrics_overhead.py --requests 20000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import db  # noqa: E402
+import metrics  # noqa: E402
+from benchmarks.bench_hot_scan import warm_cache, run  # noqa: E402
+
+
+def per_call_ns(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e9
+
+
+def hot_path_instrumentation() -> None:
+    """What scan() records for a pre-serialized hot-cache hit."""
+    start = time.perf_counter()
+    metrics.CACHE_LOOKUPS.inc("hot")
+    metrics.SCAN_SECONDS.observe(time.perf_counter() - start, "hot")
+
+
+def timed_stage() -> None:
+    with metrics.STAGE_SECONDS.time("validate"):
+        pass
+
+
+def micro(repeat: int) -> None:
+    print(f"instrumentation cost ({repeat:,} calls)")
+    for name, fn in (("hot-cache hit", hot_path_instrumentation), ("timed stage", timed_stage)):
+        metrics.METRICS_ENABLED = True
+        enabled = per_call_ns(fn, repeat)
+        metrics.METRICS_ENABLED = False
+        disabled = per_call_ns(fn, repeat)
+        print(f"  {name:<14} {enabled:7.0f} ns enabled  {disabled:7.0f} ns disabled")
+    metrics.METRICS_ENABLED = True
+
+
+async def macro(args: argparse.Namespace) -> None:
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.DB_PATH = Path(path)
+    db.init_db()
+    try:
+        barcodes = warm_cache(args.products)
+        results = {}
+        for name, enabled in (("metrics off", False), ("metrics on", True), ("metrics off ", False), ("metrics on ", True)):
+            metrics.METRICS_ENABLED = enabled
+            results[name] = await run(barcodes, args.requests, args.concurrency, "identity")
+    finally:
+        db.shutdown_executors()
+        os.remove(path)
+
+    print(f"{args.requests} hot-cache /scan requests, concurrency {args.concurrency} (alternating runs)")
+    for name, r in results.items():
+        print(f"  {name:<13} {r['req_per_s']:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200000)
+    args = parser.parse_args()
+    micro(args.repeat)
+    asyncio.run(macro(args))
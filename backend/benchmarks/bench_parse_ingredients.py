@@ -0,0 +1,89 @@
+"""
+Micro-benchmark: parse_ingredients vs the previous four-regex chain,
+over a corpus of real-world long ingredient strings.
+
+Also checks that both produce the same set of ingredients on the corpus.
+
+Run from the backend directory:
+    python benchmarks/bench_parse_ingredients.py --repeat 2000
+"""
+
+import argparse
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import parse_ingredients  # noqa: E402
+
+CORPUS_PATH = Path(__file__).parent / "data" / "ingredients_corpus.txt"
+
+
+def parse_ingredients_regex_chain(ingredients_text: Optional[str]) -> list[str]:
+    """The previous implementation, kept for comparison."""
+    if not ingredients_text:
+        return []
+    cleaned = ingredients_text.lower()
+    cleaned = re.sub(r"\([^)]*\)", " ", cleaned)
+    cleaned = re.sub(r"\[[^\]]*\]", " ", cleaned)
+    cleaned = re.sub(r"\d+\.?\d*\s*%", "", cleaned)
+    parts = re.split(r"[,;.]", cleaned)
+    ingredients = []
+    for part in parts:
+        ingredient = part.strip()
+        if ingredient and len(ingredient) > 1:
+            ingredients.append(ingredient)
+    return list(set(ingredients))
+
+
+def load_corpus() -> list[str]:
+    return [line for line in CORPUS_PATH.read_text().splitlines() if line.strip()]
+
+
+def time_parser(parser, corpus: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            parser(text)
+    return (time.perf_counter() - start) / (repeat * len(corpus))
+
+
+def peak_allocation(parser, corpus: list[str]) -> int:
+    tracemalloc.start()
+    for text in corpus:
+        parser(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(args: argparse.Namespace) -> None:
+    corpus = load_corpus()
+
+    # Flat (non-nested) brackets: both parsers must agree
+    mismatches = [
+        text for text in corpus
+        if not re.search(r"\([^)]*\(", text)
+        and set(parse_ingredients(text)) != set(parse_ingredients_regex_chain(text))
+    ]
+
+    results = {
+        "regex chain": parse_ingredients_regex_chain,
+        "parse_ingredients": parse_ingredients,
+    }
+    print(f"{len(corpus)} ingredient strings x {args.repeat} repeats")
+    for name, parser in results.items():
+        per_call = time_parser(parser, corpus, args.repeat)
+        peak = peak_allocation(parser, corpus)
+        print(f"  {name:<22} {per_call * 1e6:7.2f} us/string  peak alloc {peak / 1024:6.1f} KiB")
+    print(f"  differing results on non-nested inputs: {len(mismatches)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1000)
+    main(parser.parse_args())
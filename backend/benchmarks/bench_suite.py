@@ -0,0 +1,382 @@
+"""
+Benchmark suite: end-to-end /scan load tests plus micro-benchmarks, saved
+as JSON so runs can be compared between commits.
+
+Load tests start the app with uvicorn in a subprocess, on a fresh database
+and pointed at a local Open Food Facts stand-in (fake_off.py) with the
+given latency, error rate and payload size. /scan is then driven at each
+concurrency level with three workloads:
+
+  hot    repeat scans of products already in the hot cache
+  cold   every scan is a barcode the server has not seen (fetch, classify, store)
+  mixed  --hot-ratio of scans repeat cached products, the rest are new
+
+Each run reports req/s and p50/p95/p99 latency. Micro-benchmarks time
+parse_ingredients, normalize_ingredient, get_risk_with_source and the
+cache functions in-process. Barcode order and injected upstream failures
+come from seeded generators, so repeated runs issue the same requests.
+
+Run from the backend directory:
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --concurrency 1,16,64 --requests 2000 --output before.json
+    python benchmarks/bench_suite.py --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import db  # noqa: E402
+from app import parse_ingredients, normalize_ingredient, score_product  # noqa: E402
+from benchmarks.bench_parse_ingredients import load_corpus  # noqa: E402
+from benchmarks.fake_off import FakeOpenFoodFacts, SAMPLE_INGREDIENTS  # noqa: E402
+from hotcache import HotCache  # noqa: E402
+from rules import get_risk_with_source  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+WORKLOADS = ("hot", "cold", "mixed")
+
+
+# =============================================================================
+# RUN METADATA
+# =============================================================================
+
+def git_revision() -> dict:
+    """Current commit and whether the backend has uncommitted changes."""
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", "."))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def run_metadata(args: argparse.Namespace) -> dict:
+    return {
+        **git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+    }
+
+
+# =============================================================================
+# LOAD TESTS
+# =============================================================================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def app_server(upstream_url: str) -> Iterator[str]:
+    """Runs the app under uvicorn on a temporary database; yields its base URL."""
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            SAFEEATS_DB_PATH=str(Path(tmp) / "bench.db"),
+            SAFEEATS_OPEN_FOOD_FACTS_URL=upstream_url,
+            # Keep background jobs out of the measurements
+            SAFEEATS_RESCORE_ON_STARTUP="0",
+            SAFEEATS_MAINTENANCE_INTERVAL_SECONDS="0",
+        )
+        env.pop("TESTING", None)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=BACKEND_DIR,
+            env=env,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+                try:
+                    if httpx.get(base_url + "/health").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not become ready")
+                time.sleep(0.1)
+            yield base_url
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+class Barcodes:
+    """Hands out barcodes the server has never seen."""
+
+    def __init__(self, start: int = 2_000_000_000_000):
+        self._next = start
+
+    def new(self, count: int) -> list[str]:
+        barcodes = [str(self._next + i) for i in range(count)]
+        self._next += count
+        return barcodes
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+async def drive(client: httpx.AsyncClient, barcodes: list[str], concurrency: int) -> dict:
+    """Sends one /scan per barcode from concurrency closed-loop workers."""
+    pending = iter(barcodes)
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+
+    async def worker() -> None:
+        for barcode in pending:
+            start = time.perf_counter()
+            response = await client.post("/scan", json={"barcode": barcode})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(latencies) - statuses[200],
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "req_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def warm(client: httpx.AsyncClient, barcodes: list[str]) -> None:
+    """Scans every barcode until it is cached (retrying injected upstream failures)."""
+    semaphore = asyncio.Semaphore(16)
+
+    async def scan(barcode: str) -> int:
+        async with semaphore:
+            return (await client.post("/scan", json={"barcode": barcode})).status_code
+
+    for _ in range(10):
+        statuses = await asyncio.gather(*(scan(b) for b in barcodes))
+        barcodes = [b for b, status in zip(barcodes, statuses) if status != 200]
+        if not barcodes:
+            return
+    raise RuntimeError(f"{len(barcodes)} products could not be cached; lower --error-rate")
+
+
+def workload_barcodes(workload: str, hot: list[str], fresh: Barcodes, count: int, hot_ratio: float, rng: random.Random) -> list[str]:
+    if workload == "hot":
+        return [rng.choice(hot) for _ in range(count)]
+    if workload == "cold":
+        return fresh.new(count)
+    return [rng.choice(hot) if rng.random() < hot_ratio else fresh.new(1)[0] for _ in range(count)]
+
+
+async def run_load(args: argparse.Namespace) -> list[dict]:
+    fake = FakeOpenFoodFacts(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        payload_bytes=args.payload_bytes,
+        seed=args.seed,
+    ).start()
+    rng = random.Random(args.seed)
+    fresh = Barcodes()
+    results = []
+    try:
+        with app_server(fake.product_url) as base_url:
+            limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+                hot = fresh.new(args.products)
+                await warm(client, hot)
+                for concurrency in args.concurrency:
+                    for workload in args.workloads:
+                        barcodes = workload_barcodes(workload, hot, fresh, args.requests, args.hot_ratio, rng)
+                        result = {"workload": workload, "concurrency": concurrency, **await drive(client, barcodes, concurrency)}
+                        results.append(result)
+                        print(
+                            f"  {workload:<6} c={concurrency:<4} {result['req_per_s']:8.1f} req/s  "
+                            f"p50 {result['p50_ms']:7.2f}ms  p95 {result['p95_ms']:7.2f}ms  "
+                            f"p99 {result['p99_ms']:7.2f}ms  errors {result['errors']}"
+                        )
+    finally:
+        fake.stop()
+    return results
+
+
+# =============================================================================
+# MICRO-BENCHMARKS
+# =============================================================================
+
+def time_per_call(fn: Callable, inputs: list, rounds: int, min_round_s: float = 0.1) -> float:
+    """Median microseconds per fn(input) call over rounds, each at least min_round_s long."""
+    passes = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(passes):
+            for item in inputs:
+                fn(item)
+        if time.perf_counter() - start >= min_round_s:
+            break
+        passes *= 2
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(passes):
+            for item in inputs:
+                fn(item)
+        samples.append((time.perf_counter() - start) / (passes * len(inputs)))
+    return round(statistics.median(samples) * 1e6, 3)
+
+
+def run_micro(args: argparse.Namespace) -> dict:
+    texts = [*load_corpus(), SAMPLE_INGREDIENTS]
+    tokens = [token for text in texts for token in parse_ingredients(text)]
+    canonicals = [normalize_ingredient(token) for token in tokens]
+
+    results = {
+        "parse_ingredients": time_per_call(parse_ingredients, texts, args.rounds),
+        "normalize_ingredient": time_per_call(normalize_ingredient, tokens, args.rounds),
+        "get_risk_with_source": time_per_call(get_risk_with_source, canonicals, args.rounds),
+    }
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    db.DB_PATH = Path(path)
+    db.init_db()
+    try:
+        barcodes = [str(10_000_000 + i) for i in range(200)]
+        responses = {b: score_product(f"Product {b}", texts[i % len(texts)]) for i, b in enumerate(barcodes)}
+        chunks = [barcodes[i:i + 50] for i in range(0, len(barcodes), 50)]
+
+        results["db.cache_scan"] = time_per_call(lambda b: db.cache_scan(b, responses[b]), barcodes, args.rounds)
+        results["db.cache_scans (50)"] = time_per_call(
+            lambda chunk: db.cache_scans({b: responses[b] for b in chunk}), chunks, args.rounds
+        )
+        results["db.get_cached_scan (hot)"] = time_per_call(db.get_cached_scan, barcodes, args.rounds)
+        # A zero-byte hot cache stores nothing, so every lookup reads SQLite
+        hot_cache = db._hot_cache
+        db._hot_cache = HotCache(max_bytes=0, ttl_seconds=hot_cache.ttl_seconds)
+        try:
+            results["db.get_cached_scan (sqlite)"] = time_per_call(db.get_cached_scan, barcodes, args.rounds)
+            results["db.get_cached_scans (50, sqlite)"] = time_per_call(db.get_cached_scans, chunks, args.rounds)
+        finally:
+            db._hot_cache = hot_cache
+    finally:
+        db.shutdown_executors()
+        os.remove(path)
+
+    for name, us in results.items():
+        print(f"  {name:<34} {us:10.3f} us/call")
+    return results
+
+
+# =============================================================================
+# COMPARISON
+# =============================================================================
+
+def _change(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+6.1f}%" if old else "   n/a"
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Prints each result next to the same measurement in a baseline file."""
+    print(f"vs baseline {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    old_runs = {(r["workload"], r["concurrency"]): r for r in baseline.get("load", [])}
+    for run in current.get("load", []):
+        old = old_runs.get((run["workload"], run["concurrency"]))
+        if old is not None:
+            print(
+                f"  {run['workload']:<6} c={run['concurrency']:<4} req/s {_change(run['req_per_s'], old['req_per_s'])}  "
+                f"p99 {_change(run['p99_ms'], old['p99_ms'])}"
+            )
+    old_micro = baseline.get("micro", {})
+    for name, us in current.get("micro", {}).items():
+        if name in old_micro:
+            print(f"  {name:<34} {_change(us, old_micro[name])}")
+
+
+def main(args: argparse.Namespace) -> None:
+    report = {"meta": run_metadata(args)}
+    if not args.skip_load:
+        print(
+            f"Load: {args.requests} requests per run, upstream {args.latency_ms}ms, "
+            f"{args.error_rate:.1%} errors, {args.payload_bytes:,}-byte documents"
+        )
+        report["load"] = asyncio.run(run_load(args))
+    if not args.skip_micro:
+        print("Micro-benchmarks:")
+        report["micro"] = run_micro(args)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{report['meta']['commit'] or 'unknown'}.json"
+    Path(output).write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Saved {output}")
+
+    if args.baseline:
+        compare(report, json.loads(Path(args.baseline).read_text()))
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def _workload_list(value: str) -> list[str]:
+    workloads = value.split(",")
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown workloads: {', '.join(sorted(unknown))}")
+    return workloads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 16, 64], help="comma-separated levels")
+    parser.add_argument("--workloads", type=_workload_list, default=list(WORKLOADS), help="comma-separated subset of hot,cold,mixed")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per workload and concurrency level")
+    parser.add_argument("--products", type=int, default=200, help="cached products the hot workload draws from")
+    parser.add_argument("--hot-ratio", type=float, default=0.9, help="share of cached products in the mixed workload")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="fake upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests failing with 500")
+    parser.add_argument("--payload-bytes", type=int, default=20_000, help="approximate upstream document size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=5, help="timing rounds per micro-benchmark (median is kept)")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    main(parser.parse_args())
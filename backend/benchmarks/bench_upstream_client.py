@@ -0,0 +1,95 @@
+"""
+Benchmark: per-request AsyncClient vs the shared pooled upstream client.
+
+Runs fetch_product against a local Open Food Facts stand-in and reports
+throughput and latency percentiles for both strategies.
+
+Run from the backend directory:
+    python benchmarks/bench_upstream_client.py --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import upstream  # noqa: E402
+from benchmarks.fake_off import FakeOpenFoodFacts  # noqa: E402
+
+
+async def fetch_with_new_client(url: str) -> dict:
+    """The previous behaviour: a fresh client (and connection) per fetch."""
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_with_shared_client(url: str) -> dict:
+    response = await upstream.get_http_client().get(url)
+    response.raise_for_status()
+    return response.json()
+
+
+async def run(fetch, url_template: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int) -> None:
+        url = url_template.format(barcode=f"{10000000 + i}")
+        async with semaphore:
+            start = time.perf_counter()
+            await fetch(url)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "req_per_s": total / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = FakeOpenFoodFacts(latency_ms=args.latency_ms).start()
+    try:
+        results = {}
+        results["new client per request"] = await run(
+            fetch_with_new_client, server.product_url, args.requests, args.concurrency
+        )
+        await upstream.start_http_client()
+        try:
+            results["shared pooled client"] = await run(
+                fetch_with_shared_client, server.product_url, args.requests, args.concurrency
+            )
+        finally:
+            await upstream.close_http_client()
+    finally:
+        server.stop()
+
+    print(f"{args.requests} fetches, concurrency {args.concurrency}, upstream latency {args.latency_ms}ms")
+    for name, r in results.items():
+        print(
+            f"  {name:<24} {r['req_per_s']:8.1f} req/s  "
+            f"p50 {r['p50_ms']:6.2f}ms  p95 {r['p95_ms']:6.2f}ms  p99 {r['p99_ms']:6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    asyncio.run(main(parser.parse_args()))
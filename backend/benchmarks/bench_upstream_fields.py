@@ -0,0 +1,93 @@
+"""
+Benchmark: bytes transferred and decode time per cache miss.
+
+Runs fetch_product against a local Open Food Facts stand-in serving
+padded product documents and compares three settings: the full document
+decoded in one go (what every miss used to cost), the full document
+parsed incrementally (stopping once the name and ingredients are known),
+and only the fields a scan reads requested with ?fields=. Reports bytes
+read per miss, decode time per miss and fetch latency.
+
+Run from the backend directory:
+    python benchmarks/bench_upstream_fields.py --requests 500 --payload-bytes 50000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import app as app_module  # noqa: E402
+import metrics  # noqa: E402
+import upstream  # noqa: E402
+from benchmarks.fake_off import FakeOpenFoodFacts  # noqa: E402
+
+SETTINGS = {
+    "full document": {"OPEN_FOOD_FACTS_FIELDS": "", "UPSTREAM_STREAM_THRESHOLD": float("inf")},
+    "full, incremental": {"OPEN_FOOD_FACTS_FIELDS": "", "UPSTREAM_STREAM_THRESHOLD": 0},
+    "needed fields": {},
+}
+
+
+async def run(total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            data = await app_module.fetch_product(f"{10000000 + i}")
+            latencies.append(time.perf_counter() - start)
+            assert data["product"]["ingredients_text"]
+
+    metrics.reset_metrics()
+    await asyncio.gather(*(one(i) for i in range(total)))
+
+    latencies.sort()
+    return {
+        "bytes": metrics.UPSTREAM_RESPONSE_BYTES.get() / total,
+        "decode_us": metrics.STAGE_SECONDS.get_sum("decode") / total * 1e6,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = FakeOpenFoodFacts(latency_ms=args.latency_ms, payload_bytes=args.payload_bytes).start()
+    app_module.OPEN_FOOD_FACTS_URL = server.product_url
+    defaults = {name: getattr(app_module, name) for name in ("OPEN_FOOD_FACTS_FIELDS", "UPSTREAM_STREAM_THRESHOLD")}
+    results = {}
+    try:
+        for name, changes in SETTINGS.items():
+            for setting, value in {**defaults, **changes}.items():
+                setattr(app_module, setting, value)
+            await upstream.start_http_client()
+            try:
+                await run(args.concurrency, args.concurrency)  # warm up the connection pool
+                results[name] = await run(args.requests, args.concurrency)
+            finally:
+                await upstream.close_http_client()
+    finally:
+        server.stop()
+
+    print(
+        f"{args.requests} misses, concurrency {args.concurrency}, upstream {args.latency_ms:g}ms, "
+        f"documents of ~{args.payload_bytes} bytes"
+    )
+    for name, r in results.items():
+        print(
+            f"  {name:<18} {r['bytes']:9.0f} bytes/miss  decode {r['decode_us']:7.1f}us/miss  "
+            f"p50 {r['p50_ms']:6.2f}ms  p99 {r['p99_ms']:6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--payload-bytes", type=int, default=50_000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,111 @@
+"""
+Benchmark: upstream tail latency and load with retries and hedging.
+
+Runs fetch_product (inside a scan deadline) against a local Open Food
+Facts stand-in that fails a share of requests with a 503 and answers
+another share slowly, and compares three settings: no retries, retries
+with jittered backoff, and retries plus hedged requests. Reports the
+share of fetches that succeeded, latency percentiles and how many
+upstream requests each fetch cost.
+
+Run from the backend directory:
+    python benchmarks/bench_upstream_tail.py --requests 1000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import app as app_module  # noqa: E402
+import upstream  # noqa: E402
+from benchmarks.fake_off import FakeOpenFoodFacts  # noqa: E402
+from resilience import deadline_scope  # noqa: E402
+
+SETTINGS = {
+    "no retries": {"retries": 0, "hedge": False},
+    "retries": {"retries": 2, "hedge": False},
+    "retries + hedging": {"retries": 2, "hedge": True},
+}
+
+
+async def run(server: FakeOpenFoodFacts, total: int, concurrency: int, deadline: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors: dict[int, int] = {}
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                with deadline_scope(deadline):
+                    await app_module.fetch_product(f"{10000000 + i}")
+            except HTTPException as e:
+                errors[e.status_code] = errors.get(e.status_code, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    before = server.stats()["requests"]
+    await asyncio.gather(*(one(i) for i in range(total)))
+    sent = server.stats()["requests"] - before
+
+    latencies.sort()
+    return {
+        "success": 1 - sum(errors.values()) / total,
+        "errors": errors,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "upstream_per_fetch": sent / total,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = FakeOpenFoodFacts(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        error_status=503,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        seed=args.seed,
+    ).start()
+    app_module.OPEN_FOOD_FACTS_URL = server.product_url
+    results = {}
+    try:
+        for name, changes in SETTINGS.items():
+            await upstream.start_http_client()
+            guard = upstream.get_upstream_guard()
+            guard.retry_policy = guard.retry_policy._replace(**changes)
+            try:
+                results[name] = await run(server, args.requests, args.concurrency, args.deadline)
+            finally:
+                await upstream.close_http_client()
+    finally:
+        server.stop()
+
+    print(
+        f"{args.requests} fetches, concurrency {args.concurrency}, upstream {args.latency_ms:g}ms, "
+        f"{args.error_rate:.0%} 503s, {args.slow_rate:.0%} at {args.slow_ms:g}ms, deadline {args.deadline:g}s"
+    )
+    for name, r in results.items():
+        print(
+            f"  {name:<18} ok {r['success']:7.2%}  p50 {r['p50_ms']:6.1f}ms  p95 {r['p95_ms']:6.1f}ms  "
+            f"p99 {r['p99_ms']:6.1f}ms  upstream/fetch {r['upstream_per_fetch']:.3f}  errors {r['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.03)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=400.0)
+    parser.add_argument("--deadline", type=float, default=app_module.SCAN_DEADLINE_SECONDS)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Benchmark: compact verdict encoding vs the previous TEXT JSON storage.
+
+Scores the ingredients corpus (plus the fake Open Food Facts sample)
+under the current rules, then compares per-row size, encode and decode
+time, and the size of a SQLite table holding --rows verdicts in each
+format.
+
+Run from the backend directory:
+    python benchmarks/bench_verdict_encoding.py --repeat 2000 --rows 20000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import score_product  # noqa: E402
+from benchmarks.bench_parse_ingredients import load_corpus  # noqa: E402
+from benchmarks.fake_off import SAMPLE_INGREDIENTS  # noqa: E402
+from codec import encode_response, decode_response  # noqa: E402
+
+FORMATS = {
+    "TEXT JSON": (lambda r: json.dumps(r), json.loads),
+    "compact BLOB": (encode_response, decode_response),
+}
+
+
+def load_responses() -> list[dict]:
+    responses = []
+    for i, text in enumerate([*load_corpus(), SAMPLE_INGREDIENTS]):
+        response = score_product(f"Product {i}", text)
+        del response["cached"]
+        responses.append(response)
+    return responses
+
+
+def per_call(fn, items: list, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(items))
+
+
+def table_bytes(values: list, rows: int) -> int:
+    """Size of a SQLite file holding rows verdicts cycling through values."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE verdicts (barcode TEXT PRIMARY KEY, response) WITHOUT ROWID")
+        with conn:
+            conn.executemany(
+                "INSERT INTO verdicts VALUES (?, ?)",
+                ((str(10000000 + i), values[i % len(values)]) for i in range(rows))
+            )
+        conn.execute("VACUUM")
+        conn.close()
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def main(args: argparse.Namespace) -> None:
+    responses = load_responses()
+    print(f"{len(responses)} scored products, {args.repeat} repeats, {args.rows:,}-row tables")
+    print(f"  {'format':<14} {'avg bytes':>10} {'encode us':>10} {'decode us':>10} {'table MiB':>10}")
+    for name, (encode, decode) in FORMATS.items():
+        encoded = [encode(r) for r in responses]
+        assert all(decode(e) == r for e, r in zip(encoded, responses))
+        size = sum(len(e) for e in encoded) / len(encoded)
+        encode_us = per_call(encode, responses, args.repeat) * 1e6
+        decode_us = per_call(decode, encoded, args.repeat) * 1e6
+        table_mib = table_bytes(encoded, args.rows) / 2**20
+        print(f"  {name:<14} {size:10.0f} {encode_us:10.1f} {decode_us:10.1f} {table_mib:10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,189 @@
+"""
+Local stand-in for the Open Food Facts product API.
+
+Serves /api/v2/product/{barcode}.json from a background thread so
+benchmarks can exercise the real HTTP path without touching the network.
+Latency, the share of requests failing (with a 500 by default) and the
+size of each product document are configurable, as is a slow tail: a
+share of requests that take slow_ms instead. Failures and slow requests
+are drawn from a seeded generator so runs are repeatable.
+
+Like the real API, documents are sent with their keys sorted and honour
+a fields=a,b,... query parameter by returning only those product fields.
+
+Usage:
+    server = FakeOpenFoodFacts(latency_ms=20, error_rate=0.01, payload_bytes=20_000)
+    server.start()
+    url = server.product_url  # drop-in for OPEN_FOOD_FACTS_URL
+    ...
+    server.stop()
+"""
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+PRODUCT_PATH = re.compile(r"^/api/v2/product/(\d+)\.json")
+
+SAMPLE_INGREDIENTS = (
+    "sugar, palm oil, hazelnuts (13%), skimmed milk powder (8.7%), "
+    "fat-reduced cocoa (7.4%), emulsifier: lecithins (soya), vanillin, "
+    "aspartame, sodium benzoate, e150d"
+)
+
+
+def make_product(barcode: str, payload_bytes: int = 0, fields: Optional[list[str]] = None) -> dict:
+    """
+    Builds an Open Food Facts product document. With payload_bytes, the
+    product is padded with fields the app does not use (as real documents
+    carry nutriments, images and so on) to roughly that many bytes of JSON:
+    three quarters in "nutriments", which sorts before "product_name", and
+    the rest in "selected_images", which sorts after it. With fields, the
+    product only has those fields.
+    """
+    product = {
+        "product_name": f"Benchmark Product {barcode}",
+        "ingredients_text": SAMPLE_INGREDIENTS,
+    }
+    # Each padding field is about 30 bytes of JSON
+    padding = max(0, payload_bytes - len(json.dumps(product)) - 80) // 30
+    if padding:
+        before = padding * 3 // 4
+        product["nutriments"] = {f"nutrient_{i:05d}_100g": 12.345 for i in range(before)}
+        product["selected_images"] = {f"image_{i:05d}_400": 12.345 for i in range(padding - before)}
+    if fields is not None:
+        product = {name: value for name, value in product.items() if name in fields}
+    return {
+        "code": barcode,
+        "product": dict(sorted(product.items())),
+        "status": 1,
+        "status_verbose": "product found",
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY the body
+    # waits on the client's delayed ACK (~40ms per request)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server: "_Server" = self.server  # type: ignore[assignment]
+        failed, slow = server.draw()
+        latency_s = server.slow_s if slow else server.latency_s
+        if latency_s:
+            time.sleep(latency_s)
+
+        url = urlsplit(self.path)
+        match = PRODUCT_PATH.match(url.path)
+        fields = parse_qs(url.query).get("fields")
+        status = 200
+        if failed:
+            status, body = server.error_status, b'{"error": "injected failure"}'
+        elif match is None:
+            body = b'{"status": 0}'
+        else:
+            document = make_product(match.group(1), server.payload_bytes, fields[0].split(",") if fields else None)
+            body = json.dumps(document).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs when many clients connect at once,
+    # which shows up as ~1s connect retransmits in the latency tail
+    request_queue_size = 128
+    latency_s: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    slow_rate: float = 0.0
+    slow_s: float = 0.0
+    payload_bytes: int = 0
+    requests: int = 0
+    failures: int = 0
+    slow: int = 0
+    bytes_sent: int = 0
+
+    def draw(self) -> tuple[bool, bool]:
+        """Counts the request and decides (reproducibly) whether it fails and whether it is slow."""
+        with self.lock:
+            self.requests += 1
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            slow = self.slow_rate > 0 and self.random.random() < self.slow_rate
+            self.failures += failed
+            self.slow += slow
+            return failed, slow
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose (cancelled or hedged requests)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeOpenFoodFacts:
+    """Threaded HTTP/1.1 server that mimics the Open Food Facts product endpoint."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        payload_bytes: int = 0,
+        seed: int = 0,
+        error_status: int = 500,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+    ):
+        self._server = _Server((host, port), _Handler)
+        self._server.latency_s = latency_ms / 1000.0
+        self._server.error_rate = error_rate
+        self._server.error_status = error_status
+        self._server.slow_rate = slow_rate
+        self._server.slow_s = slow_ms / 1000.0
+        self._server.payload_bytes = payload_bytes
+        self._server.random = random.Random(seed)
+        self._server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def product_url(self) -> str:
+        return self.base_url + "/api/v2/product/{barcode}.json"
+
+    def stats(self) -> dict:
+        """Requests served, failures and slow responses injected, and body bytes written so far."""
+        return {
+            "requests": self._server.requests,
+            "failures": self._server.failures,
+            "slow": self._server.slow,
+            "bytes_sent": self._server.bytes_sent,
+        }
+
+    def start(self) -> "FakeOpenFoodFacts":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,107 @@
+"""
+Compact storage encoding for cached scan responses (verdicts).
+
+A response is stored as a zlib-compressed array document instead of the
+full JSON object. Ingredients that carry a rule's source and notes keep
+only the rule ID; the prose is rehydrated from the rules table on read,
+so cached rows no longer repeat the same notes for every product.
+
+Rule IDs are only meaningful under the rules version they were written
+with. Only responses for the current RULES_VERSION use references; other
+responses are stored inline. As the canonical name is stored next to
+every reference, a reference is also checked against the rule that name
+resolves to now, so rules edited without a version bump make the entry
+undecodable (a cache miss) instead of rehydrating another rule's verdict.
+"""
+
+import json
+import zlib
+from typing import Optional
+
+from rules import RISK_CODES, RISK_LEVELS, RULES_VERSION, get_rule_id, get_rule_result
+
+# First byte of every encoded blob, bumped on incompatible format changes
+FORMAT_VERSION = 1
+_HEADER = bytes([FORMAT_VERSION])
+
+COMPRESSION_LEVEL = 6
+
+
+def _rehydrated(rule_id: int) -> tuple[str, Optional[str], Optional[str]]:
+    """(risk, source, notes) an ingredient gets from a rule (see classify_ingredient)."""
+    risk, source, notes = get_rule_result(rule_id)
+    if risk == "safe":
+        return risk, None, None
+    return risk, source, notes
+
+
+def _encode_ingredient(ingredient: dict, use_refs: bool) -> list:
+    raw, canonical = ingredient["raw"], ingredient["canonical"]
+    risk, source, notes = ingredient["risk"], ingredient.get("source"), ingredient.get("notes")
+    confidence = ingredient.get("confidence")
+    if use_refs:
+        rule_id = get_rule_id(canonical)
+        if rule_id is not None and _rehydrated(rule_id) == (risk, source, notes):
+            # [raw, canonical, rule_id, confidence]
+            return [raw, canonical, rule_id, confidence]
+    # [raw, canonical, risk_code, source, notes, confidence]
+    return [raw, canonical, RISK_CODES[risk], source, notes, confidence]
+
+
+def _decode_ingredient(entry: list, refs_allowed: bool) -> dict:
+    if len(entry) == 4:
+        raw, canonical, rule_id, confidence = entry
+        if not refs_allowed:
+            raise ValueError("Rule reference in a verdict for another rules version")
+        if get_rule_id(canonical) != rule_id:
+            raise ValueError(f"Rule reference {rule_id} no longer matches {canonical!r}")
+        risk, source, notes = _rehydrated(rule_id)
+    else:
+        raw, canonical, risk_code, source, notes, confidence = entry
+        risk = RISK_LEVELS[risk_code]
+    return {
+        "raw": raw,
+        "canonical": canonical,
+        "risk": risk,
+        "source": source,
+        "notes": notes,
+        "confidence": confidence,
+    }
+
+
+def encode_response(response: dict) -> bytes:
+    """
+    Encodes a scan response for storage. Per-request flags (cached, stale)
+    are not stored.
+    """
+    rules_version = response.get("rules_version", RULES_VERSION)
+    use_refs = rules_version == RULES_VERSION
+    document = [
+        response["product_name"],
+        RISK_CODES[response["overall_risk"]],
+        rules_version,
+        [_encode_ingredient(i, use_refs) for i in response["ingredients"]],
+    ]
+    payload = json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode()
+    return _HEADER + zlib.compress(payload, COMPRESSION_LEVEL)
+
+
+def decode_response(blob: bytes) -> dict:
+    """
+    Decodes a stored response back into the scan response dict.
+
+    Raises:
+        ValueError: For an unknown format, or rule references written
+            under a different rules version than the current one or no
+            longer matching their canonical name
+    """
+    if blob[:1] != _HEADER:
+        raise ValueError(f"Unknown verdict encoding: {blob[:1]!r}")
+    product_name, overall_code, rules_version, ingredients = json.loads(zlib.decompress(blob[1:]))
+    refs_allowed = rules_version == RULES_VERSION
+    return {
+        "product_name": product_name,
+        "ingredients": [_decode_ingredient(entry, refs_allowed) for entry in ingredients],
+        "overall_risk": RISK_LEVELS[overall_code],
+        "rules_version": rules_version,
+    }
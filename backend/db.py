@@ -1,30 +1,98 @@
 """
 SQLite cache operations for scan results.
+
+Raw product data (name + ingredients text, as fetched) and verdicts (the
+classified scan response) are stored separately. Verdicts are keyed by
+(barcode, rules_version), so after a rules change a miss can be
+recomputed from the stored raw product without calling Open Food Facts.
+
+Synchronous functions are used at startup and by scripts. Request handlers
+use the *_async variants, which run SQLite work on dedicated threads so disk
+reads and commits never block the event loop: a small pool of reader
+threads and a single writer thread (SQLite allows one writer at a time).
+
+Each thread keeps one persistent connection in WAL mode, so readers and
+the writer do not block each other and no call pays for connection setup.
 """
 
+import asyncio
+import hashlib
 import json
 import sqlite3
 import os
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
 
-# Database file path (same directory as this module)
-DB_PATH = Path(__file__).parent / "safeeats.db"
+from codec import encode_response, decode_response
+from hotcache import HotCache, EncodedResponse
+from rules import RULES_VERSION
+
+# Database file path (same directory as this module unless overridden)
+DB_PATH = Path(os.environ.get("SAFEEATS_DB_PATH", Path(__file__).parent / "safeeats.db"))
 
 # Cache validity duration
 CACHE_TTL_HOURS = 24
 
+# How long past the TTL an entry may still be served (flagged stale) while
+# it is refreshed in the background; older entries are refetched inline
+CACHE_MAX_STALE_HOURS = float(os.environ.get("SAFEEATS_CACHE_MAX_STALE_HOURS", 72))
+
+# Not-found / no-ingredient outcomes are cached for a shorter time, since
+# products get added to and completed in Open Food Facts
+NEGATIVE_CACHE_TTL_MINUTES = float(os.environ.get("SAFEEATS_NEGATIVE_CACHE_TTL_MINUTES", 60))
+
+_negative_stats = {"hits": 0, "misses": 0, "stores": 0}
+_negative_stats_lock = threading.Lock()
+
+# In-memory hot cache budget (bytes) in front of SQLite
+HOT_CACHE_MAX_BYTES = int(os.environ.get("SAFEEATS_HOT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# Hot-cache response bodies at least this large also keep a gzip copy
+HOT_CACHE_GZIP_MIN_BYTES = int(os.environ.get("SAFEEATS_HOT_CACHE_GZIP_MIN_BYTES", 500))
+
+_hot_cache = HotCache(
+    max_bytes=HOT_CACHE_MAX_BYTES,
+    ttl_seconds=CACHE_TTL_HOURS * 3600,
+    gzip_min_bytes=HOT_CACHE_GZIP_MIN_BYTES,
+)
+
+# Threads used by the async API
+DB_READ_WORKERS = int(os.environ.get("SAFEEATS_DB_READ_WORKERS", 4))
+
+_read_executor: Optional[ThreadPoolExecutor] = None
+_write_executor: Optional[ThreadPoolExecutor] = None
+
+# SQLite tuning for the pooled connections
+SQLITE_MMAP_SIZE = int(os.environ.get("SAFEEATS_SQLITE_MMAP_SIZE", 64 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KIB = int(os.environ.get("SAFEEATS_SQLITE_CACHE_SIZE_KIB", 16 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHED_STATEMENTS = 128
+SQLITE_MAX_IN_PARAMS = 500  # well under SQLite's host-parameter limit
+
+# Barcodes served from the cache since the last maintenance run. Their
+# verdicts' accessed_at (used for LRU eviction) is written in one batch by
+# flush_accessed() rather than on every read.
+_accessed: set[str] = set()
+_accessed_lock = threading.Lock()
+
 # Test database path (temporary file for cross-thread access)
 _test_db_path: Optional[str] = None
 
+# Per-thread pooled connections. Every connection is also registered in
+# _connections so close_connections() can close them from any thread;
+# bumping _pool_generation makes threads reconnect on their next call.
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_pool_generation = 0
 
-def get_connection() -> sqlite3.Connection:
-    """
-    Returns a database connection with row factory.
-    Uses a file-based test database if the TESTING environment variable is set.
-    """
+
+def _db_path() -> str:
+    """Returns the database file in use (the temp test db when TESTING=1)."""
     global _test_db_path
     
     if os.environ.get("TESTING") == "1":
@@ -33,82 +101,884 @@ def get_connection() -> sqlite3.Connection:
             # Create a temporary database file
             fd, _test_db_path = tempfile.mkstemp(suffix=".db")
             os.close(fd)
-        conn = sqlite3.connect(_test_db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        return conn
-    else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
+        return _test_db_path
+    return str(DB_PATH)
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """Opens a connection with WAL mode and tuned pragmas."""
+    # Each pooled connection is only used by the thread that owns it;
+    # check_same_thread=False lets close_connections() run from elsewhere.
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+    )
+    conn.row_factory = sqlite3.Row
+    # Only takes effect on a new database (before WAL and the first table);
+    # lets maintenance return freed pages to the OS without a full VACUUM
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns the calling thread's pooled database connection with row factory.
+    Uses a file-based test database if the TESTING environment variable is set.
+    
+    Connections are reused across calls; callers must not close them.
+    """
+    path = _db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.generation == _pool_generation and _local.path == path:
         return conn
+    
+    conn = _open_connection(path)
+    with _connections_lock:
+        _connections.append(conn)
+    _local.conn = conn
+    _local.generation = _pool_generation
+    _local.path = path
+    return conn
+
+
+def close_connections() -> None:
+    """Closes every pooled connection. Threads reconnect on their next call."""
+    global _pool_generation
+    
+    with _connections_lock:
+        _pool_generation += 1
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+
+
+# Classified scan responses per rules version, encoded by codec.py.
+# updated_at is when the underlying product data was fetched, so a verdict
+# recomputed from stored data expires together with that data.
+_CREATE_VERDICTS = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        barcode TEXT NOT NULL,
+        rules_version TEXT NOT NULL,
+        response BLOB NOT NULL,
+        content_hash TEXT,
+        updated_at TIMESTAMP NOT NULL,
+        accessed_at TIMESTAMP,
+        PRIMARY KEY (barcode, rules_version)
+    ) WITHOUT ROWID
+"""
 
 
 def init_db() -> None:
-    """Creates the scan_cache table if it doesn't exist."""
+    """Creates the products, verdicts and local_products tables if they don't exist."""
     global _test_db_path
     
     # Reset test database for each test
     if os.environ.get("TESTING") == "1":
+        close_connections()
         if _test_db_path is not None:
-            try:
-                os.remove(_test_db_path)
-            except OSError:
-                pass
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(_test_db_path + suffix)
+                except OSError:
+                    pass
             _test_db_path = None
+        _hot_cache.clear()
+        with _accessed_lock:
+            _accessed.clear()
+        with _negative_stats_lock:
+            _negative_stats.update(hits=0, misses=0, stores=0)
     
     conn = get_connection()
-    try:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS scan_cache (
-                barcode TEXT PRIMARY KEY,
-                response_json TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-    finally:
-        conn.close()
+    # Raw product data as fetched, so verdicts can be recomputed locally
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            barcode TEXT PRIMARY KEY,
+            product_name TEXT,
+            ingredients_text TEXT NOT NULL,
+            fetched_at TIMESTAMP NOT NULL,
+            content_hash TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute(_CREATE_VERDICTS.format(table="verdicts"))
+    # Error outcomes (404 not found, 422 no ingredients) with a shorter TTL
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS negative_cache (
+            barcode TEXT PRIMARY KEY,
+            status INTEGER NOT NULL,
+            detail TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Offline product store, bulk-loaded from Open Food Facts dumps
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS local_products (
+            barcode TEXT PRIMARY KEY,
+            product_name TEXT,
+            product_name_en TEXT,
+            ingredients_text TEXT,
+            ingredients_text_en TEXT,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    _migrate_verdicts_accessed_at(conn)
+    _migrate_verdicts_to_blob(conn)
+    _migrate_scan_cache(conn)
+    # Expiry sweeps and LRU eviction scan these in order
+    conn.execute("CREATE INDEX IF NOT EXISTS verdicts_updated_at ON verdicts (updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS verdicts_accessed_at ON verdicts (accessed_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS products_fetched_at ON products (fetched_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS negative_cache_updated_at ON negative_cache (updated_at)")
+    conn.commit()
+
+
+def _migrate_scan_cache(conn: sqlite3.Connection) -> None:
+    """
+    Moves rows from the old single scan_cache table into verdicts.
+    Their raw product data was never stored, so they stay valid until
+    they expire and are then refetched.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_cache'"
+    ).fetchone()
+    if not exists:
+        return
+    _register_encoder(conn)
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO verdicts (barcode, rules_version, response, updated_at, accessed_at)
+        SELECT barcode, COALESCE(json_extract(response_json, '$.rules_version'), ?),
+               encode_verdict(response_json), updated_at, updated_at
+        FROM scan_cache
+        """,
+        (RULES_VERSION,)
+    )
+    conn.execute("DROP TABLE scan_cache")
+
+
+def _register_encoder(conn: sqlite3.Connection) -> None:
+    """Makes encode_verdict(json_text) available to migration SQL."""
+    conn.create_function(
+        "encode_verdict", 1, lambda text: encode_response(json.loads(text)), deterministic=True
+    )
 
 
-def get_cached_scan(barcode: str) -> Optional[dict]:
+def _migrate_verdicts_to_blob(conn: sqlite3.Connection) -> None:
     """
-    Returns cached response if exists and is less than 24 hours old.
+    Rewrites a verdicts table storing TEXT JSON (response_json) into the
+    compact encoding, in one transaction at startup.
+    """
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(verdicts)")}
+    if "response_json" not in columns:
+        return
+    _register_encoder(conn)
+    conn.execute(_CREATE_VERDICTS.format(table="verdicts_encoded"))
+    conn.execute(
+        """
+        INSERT INTO verdicts_encoded
+        SELECT barcode, rules_version, encode_verdict(response_json), content_hash, updated_at, accessed_at
+        FROM verdicts
+        """
+    )
+    conn.execute("DROP TABLE verdicts")
+    conn.execute("ALTER TABLE verdicts_encoded RENAME TO verdicts")
+
+
+def _migrate_verdicts_accessed_at(conn: sqlite3.Connection) -> None:
+    """Adds the accessed_at column (for LRU eviction) to older verdicts tables."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(verdicts)")}
+    if "accessed_at" in columns:
+        return
+    conn.execute("ALTER TABLE verdicts ADD COLUMN accessed_at TIMESTAMP")
+    conn.execute("UPDATE verdicts SET accessed_at = updated_at")
+
+
+def product_content_hash(product_name: Optional[str], ingredients_text: str) -> str:
+    """Returns a hash of the raw product fields a verdict is computed from."""
+    return hashlib.sha256(f"{product_name or ''}\0{ingredients_text}".encode()).hexdigest()
+
+
+def get_cached_scan(
+    barcode: str,
+    rules_version: str = RULES_VERSION,
+    allow_stale: bool = False,
+) -> Optional[dict]:
+    """
+    Returns the cached verdict for the given rules version if it exists
+    and is less than 24 hours old.
+    With allow_stale, entries up to CACHE_MAX_STALE_HOURS past the TTL are
+    returned too, with "stale": True set.
     Returns None if not cached or expired.
+    Checks the in-memory hot cache before touching SQLite.
     """
-    conn = get_connection()
+    hot = _hot_cache.get(barcode)
+    if hot is not None and hot.get("rules_version") == rules_version:
+        _record_access(barcode)
+        return hot
+    return _load_cached_scan(barcode, rules_version, allow_stale)
+
+
+def get_hot_encoded_scan(barcode: str, rules_version: str = RULES_VERSION) -> Optional[EncodedResponse]:
+    """
+    Returns the pre-serialized response for a hot-cache hit under the given
+    rules version, or None. Never touches SQLite, so it is safe to call on
+    the event loop.
+    """
+    encoded = _hot_cache.get_encoded(barcode)
+    if encoded is not None and encoded.rules_version == rules_version:
+        _record_access(barcode)
+        return encoded
+    return None
+
+
+def _record_access(*barcodes: str) -> None:
+    with _accessed_lock:
+        _accessed.update(barcodes)
+
+
+def _cache_age_state(
+    updated_at: str,
+    now: datetime,
+    allow_stale: bool,
+    max_stale_hours: Optional[float] = None,
+) -> tuple[Optional[bool], float]:
+    """
+    Returns (stale, age in seconds) for a cache row; stale is None when the
+    row is too old to serve. max_stale_hours defaults to CACHE_MAX_STALE_HOURS.
+    """
+    age = now - datetime.fromisoformat(updated_at)
+    ttl = timedelta(hours=CACHE_TTL_HOURS)
+    if age <= ttl:
+        return False, age.total_seconds()
+    if max_stale_hours is None:
+        max_stale_hours = CACHE_MAX_STALE_HOURS
+    if allow_stale and age.total_seconds() <= (ttl.total_seconds() + max_stale_hours * 3600):
+        return True, age.total_seconds()
+    return None, age.total_seconds()
+
+
+def _decode_verdict(blob: bytes) -> Optional[dict]:
+    """Decodes a stored verdict, or None (a cache miss) if it no longer decodes under the current rules."""
     try:
-        cursor = conn.execute(
-            "SELECT response_json, updated_at FROM scan_cache WHERE barcode = ?",
-            (barcode,)
+        return decode_response(blob)
+    except ValueError:
+        return None
+
+
+def _load_cached_scan(
+    barcode: str,
+    rules_version: str = RULES_VERSION,
+    allow_stale: bool = False,
+    max_stale_hours: Optional[float] = None,
+) -> Optional[dict]:
+    """Reads a cached verdict from SQLite and promotes fresh ones to the hot cache."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT response, updated_at FROM verdicts WHERE barcode = ? AND rules_version = ?",
+        (barcode, rules_version)
+    ).fetchone()
+    
+    if row is None:
+        return None
+    
+    # Check if cache is still valid (or servable as stale)
+    stale, age_seconds = _cache_age_state(row["updated_at"], datetime.now(), allow_stale, max_stale_hours)
+    if stale is None:
+        return None
+    
+    response = _decode_verdict(row["response"])
+    if response is None:
+        return None
+    if stale:
+        response["stale"] = True
+    else:
+        _hot_cache.put(barcode, response, age_seconds=age_seconds)
+    _record_access(barcode)
+    return response
+
+
+# Verdicts computed from stored raw data inherit its fetch time and hash
+_UPSERT_VERDICT = """
+    INSERT INTO verdicts (barcode, rules_version, response, content_hash, updated_at, accessed_at)
+    VALUES (
+        :barcode, :rules_version, :response,
+        (SELECT content_hash FROM products WHERE barcode = :barcode),
+        COALESCE((SELECT fetched_at FROM products WHERE barcode = :barcode), :now),
+        :now
+    )
+    ON CONFLICT(barcode, rules_version) DO UPDATE SET
+        response = excluded.response,
+        content_hash = excluded.content_hash,
+        updated_at = excluded.updated_at,
+        accessed_at = excluded.accessed_at
+"""
+
+_UPSERT_PRODUCT = """
+    INSERT INTO products (barcode, product_name, ingredients_text, fetched_at, content_hash)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(barcode) DO UPDATE SET
+        product_name = excluded.product_name,
+        ingredients_text = excluded.ingredients_text,
+        fetched_at = excluded.fetched_at,
+        content_hash = excluded.content_hash
+"""
+
+
+def _product_row(barcode: str, response: dict, ingredients_text: str, now: str) -> tuple:
+    product_name = response["product_name"]
+    return (barcode, product_name, ingredients_text, now, product_content_hash(product_name, ingredients_text))
+
+
+def _verdict_params(barcode: str, response: dict, now: str) -> dict:
+    return {
+        "barcode": barcode,
+        "rules_version": response.get("rules_version", RULES_VERSION),
+        "response": encode_response(response),
+        "now": now,
+    }
+
+
+def _put_written_verdict(conn: sqlite3.Connection, barcode: str, response: dict, fetched: bool, now: str) -> None:
+    """
+    Puts a verdict that was just written into the hot cache, aged like the
+    stored row. A verdict recomputed from stored raw data inherits its fetch
+    time (see _UPSERT_VERDICT) and may be close to expiry, or past it.
+    """
+    updated_at = now
+    if not fetched:
+        row = conn.execute(
+            "SELECT updated_at FROM verdicts WHERE barcode = ? AND rules_version = ?",
+            (barcode, response.get("rules_version", RULES_VERSION))
+        ).fetchone()
+        if row is not None:
+            updated_at = row["updated_at"]
+    stale, age_seconds = _cache_age_state(updated_at, datetime.fromisoformat(now), allow_stale=False)
+    if stale is None:
+        _hot_cache.invalidate(barcode)
+    else:
+        _hot_cache.put(barcode, response, age_seconds=age_seconds)
+
+
+def cache_scan(barcode: str, response: dict, ingredients_text: Optional[str] = None) -> None:
+    """
+    Stores or updates a verdict in the cache.
+    
+    Pass the ingredients text the verdict was computed from when the
+    product was just fetched; it is stored as the product's raw data.
+    Without it the verdict is tied to the already stored raw data.
+    """
+    now = datetime.now().isoformat()
+    conn = get_connection()
+    with conn:  # commits, or rolls back on error
+        if ingredients_text is not None:
+            conn.execute(_UPSERT_PRODUCT, _product_row(barcode, response, ingredients_text, now))
+        conn.execute(_UPSERT_VERDICT, _verdict_params(barcode, response, now))
+    _put_written_verdict(conn, barcode, response, ingredients_text is not None, now)
+
+
+def get_cached_scans(
+    barcodes: list[str],
+    rules_version: str = RULES_VERSION,
+    allow_stale: bool = False,
+) -> dict[str, dict]:
+    """
+    Bulk version of get_cached_scan.
+    Returns {barcode: response} for every barcode with a fresh (or, with
+    allow_stale, stale) cache entry; hot-cache misses are resolved with one
+    IN (...) query per chunk.
+    """
+    found: dict[str, dict] = {}
+    remaining = []
+    for barcode in dict.fromkeys(barcodes):
+        hot = _hot_cache.get(barcode)
+        if hot is not None and hot.get("rules_version") == rules_version:
+            found[barcode] = hot
+        else:
+            remaining.append(barcode)
+    
+    conn = get_connection()
+    now = datetime.now()
+    for start in range(0, len(remaining), SQLITE_MAX_IN_PARAMS):
+        chunk = remaining[start:start + SQLITE_MAX_IN_PARAMS]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT barcode, response, updated_at FROM verdicts "
+            f"WHERE rules_version = ? AND barcode IN ({placeholders})",
+            [rules_version, *chunk]
+        ).fetchall()
+        for row in rows:
+            stale, age_seconds = _cache_age_state(row["updated_at"], now, allow_stale)
+            if stale is None:
+                continue
+            response = _decode_verdict(row["response"])
+            if response is None:
+                continue
+            if stale:
+                response["stale"] = True
+            else:
+                _hot_cache.put(row["barcode"], response, age_seconds=age_seconds)
+            found[row["barcode"]] = response
+    _record_access(*found)
+    return found
+
+
+def cache_scans(
+    responses: dict[str, dict],
+    ingredients: Optional[dict[str, str]] = None,
+    hot: bool = True,
+) -> None:
+    """
+    Bulk version of cache_scan. Writes every result in one transaction.
+    ingredients maps barcodes to freshly fetched ingredients text; pass
+    hot=False to leave the in-memory hot cache untouched.
+    """
+    now = datetime.now().isoformat()
+    ingredients = ingredients or {}
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            _UPSERT_PRODUCT,
+            [_product_row(b, responses[b], text, now) for b, text in ingredients.items() if b in responses]
+        )
+        conn.executemany(
+            _UPSERT_VERDICT,
+            [_verdict_params(barcode, response, now) for barcode, response in responses.items()]
         )
-        row = cursor.fetchone()
-        
-        if row is None:
-            return None
-        
-        # Check if cache is still valid
-        updated_at = datetime.fromisoformat(row["updated_at"])
-        if datetime.now() - updated_at > timedelta(hours=CACHE_TTL_HOURS):
-            return None
-        
-        return json.loads(row["response_json"])
-    finally:
-        conn.close()
-
-
-def cache_scan(barcode: str, response: dict) -> None:
-    """Stores or updates a scan result in the cache."""
+    if hot:
+        for barcode, response in responses.items():
+            _put_written_verdict(conn, barcode, response, barcode in ingredients, now)
+    else:
+        for barcode in responses:
+            _hot_cache.invalidate(barcode)
+
+
+def get_stored_product(barcode: str) -> Optional[dict]:
+    """
+    Returns the stored raw product ({"product_name", "ingredients_text",
+    "fetched_at", "content_hash"}) if it was fetched less than 24 hours ago.
+    """
     conn = get_connection()
-    try:
+    row = conn.execute(
+        "SELECT product_name, ingredients_text, fetched_at, content_hash FROM products WHERE barcode = ?",
+        (barcode,)
+    ).fetchone()
+    if row is None:
+        return None
+    if datetime.now() - datetime.fromisoformat(row["fetched_at"]) > timedelta(hours=CACHE_TTL_HOURS):
+        return None
+    return dict(row)
+
+
+def get_products_without_verdict(rules_version: str, after: str, limit: int) -> list[tuple]:
+    """
+    Returns up to limit (barcode, product_name, ingredients_text) rows for
+    stored products with no verdict under rules_version, in barcode order
+    starting after the given barcode (keyset pagination).
+    """
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT p.barcode, p.product_name, p.ingredients_text FROM products p
+        WHERE p.barcode > ? AND NOT EXISTS (
+            SELECT 1 FROM verdicts v WHERE v.barcode = p.barcode AND v.rules_version = ?
+        )
+        ORDER BY p.barcode
+        LIMIT ?
+        """,
+        (after, rules_version, limit)
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def _count_negative(counter: str) -> None:
+    with _negative_stats_lock:
+        _negative_stats[counter] += 1
+
+
+def get_negative_scan(barcode: str) -> Optional[tuple[int, str]]:
+    """
+    Returns the cached (status, detail) error for a barcode if it was
+    recorded less than NEGATIVE_CACHE_TTL_MINUTES ago, otherwise None.
+    """
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT status, detail, updated_at FROM negative_cache WHERE barcode = ?",
+        (barcode,)
+    ).fetchone()
+    if row is None or datetime.now() - datetime.fromisoformat(row["updated_at"]) > timedelta(
+        minutes=NEGATIVE_CACHE_TTL_MINUTES
+    ):
+        _count_negative("misses")
+        return None
+    _count_negative("hits")
+    return row["status"], row["detail"]
+
+
+def cache_negative_scan(barcode: str, status: int, detail: str) -> None:
+    """Records an error outcome (e.g. 404 not found) for a barcode."""
+    conn = get_connection()
+    with conn:
         conn.execute(
             """
-            INSERT INTO scan_cache (barcode, response_json, updated_at)
-            VALUES (?, ?, ?)
+            INSERT INTO negative_cache (barcode, status, detail, updated_at)
+            VALUES (?, ?, ?, ?)
             ON CONFLICT(barcode) DO UPDATE SET
-                response_json = excluded.response_json,
+                status = excluded.status,
+                detail = excluded.detail,
                 updated_at = excluded.updated_at
             """,
-            (barcode, json.dumps(response), datetime.now().isoformat())
+            (barcode, status, detail, datetime.now().isoformat())
+        )
+    _count_negative("stores")
+
+
+LOCAL_PRODUCT_FIELDS = ("product_name", "product_name_en", "ingredients_text", "ingredients_text_en")
+
+
+def get_local_product(barcode: str) -> Optional[dict]:
+    """
+    Returns a product from the offline store in Open Food Facts shape
+    ({"product_name": ..., "ingredients_text": ...}), or None.
+    """
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT product_name, product_name_en, ingredients_text, ingredients_text_en "
+        "FROM local_products WHERE barcode = ?",
+        (barcode,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {field: row[field] for field in LOCAL_PRODUCT_FIELDS}
+
+
+def upsert_local_products(products: list[tuple]) -> None:
+    """
+    Bulk-loads products into the offline store in one transaction.
+    Each tuple is (barcode, product_name, product_name_en,
+    ingredients_text, ingredients_text_en).
+    """
+    imported_at = datetime.now().isoformat()
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO local_products (
+                barcode, product_name, product_name_en,
+                ingredients_text, ingredients_text_en, imported_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(barcode) DO UPDATE SET
+                product_name = excluded.product_name,
+                product_name_en = excluded.product_name_en,
+                ingredients_text = excluded.ingredients_text,
+                ingredients_text_en = excluded.ingredients_text_en,
+                imported_at = excluded.imported_at
+            """,
+            [product + (imported_at,) for product in products]
         )
-        conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+# Maintenance primitives (driven by maintenance.py). Each call does one
+# small batch in its own short transaction, so the write lock is never held
+# long enough to stall /scan writes.
+
+def flush_accessed(batch_size: int) -> int:
+    """
+    Writes accessed_at for barcodes served since the last flush, in
+    batches. Returns the number of barcodes flushed.
+    """
+    global _accessed
+    
+    with _accessed_lock:
+        barcodes, _accessed = list(_accessed), set()
+    now = datetime.now().isoformat()
+    conn = get_connection()
+    for start in range(0, len(barcodes), min(batch_size, SQLITE_MAX_IN_PARAMS)):
+        chunk = barcodes[start:start + min(batch_size, SQLITE_MAX_IN_PARAMS)]
+        placeholders = ",".join("?" * len(chunk))
+        with conn:
+            conn.execute(
+                f"UPDATE verdicts SET accessed_at = ? WHERE barcode IN ({placeholders})",
+                [now, *chunk]
+            )
+    return len(barcodes)
+
+
+def delete_expired_batch(table: str, limit: int) -> int:
+    """
+    Deletes up to limit rows from table that can no longer be served.
+    Returns the number of rows deleted.
+    
+    - verdicts: older than TTL + max staleness, or for other rules versions
+    - products: fetched longer ago than TTL + max staleness
+    - negative_cache: older than the negative TTL
+    """
+    now = datetime.now()
+    servable = (now - timedelta(hours=CACHE_TTL_HOURS + CACHE_MAX_STALE_HOURS)).isoformat()
+    if table == "verdicts":
+        sql = """
+            DELETE FROM verdicts WHERE (barcode, rules_version) IN (
+                SELECT barcode, rules_version FROM verdicts
+                WHERE updated_at < ? OR rules_version != ? LIMIT ?
+            )
+        """
+        params = (servable, RULES_VERSION, limit)
+    elif table == "products":
+        sql = """
+            DELETE FROM products WHERE barcode IN (
+                SELECT barcode FROM products WHERE fetched_at < ? LIMIT ?
+            )
+        """
+        params = (servable, limit)
+    elif table == "negative_cache":
+        sql = """
+            DELETE FROM negative_cache WHERE barcode IN (
+                SELECT barcode FROM negative_cache WHERE updated_at < ? LIMIT ?
+            )
+        """
+        params = ((now - timedelta(minutes=NEGATIVE_CACHE_TTL_MINUTES)).isoformat(), limit)
+    else:
+        raise ValueError(f"Unknown cache table: {table}")
+    
+    conn = get_connection()
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+
+# Tables whose rows LRU eviction frees; the byte budget counts only these
+EVICTABLE_TABLES = ("verdicts", "products")
+
+
+def _evictable_bytes(conn: sqlite3.Connection) -> int:
+    """
+    Bytes held by the evictable tables and their indexes, leaving out the
+    offline local_products store. Uses the dbstat table when SQLite was
+    built with it, and an estimate from stored value sizes otherwise.
+    """
+    placeholders = ",".join("?" * len(EVICTABLE_TABLES))
+    try:
+        return conn.execute(
+            f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+            f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({placeholders}))",
+            EVICTABLE_TABLES
+        ).fetchone()[0]
+    except sqlite3.OperationalError:  # no dbstat virtual table
+        verdicts = conn.execute(
+            "SELECT COALESCE(SUM(length(barcode) + length(rules_version) + length(response) "
+            "+ IFNULL(length(content_hash), 0) + 64), 0) FROM verdicts"
+        ).fetchone()[0]
+        products = conn.execute(
+            "SELECT COALESCE(SUM(length(barcode) + IFNULL(length(product_name), 0) + length(ingredients_text) "
+            "+ IFNULL(length(content_hash), 0) + 48), 0) FROM products"
+        ).fetchone()[0]
+        return verdicts + products
+
+
+def get_cache_size() -> dict:
+    """
+    Returns the verdict count, the bytes held by cached verdicts and raw
+    products, and the whole database's used and free bytes.
+    """
+    conn = get_connection()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "verdicts": conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0],
+        "cache_bytes": _evictable_bytes(conn),
+        "used_bytes": (page_count - free_pages) * page_size,
+        "free_bytes": free_pages * page_size,
+    }
+
+
+def evict_lru_batch(limit: int) -> int:
+    """
+    Deletes the limit least recently used barcodes (their verdicts and raw
+    product). Returns the number of barcodes evicted.
+    """
+    conn = get_connection()
+    with conn:
+        barcodes = [
+            row[0] for row in conn.execute(
+                "SELECT barcode FROM verdicts ORDER BY accessed_at LIMIT ?", (limit,)
+            )
+        ]
+        if not barcodes:
+            return 0
+        placeholders = ",".join("?" * len(barcodes))
+        conn.execute(f"DELETE FROM verdicts WHERE barcode IN ({placeholders})", barcodes)
+        conn.execute(f"DELETE FROM products WHERE barcode IN ({placeholders})", barcodes)
+    for barcode in barcodes:
+        _hot_cache.invalidate(barcode)
+    return len(set(barcodes))
+
+
+def incremental_vacuum(pages: int) -> Optional[int]:
+    """
+    Returns up to pages free pages to the OS. Returns the number of pages
+    freed, or None when the database was not created with incremental
+    auto-vacuum (see maintenance.py --enable-incremental-vacuum).
+    """
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # INCREMENTAL
+        return None
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # executescript steps the pragma to completion; execute() would free
+    # a single page because the pragma returns no result columns
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def enable_incremental_vacuum() -> None:
+    """
+    Switches an existing database to incremental auto-vacuum. Rewrites the
+    whole file with VACUUM, so run it offline.
+    """
+    conn = get_connection()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _get_read_executor() -> ThreadPoolExecutor:
+    global _read_executor
+    
+    if _read_executor is None:
+        _read_executor = ThreadPoolExecutor(
+            max_workers=DB_READ_WORKERS, thread_name_prefix="safeeats-db-read"
+        )
+    return _read_executor
+
+
+def _get_write_executor() -> ThreadPoolExecutor:
+    global _write_executor
+    
+    if _write_executor is None:
+        _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="safeeats-db-write")
+    return _write_executor
+
+
+async def get_cached_scan_async(barcode: str, allow_stale: bool = False, skip_hot: bool = False) -> Optional[dict]:
+    """
+    Async version of get_cached_scan.
+    Hot-cache hits are answered inline; SQLite reads run on a reader thread.
+    Pass skip_hot when the caller has just missed the hot cache, so the
+    miss is not looked up (and counted) twice.
+    """
+    if not skip_hot:
+        hot = _hot_cache.get(barcode)
+        if hot is not None and hot.get("rules_version") == RULES_VERSION:
+            _record_access(barcode)
+            return hot
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_read_executor(), _load_cached_scan, barcode, RULES_VERSION, allow_stale
+    )
+
+
+async def get_fallback_scan_async(barcode: str) -> Optional[dict]:
+    """
+    Returns the cached verdict for the current rules however old it is
+    (flagged stale when past the TTL), for answering scans while upstream
+    is unavailable. Only rows not yet removed by maintenance are found.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_read_executor(), _load_cached_scan, barcode, RULES_VERSION, True, float("inf")
+    )
+
+
+async def cache_scan_async(barcode: str, response: dict, ingredients_text: Optional[str] = None) -> None:
+    """Async version of cache_scan. Writes are serialized on the writer thread."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_write_executor(), cache_scan, barcode, response, ingredients_text)
+
+
+async def get_cached_scans_async(barcodes: list[str], allow_stale: bool = False) -> dict[str, dict]:
+    """Async version of get_cached_scans, run on a reader thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_read_executor(), get_cached_scans, barcodes, RULES_VERSION, allow_stale
+    )
+
+
+async def cache_scans_async(responses: dict[str, dict], ingredients: Optional[dict[str, str]] = None) -> None:
+    """Async version of cache_scans, run on the writer thread."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_write_executor(), cache_scans, responses, ingredients)
+
+
+async def get_stored_product_async(barcode: str) -> Optional[dict]:
+    """Async version of get_stored_product, run on a reader thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_read_executor(), get_stored_product, barcode)
+
+
+async def get_negative_scan_async(barcode: str) -> Optional[tuple[int, str]]:
+    """Async version of get_negative_scan, run on a reader thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_read_executor(), get_negative_scan, barcode)
+
+
+async def cache_negative_scan_async(barcode: str, status: int, detail: str) -> None:
+    """Async version of cache_negative_scan, run on the writer thread."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_get_write_executor(), cache_negative_scan, barcode, status, detail)
+
+
+async def get_local_product_async(barcode: str) -> Optional[dict]:
+    """Async version of get_local_product, run on a reader thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_read_executor(), get_local_product, barcode)
+
+
+async def run_on_writer(fn, *args):
+    """Runs fn(*args) on the writer thread, serialized with cache writes."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_write_executor(), fn, *args)
+
+
+def run_on_writer_sync(fn, *args, **kwargs):
+    """
+    Blocking form of run_on_writer for code running on other threads
+    (such as the rescore job), so its writes queue behind cache writes
+    instead of contending with them for the SQLite write lock.
+    """
+    return _get_write_executor().submit(fn, *args, **kwargs).result()
+
+
+async def get_cache_size_async() -> dict:
+    """Async version of get_cache_size, run on a reader thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_read_executor(), get_cache_size)
+
+
+def shutdown_executors() -> None:
+    """
+    Waits for pending database work, stops the reader/writer threads
+    and closes their pooled connections.
+    """
+    global _read_executor, _write_executor
+    
+    for executor in (_read_executor, _write_executor):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    _read_executor = None
+    _write_executor = None
+    close_connections()
+
+
+def get_cache_stats() -> dict:
+    """Returns counters for the in-memory hot cache and the negative cache."""
+    with _negative_stats_lock:
+        negative = dict(_negative_stats, ttl_minutes=NEGATIVE_CACHE_TTL_MINUTES)
+    return {"hot_cache": _hot_cache.stats(), "negative_cache": negative}
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Approximate ingredient resolution for misspellings and OCR noise
+("aspartam", "sodium benzoat", "tartrazin").
+
+A trigram inverted index narrows the known names down to a few candidates,
+which are then verified with a bounded Levenshtein distance. Lookups are
+memoized in a bounded LRU cache because the same typos recur across
+products.
+
+A near miss only counts as a typo when the words that differ are not real
+words themselves: "sodium citrate" is two edits from "sodium nitrate" but
+names a different (harmless) salt, so a match whose differing word is a
+known word is rejected.
+
+Every setting can be overridden with a SAFEEATS_FUZZY_* environment variable.
+"""
+
+import os
+from functools import lru_cache
+from typing import Iterable, Optional
+
+# Minimum similarity (1 - edit distance / longer length) to accept a match
+FUZZY_MIN_SIMILARITY = float(os.environ.get("SAFEEATS_FUZZY_MIN_SIMILARITY", 0.85))
+# Hard cap on edit distance, whatever the length
+FUZZY_MAX_DISTANCE = int(os.environ.get("SAFEEATS_FUZZY_MAX_DISTANCE", 2))
+# Shorter names (e-numbers, "msg", "bha") are too ambiguous to fuzz
+FUZZY_MIN_LENGTH = int(os.environ.get("SAFEEATS_FUZZY_MIN_LENGTH", 5))
+# Memoized lookups
+FUZZY_CACHE_SIZE = int(os.environ.get("SAFEEATS_FUZZY_CACHE_SIZE", 4096))
+
+# Real words common in additive names that sit a letter or two away from
+# words of listed substances ("citrate"/"nitrate", "sulfate"/"sulfite").
+# Words of the indexed names themselves are known words too.
+COMMON_ADDITIVE_WORDS = frozenset({
+    "acetate", "acetic", "alginate", "ascorbate", "ascorbic", "benzoate", "bicarbonate",
+    "bromate", "carbonate", "caseinate", "chloride", "citrate", "citric", "diphosphate",
+    "fluoride", "fumarate", "fumaric", "gluconate", "glutamate", "guanylate", "hydroxide",
+    "inosinate", "iodate", "iodide", "lactate", "lactic", "malate", "malic", "nitrate",
+    "nitrite", "oleate", "oxide", "palmitate", "phosphate", "propionate", "silicate",
+    "sorbate", "sorbic", "stearate", "succinate", "sulfate", "sulfite", "sulphate",
+    "sulphite", "tartaric", "tartrate",
+})
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> int:
+    """
+    Returns the edit distance between a and b, or max_distance + 1 as soon
+    as it is known to exceed max_distance.
+
+    Only the diagonal band of width 2 * max_distance + 1 is computed, so the
+    cost is linear in the string length.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = max_distance + 1
+    previous = list(range(len(a) + 1))
+    for j, char_b in enumerate(b, 1):
+        low = max(1, j - max_distance)
+        high = min(len(a), j + max_distance)
+        current = [over] * (len(a) + 1)
+        current[0] = j if j <= max_distance else over
+        row_min = current[0]
+        for i in range(low, high + 1):
+            cost = min(
+                previous[i] + 1,
+                current[i - 1] + 1,
+                previous[i - 1] + (a[i - 1] != char_b),
+            )
+            current[i] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+class FuzzyIndex:
+    """Trigram index over known ingredient names mapping to canonical names."""
+
+    def __init__(
+        self,
+        terms: dict[str, str],
+        min_similarity: float = FUZZY_MIN_SIMILARITY,
+        max_distance: int = FUZZY_MAX_DISTANCE,
+        min_length: int = FUZZY_MIN_LENGTH,
+        cache_size: int = FUZZY_CACHE_SIZE,
+        known_words: Iterable[str] = COMMON_ADDITIVE_WORDS,
+    ):
+        self.min_similarity = min_similarity
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.known_words = set(known_words)
+        for term in terms:
+            self.known_words.update(term.split())
+        self._terms: list[tuple[str, str]] = []
+        self._postings: dict[str, list[int]] = {}
+        for term, canonical in terms.items():
+            if len(term) < min_length:
+                continue
+            term_id = len(self._terms)
+            self._terms.append((term, canonical))
+            for gram in _trigrams(term):
+                self._postings.setdefault(gram, []).append(term_id)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def _differs_by_known_word(self, text: str, term: str) -> bool:
+        """Whether a word where text and term differ is itself a real word."""
+        words, term_words = text.split(), term.split()
+        if len(words) != len(term_words):
+            return False
+        return any(word != other and word in self.known_words for word, other in zip(words, term_words))
+
+    def _lookup(self, text: str) -> Optional[tuple[str, float]]:
+        """
+        Returns (canonical name, similarity) for the closest known name
+        within the thresholds, or None.
+        """
+        if len(text) < self.min_length:
+            return None
+
+        # Count shared trigrams per candidate term
+        grams = _trigrams(text)
+        shared: dict[int, int] = {}
+        for gram in grams:
+            for term_id in self._postings.get(gram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+
+        # Each edit destroys at most 3 trigrams, so candidates sharing fewer
+        # than len(grams) - 3 * max_distance cannot be within max_distance
+        needed = len(grams) - 3 * self.max_distance
+        best: Optional[tuple[str, float]] = None
+        best_distance = self.max_distance + 1
+        for term_id, count in sorted(shared.items(), key=lambda item: -item[1]):
+            if count < needed:
+                break
+            term, canonical = self._terms[term_id]
+            distance = bounded_levenshtein(text, term, min(self.max_distance, best_distance))
+            if distance < best_distance:
+                similarity = 1 - distance / max(len(text), len(term))
+                if similarity >= self.min_similarity and not self._differs_by_known_word(text, term):
+                    best, best_distance = (canonical, round(similarity, 3)), distance
+                    if distance == 0:
+                        break
+        return best
+
+    def cache_info(self):
+        """Returns the memoization cache statistics."""
+        return self.lookup.cache_info()
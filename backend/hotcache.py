@@ -0,0 +1,221 @@
+"""
+In-process hot cache for scan results.
+
+Sits in front of the SQLite scan cache so frequently scanned barcodes are
+served without disk I/O or JSON decoding. Entries are stored as compact
+tuples with interned rule strings, the cache is capped by (approximate)
+bytes rather than entry count, and eviction is least-recently-used.
+
+Each entry also keeps the serialized /scan response body (with
+"cached": true) and, for larger bodies, a gzip copy of it, so a hit can be
+written to the client without rebuilding the response, along with its
+ETag.
+"""
+
+import gzip
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Ingredient fields, in the order they are packed into entry tuples
+INGREDIENT_FIELDS = ("raw", "canonical", "risk", "source", "notes", "confidence")
+
+
+def pack_response(response: dict) -> tuple:
+    """
+    Converts a scan response dict into a compact nested tuple.
+
+    Canonical names, risks, sources and notes repeat across products, so
+    they are interned and shared between entries.
+    """
+    ingredients = tuple(
+        (
+            i["raw"],
+            sys.intern(i["canonical"]),
+            sys.intern(i["risk"]),
+            sys.intern(i["source"]) if i.get("source") else None,
+            sys.intern(i["notes"]) if i.get("notes") else None,
+            i.get("confidence"),
+        )
+        for i in response["ingredients"]
+    )
+    return (
+        response["product_name"],
+        sys.intern(response["overall_risk"]),
+        response.get("rules_version"),
+        ingredients,
+    )
+
+
+def unpack_response(packed: tuple) -> dict:
+    """Rebuilds a fresh scan response dict from a packed tuple."""
+    product_name, overall_risk, rules_version, ingredients = packed
+    response = {
+        "product_name": product_name,
+        "ingredients": [dict(zip(INGREDIENT_FIELDS, i)) for i in ingredients],
+        "overall_risk": overall_risk,
+    }
+    if rules_version is not None:
+        response["rules_version"] = rules_version
+    return response
+
+
+def _packed_etag(barcode: str, packed: tuple) -> str:
+    content = json.dumps(packed, ensure_ascii=False, separators=(",", ":"))
+    return '"' + hashlib.sha256(f"{barcode}\0{content}".encode()).hexdigest()[:32] + '"'
+
+
+def response_etag(barcode: str, response: dict) -> str:
+    """
+    Strong ETag for a scan result: a hash of the barcode and the verdict
+    content, which includes the rules version. The per-request cached and
+    stale flags are not part of it.
+    """
+    return _packed_etag(barcode, pack_response(response))
+
+
+class EncodedResponse(NamedTuple):
+    """Pre-serialized /scan response for a cache hit."""
+    rules_version: Optional[str]
+    etag: str
+    body: bytes
+    # gzip-compressed body, None when the body is below the gzip threshold
+    gzip_body: Optional[bytes]
+
+
+def serialize_response(barcode: str, packed: tuple, gzip_min_bytes: int) -> EncodedResponse:
+    """Serializes a packed entry as the JSON body /scan returns for a cache hit."""
+    response = unpack_response(packed)
+    response["cached"] = True
+    response["stale"] = False
+    body = json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode()
+    # mtime=0 keeps the compressed bytes identical for identical bodies
+    compressed = gzip.compress(body, compresslevel=9, mtime=0) if len(body) >= gzip_min_bytes else None
+    return EncodedResponse(response.get("rules_version"), _packed_etag(barcode, packed), body, compressed)
+
+
+def packed_size(packed: tuple) -> int:
+    """
+    Approximates the memory held by a packed entry.
+
+    Interned strings are shared between entries, so this over-counts them;
+    the cap errs on the side of using less memory than configured.
+    """
+    product_name, overall_risk, rules_version, ingredients = packed
+    size = sys.getsizeof(packed) + sys.getsizeof(product_name) + sys.getsizeof(ingredients)
+    for ingredient in ingredients:
+        size += sys.getsizeof(ingredient) + sys.getsizeof(ingredient[0])
+    return size
+
+
+def encoded_size(encoded: EncodedResponse) -> int:
+    """Memory held by the serialized bodies of an entry."""
+    size = sys.getsizeof(encoded) + sys.getsizeof(encoded.etag) + sys.getsizeof(encoded.body)
+    if encoded.gzip_body is not None:
+        size += sys.getsizeof(encoded.gzip_body)
+    return size
+
+
+class HotCache:
+    """Byte-bounded LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, gzip_min_bytes: int = 500):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.gzip_min_bytes = gzip_min_bytes
+        # barcode -> (expires_at, size, packed, encoded)
+        self._entries: OrderedDict[str, tuple[float, int, tuple, EncodedResponse]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, barcode: str) -> Optional[tuple]:
+        """Returns the live entry and counts the hit or miss. Call with the lock held."""
+        entry = self._entries.get(barcode)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, _, _ = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[barcode]
+            self._bytes -= size
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(barcode)
+        self.hits += 1
+        return entry
+
+    def get(self, barcode: str) -> Optional[dict]:
+        """Returns a fresh response dict, or None if absent or expired."""
+        with self._lock:
+            entry = self._lookup(barcode)
+        return None if entry is None else unpack_response(entry[2])
+
+    def get_encoded(self, barcode: str) -> Optional[EncodedResponse]:
+        """Returns the pre-serialized response, or None if absent or expired."""
+        with self._lock:
+            entry = self._lookup(barcode)
+        return None if entry is None else entry[3]
+
+    def put(self, barcode: str, response: dict, age_seconds: float = 0.0) -> None:
+        """
+        Stores a response. age_seconds is how old the result already is
+        (e.g. when promoting a row from SQLite) so it expires on schedule.
+        """
+        remaining = self.ttl_seconds - age_seconds
+        if remaining <= 0:
+            return
+        packed = pack_response(response)
+        encoded = serialize_response(barcode, packed, self.gzip_min_bytes)
+        size = packed_size(packed) + encoded_size(encoded)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(barcode, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[barcode] = (time.monotonic() + remaining, size, packed, encoded)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, barcode: str) -> None:
+        """Drops a single entry if present."""
+        with self._lock:
+            entry = self._entries.pop(barcode, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self) -> None:
+        """Drops every entry and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self) -> dict:
+        """Returns counters and current size for monitoring."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,166 @@
+"""
+Periodic maintenance of the SQLite cache.
+
+Each run:
+1. writes the last-access times of recently served barcodes,
+2. deletes rows that can no longer be served (past TTL + max staleness,
+   verdicts for old rules versions, expired negative entries),
+3. evicts least recently used barcodes while the cache is over its row
+   count or byte budget,
+4. returns freed pages to the OS with an incremental vacuum,
+and reports what it did.
+
+Every step works in small batches, each its own transaction on the db
+writer thread, so /scan writes queue behind at most one short batch.
+
+Runs every SAFEEATS_MAINTENANCE_INTERVAL_SECONDS inside the server and
+from the command line:
+    python maintenance.py
+    python maintenance.py --max-rows 100000
+    python maintenance.py --enable-incremental-vacuum   # one-off, offline
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Optional
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Seconds between runs inside the server; 0 disables the background task
+MAINTENANCE_INTERVAL_SECONDS = float(os.environ.get("SAFEEATS_MAINTENANCE_INTERVAL_SECONDS", 600))
+# Rows deleted (or barcodes evicted) per transaction
+MAINTENANCE_BATCH_SIZE = int(os.environ.get("SAFEEATS_MAINTENANCE_BATCH_SIZE", 500))
+# Cache budgets; 0 means unlimited
+CACHE_MAX_ROWS = int(os.environ.get("SAFEEATS_CACHE_MAX_ROWS", 500_000))
+CACHE_MAX_DB_BYTES = int(os.environ.get("SAFEEATS_CACHE_MAX_DB_BYTES", 0))
+# Pages returned to the OS per incremental vacuum step
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get("SAFEEATS_MAINTENANCE_VACUUM_PAGES", 1000))
+
+EXPIRING_TABLES = ("verdicts", "products", "negative_cache")
+
+_last_report: Optional[dict] = None
+
+
+def rows_over_budget(size: dict, max_rows: int, max_db_bytes: int) -> int:
+    """
+    Returns how many verdict rows must go to fit both budgets. The byte
+    budget applies to the cached verdicts and raw products only (not the
+    offline product store) and is converted to rows using their current
+    average size per verdict.
+    """
+    excess = max(0, size["verdicts"] - max_rows) if max_rows else 0
+    if max_db_bytes and size["verdicts"] and size["cache_bytes"] > max_db_bytes:
+        bytes_per_row = size["cache_bytes"] / size["verdicts"]
+        excess = max(excess, math.ceil((size["cache_bytes"] - max_db_bytes) / bytes_per_row))
+    return excess
+
+
+async def run_maintenance(
+    batch_size: int = MAINTENANCE_BATCH_SIZE,
+    max_rows: int = CACHE_MAX_ROWS,
+    max_db_bytes: int = CACHE_MAX_DB_BYTES,
+    vacuum_pages: int = MAINTENANCE_VACUUM_PAGES,
+) -> dict:
+    """Runs one maintenance pass and returns a report of what it did."""
+    global _last_report
+
+    start = time.perf_counter()
+    report = {
+        "accessed_flushed": await db.run_on_writer(db.flush_accessed, batch_size),
+        "expired": {},
+        "evicted": 0,
+        "vacuumed_pages": 0,
+    }
+
+    for table in EXPIRING_TABLES:
+        deleted = 0
+        while True:
+            batch = await db.run_on_writer(db.delete_expired_batch, table, batch_size)
+            deleted += batch
+            if batch < batch_size:
+                break
+        report["expired"][table] = deleted
+
+    excess = rows_over_budget(await db.get_cache_size_async(), max_rows, max_db_bytes)
+    while excess > 0:
+        evicted = await db.run_on_writer(db.evict_lru_batch, min(batch_size, excess))
+        if not evicted:
+            break
+        report["evicted"] += evicted
+        excess -= evicted
+
+    while True:
+        freed = await db.run_on_writer(db.incremental_vacuum, vacuum_pages)
+        if freed is None:
+            report["vacuumed_pages"] = None  # database not in incremental mode
+            break
+        report["vacuumed_pages"] += freed
+        if freed < vacuum_pages:
+            break
+
+    report.update(await db.get_cache_size_async())
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    _last_report = report
+    return report
+
+
+async def maintenance_loop(interval: float = MAINTENANCE_INTERVAL_SECONDS) -> None:
+    """Runs maintenance every interval seconds until cancelled."""
+    global _last_report
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_maintenance()
+        except Exception as e:
+            # Any failure (not just SQLite errors) would otherwise end the
+            # task for good; report it and try again next interval
+            logger.exception("Cache maintenance failed")
+            _last_report = {"error": f"{type(e).__name__}: {e}"}
+
+
+def get_last_report() -> Optional[dict]:
+    """Returns the report of the most recent run, or None before the first."""
+    return _last_report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Expire, evict and vacuum the SQLite cache.")
+    parser.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument("--max-rows", type=int, default=CACHE_MAX_ROWS, help="verdict row budget (0 = unlimited)")
+    parser.add_argument("--max-db-bytes", type=int, default=CACHE_MAX_DB_BYTES, help="byte budget for cached verdicts and products (0 = unlimited)")
+    parser.add_argument(
+        "--enable-incremental-vacuum", action="store_true",
+        help="switch an existing database to incremental vacuum (full VACUUM; stop the server first)",
+    )
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.enable_incremental_vacuum:
+        db.enable_incremental_vacuum()
+        print("Incremental vacuum enabled.")
+
+    async def run() -> dict:
+        try:
+            return await run_maintenance(args.batch_size, args.max_rows, args.max_db_bytes)
+        finally:
+            db.shutdown_executors()
+
+    report = asyncio.run(run())
+    expired = ", ".join(f"{count:,} {table}" for table, count in report["expired"].items())
+    print(f"Expired: {expired}")
+    print(f"Evicted {report['evicted']:,} barcodes; vacuumed {report['vacuumed_pages'] or 0:,} pages")
+    print(
+        f"Now {report['verdicts']:,} verdicts in {report['cache_bytes']:,} bytes, {report['used_bytes']:,} bytes used, "
+        f"{report['free_bytes']:,} free ({report['seconds']:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Aho-Corasick multi-pattern matcher for finding known substances inside
+free-text ingredients ("preservative: sodium benzoate", "colour e150d").
+
+The automaton is built once from every known name and alias and finds all
+matches in a single linear pass over the text. Matches must sit on word
+boundaries, so "msg" matches "flavour enhancer msg" but not "msgx".
+
+Claims of absence are not mentions: a match followed by "free"
+("aspartame-free") or inside a negation ("no added msg", "without
+aspartame", "uncured (no nitrates added)") is ignored.
+"""
+
+import json
+import re
+from collections import deque
+from pathlib import Path
+from typing import Iterable, Optional
+
+CARCINOGENS_PATH = Path(__file__).parent.parent / "assets" / "data" / "carcinogens.json"
+
+# Carcinogen aliases that are also everyday words ("Equal" the sweetener
+# brand vs "equal parts") and would cause false positives in free text
+AMBIGUOUS_ALIASES = frozenset({"equal"})
+
+# Names that are also the head noun of unrelated compounds ("sugar alcohol",
+# "cetyl alcohol", "benzyl alcohol"). They, and aliases ending in them
+# ("ethyl alcohol"), only match when they are the whole ingredient.
+GENERIC_NAMES = frozenset({"alcohol"})
+
+# Carcinogen aliases too broad to trust inside longer text ("lamb's
+# lettuce", "vegan beef style pieces", "pork gelatin"); like generic names
+# they only match as the whole ingredient
+BROAD_ALIASES = frozenset({"beef", "pork", "lamb"})
+
+# "free" right after a match: "alcohol free", "msg-free"
+_FREE_SUFFIX = re.compile(r"[\s-]*free\b")
+
+# Words opening a negation ("no msg", "contains no aspartame", "without
+# nitrites"), but not quantities ("not more than 2% sodium benzoate")
+_NEGATION = re.compile(r"\b(?:no|not|without)\b(?!\s+(?:more|less)\s+than\b)")
+
+# Ends a negation's scope: "no nitrates added except those in celery
+# powder", "no msg but contains aspartame", "uncured (no nitrates) pork"
+_NEGATION_END = re.compile(r"[.:;()\[\]]|\b(?:but|except|contains?|plus)\b")
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton mapping lowercase patterns to values.
+    Patterns in whole_only match only when they are all of the text
+    (apart from spaces and punctuation).
+    """
+
+    def __init__(self, patterns: Iterable[tuple[str, str]], whole_only: Iterable[str] = ()):
+        # Node i: transitions in _goto[i], failure link in _fail[i] and
+        # (pattern length, value, whole only) outputs in _out[i], including
+        # those inherited through the failure chain.
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, str, bool]]] = [[]]
+        self.size = 0
+
+        whole_only = frozenset(whole_only)
+        for pattern, value in patterns:
+            if pattern:
+                self._add(pattern, value, pattern in whole_only)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, value: str, whole: bool = False) -> None:
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        if (len(pattern), value, whole) not in self._out[node]:
+            self._out[node].append((len(pattern), value, whole))
+            self.size += 1
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> list[tuple[int, int, str]]:
+        """
+        Returns (start, end, value) for every word-bounded match in text
+        that is not followed by "free" or negated. text is expected to be
+        lowercase already.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                end = i + 1
+                for length, value, whole in out[node]:
+                    start = end - length
+                    if whole and not _is_whole(text, start, end):
+                        continue
+                    if _is_boundary(text, start - 1) and _is_boundary(text, end) and not _FREE_SUFFIX.match(text, end):
+                        matches.append((start, end, value))
+        if matches and _NEGATION.search(text):
+            matches = [match for match in matches if not _is_negated(text, match[0])]
+        return matches
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    """True when index is outside text or not a letter/digit."""
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+def _is_whole(text: str, start: int, end: int) -> bool:
+    """True when text has no letters or digits outside text[start:end]."""
+    return not any(char.isalnum() for char in text[:start]) and not any(char.isalnum() for char in text[end:])
+
+
+def _is_negated(text: str, start: int) -> bool:
+    """True when the match starting at start follows a negation in the same clause."""
+    negation_end = None
+    for negation in _NEGATION.finditer(text, 0, start):
+        negation_end = negation.end()
+    return negation_end is not None and not _NEGATION_END.search(text, negation_end, start)
+
+
+def load_carcinogen_terms(path: Path = CARCINOGENS_PATH) -> list[list[str]]:
+    """Returns the lowercase name + aliases of each carcinogen in the app database."""
+    if not path.exists():
+        return []
+    with open(path, "r") as f:
+        data = json.load(f)
+    return [
+        [term.lower().strip() for term in [entry["name"], *entry.get("aliases", [])]]
+        for entry in data.get("carcinogens", [])
+    ]
+
+
+def build_substance_matcher(
+    ingredient_map: dict[str, str],
+    rule_names: Iterable[str],
+    carcinogen_terms: Optional[list[list[str]]] = None,
+) -> AhoCorasick:
+    """
+    Builds the matcher from ingredient aliases, rule names and the app's
+    carcinogen aliases. Every pattern maps to a canonical ingredient name.
+
+    A carcinogen term with its own rule (directly or through the ingredient
+    map) keeps it; its other terms are mapped to the first term that has
+    one. Carcinogens without a matching rule are skipped because the rules
+    decide the risk. Generic names, aliases ending in one and broad aliases
+    (see GENERIC_NAMES and BROAD_ALIASES) only match whole ingredients.
+    """
+    rules = set(rule_names)
+    patterns: list[tuple[str, str]] = [(alias, canonical) for alias, canonical in ingredient_map.items()]
+    patterns += [(name, name) for name in rules]
+
+    for terms in carcinogen_terms or []:
+        canonical = next(
+            (ingredient_map.get(t, t) for t in terms if ingredient_map.get(t, t) in rules),
+            None,
+        )
+        if canonical is not None:
+            patterns += [
+                (term, ingredient_map.get(term, term) if ingredient_map.get(term, term) in rules else canonical)
+                for term in terms if term not in AMBIGUOUS_ALIASES
+            ]
+
+    whole_only = {
+        term for term, _ in patterns
+        if term in BROAD_ALIASES or term.rsplit(" ", 1)[-1] in GENERIC_NAMES
+    }
+    return AhoCorasick(patterns, whole_only)
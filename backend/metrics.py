@@ -0,0 +1,239 @@
+"""
+In-process metrics for the scan pipeline, exposed in the Prometheus text
+format on GET /metrics.
+
+Counters, gauges and histograms are small objects updated under a lock
+(stages also run on database and re-scoring threads), so recording a
+value costs well under a microsecond and needs no extra dependency.
+Set SAFEEATS_METRICS=0 to turn recording off.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+METRICS_ENABLED = os.environ.get("SAFEEATS_METRICS", "1") == "1"
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow
+# upstream fetches
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+        self.reset()
+        _registry.append(self)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+            if not self.labelnames and self.type != "histogram":
+                self._values[()] = 0  # report unlabelled series from the start
+
+    def _add(self, labels: tuple, amount: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        """Current value of a counter or gauge series (0 if never set)."""
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = sorted(self._values.items())
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, one series per label combination."""
+
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._add(labels, amount)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._add(labels, amount)
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._add(labels, -amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Latency distribution over fixed buckets, with sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per-bucket counts (last one is +Inf), sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observes how long the with-block takes (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def get_count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return sum(series[0]) if series else 0
+
+    def get_sum(self, *labels: str) -> float:
+        series = self._values.get(labels)
+        return series[1] if series else 0.0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in samples:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Returns every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics() -> None:
+    """Clears every series (on startup, like the other in-process counters)."""
+    for metric in _registry:
+        metric.reset()
+
+
+# =============================================================================
+# SCAN PIPELINE METRICS
+# =============================================================================
+
+SCAN_SECONDS = Histogram(
+    "safeeats_scan_seconds",
+    "End-to-end /scan latency by outcome (hot, hit, stale, miss, error).",
+    ("outcome",),
+)
+STAGE_SECONDS = Histogram(
+    "safeeats_scan_stage_seconds",
+    "Time spent in each scan pipeline stage.",
+    ("stage",),
+)
+CACHE_LOOKUPS = Counter(
+    "safeeats_cache_lookups_total",
+    "Scan cache lookups by result (hot = pre-serialized hot-cache hit).",
+    ("result",),
+)
+UPSTREAM_RESPONSES = Counter(
+    "safeeats_upstream_responses_total",
+    "Open Food Facts responses by HTTP status (error = no response).",
+    ("status",),
+)
+UPSTREAM_RESPONSE_BYTES = Counter(
+    "safeeats_upstream_response_bytes_total",
+    "Open Food Facts response body bytes read off the wire (before decompression).",
+)
+SCANS_IN_FLIGHT = Gauge(
+    "safeeats_scans_in_flight",
+    "Scans currently past the hot-cache fast path.",
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "safeeats_upstream_requests_in_flight",
+    "Open Food Facts requests currently in flight.",
+)
+
+# =============================================================================
+# UPSTREAM ADMISSION METRICS
+# =============================================================================
+
+# Circuit breaker states as gauge values
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "safeeats_upstream_circuit_state",
+    "Open Food Facts circuit breaker state (0 closed, 1 half-open, 2 open).",
+)
+UPSTREAM_REJECTED = Counter(
+    "safeeats_upstream_rejected_total",
+    "Open Food Facts requests refused before being sent (circuit_open, rate_limited, overloaded).",
+    ("reason",),
+)
+UPSTREAM_RETRIES = Counter(
+    "safeeats_upstream_retries_total",
+    "Open Food Facts requests sent again after a retryable failure.",
+)
+UPSTREAM_HEDGES = Counter(
+    "safeeats_upstream_hedges_total",
+    "Hedged (second) Open Food Facts requests by result (sent, won).",
+    ("result",),
+)
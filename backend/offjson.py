@@ -0,0 +1,214 @@
+"""
+Incremental extraction of the product fields /scan reads from an Open
+Food Facts API response.
+
+A full product document runs to tens or hundreds of kilobytes (images,
+nutriments, packaging, every language variant), of which a scan needs
+the name and the ingredients text. ProductFieldReader is fed the body
+chunk by chunk as it downloads. It walks the top-level object and the
+"product" object one member at a time, keeps the wanted values, skips
+the rest and says when nothing wanted is left, so the caller can stop
+parsing (and reading) the body.
+
+Wanted fields come in groups in order of preference, e.g.
+("product_name", "product_name_en"): once the first field of a group has
+a non-empty value the later ones cannot change the result, so they are
+not waited for. Open Food Facts only sends a product object for found
+products, so a reader that stops inside it reports status 1 unless the
+document gave a status earlier.
+
+A value split across chunks is decoded again once more data arrives.
+Retries wait until the buffered part of the value has doubled (or grown
+by RESUME_MAX_GAP characters) and until a character that could close it
+has arrived, which keeps repeated decoding of a large value cheap
+without delaying the stop by much.
+"""
+
+import codecs
+import json
+import re
+from typing import Any, Iterable, Optional
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+_scanstring = json.decoder.scanstring
+
+# Parser states
+_START, _KEY_OR_END, _KEY, _COLON, _VALUE, _COMMA_OR_END, _FINISHED = range(7)
+
+# Containers being walked
+_TOP, _PRODUCT = "top", "product"
+
+# Most characters to wait for before decoding a split value again
+RESUME_MAX_GAP = 64 * 1024
+
+# Character that must arrive before a split value can be complete
+_CLOSERS = {"{": "}", "[": "]", '"': '"'}
+
+
+class _Incomplete(Exception):
+    """The buffered text ends inside the next token."""
+
+
+class ProductFieldReader:
+    """Push parser that keeps "status" and the wanted "product" fields."""
+
+    def __init__(self, field_groups: Iterable[Iterable[str]]):
+        self.field_groups = [tuple(group) for group in field_groups]
+        self.fields = frozenset(field for group in self.field_groups for field in group)
+        self.status: Any = None
+        self.product: Optional[dict] = None
+        self.done = False
+        self._has_product = False
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._pos = 0
+        self._chunks: list[str] = []
+        self._buffered = 0
+        self._resume_at = 0
+        self._closer = ""
+        self._state = _START
+        self._containers: list[str] = []
+        self._key = ""
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parses as much of the body as has arrived. Returns True once done."""
+        if not self.done:
+            text = self._utf8.decode(chunk)
+            self._chunks.append(text)
+            self._buffered += len(text)
+            if self._closer and self._closer in text:
+                self._closer = ""
+            if self._buffered >= self._resume_at and not self._closer:
+                self._advance(final=False)
+        return self.done
+
+    def result(self) -> dict:
+        """
+        The extracted document, {"status": ..., "product": {...}}, after the
+        last chunk. Raises ValueError if the body was malformed or ended
+        before the wanted fields could be known.
+        """
+        if not self.done:
+            self._chunks.append(self._utf8.decode(b"", final=True))
+            self._advance(final=True)
+        if not self.done:
+            raise ValueError("Open Food Facts response ended early")
+        document = {"status": self.status}
+        if self._has_product:
+            document["product"] = self.product
+        return document
+
+    def _wanted_fields_found(self) -> bool:
+        product = self.product
+        return all(product.get(group[0]) for group in self.field_groups)
+
+    def _advance(self, final: bool) -> None:
+        self._text = self._text[self._pos:] + "".join(self._chunks)
+        self._pos = 0
+        self._chunks.clear()
+        self._buffered = len(self._text)
+        self._resume_at = 0
+        self._closer = ""
+        try:
+            while not self.done:
+                self._step(final)
+        except _Incomplete:
+            if final:
+                raise ValueError("Open Food Facts response is not valid JSON")
+
+    def _next_char(self) -> str:
+        self._pos = _WHITESPACE.match(self._text, self._pos).end()
+        if self._pos >= len(self._text):
+            raise _Incomplete
+        return self._text[self._pos]
+
+    def _expect(self, char: str) -> None:
+        if self._next_char() != char:
+            raise ValueError(f"Open Food Facts response: expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def _step(self, final: bool) -> None:
+        state = self._state
+        if state == _START:
+            self._expect("{")
+            self._containers.append(_TOP)
+            self._state = _KEY_OR_END
+        elif state in (_KEY_OR_END, _KEY):
+            if state == _KEY_OR_END and self._next_char() == "}":
+                self._pos += 1
+                self._close_container()
+                return
+            self._expect('"')
+            try:
+                self._key, self._pos = _scanstring(self._text, self._pos)
+            except json.JSONDecodeError:
+                self._pos -= 1  # re-read the key from its opening quote
+                raise _Incomplete
+            self._state = _COLON
+        elif state == _COLON:
+            self._expect(":")
+            self._state = _VALUE
+        elif state == _VALUE:
+            self._read_value(final)
+        elif state == _COMMA_OR_END:
+            char = self._next_char()
+            self._pos += 1
+            if char == ",":
+                self._state = _KEY
+            elif char == "}":
+                self._close_container()
+            else:
+                raise ValueError(f"Open Food Facts response: unexpected {char!r} at offset {self._pos - 1}")
+
+    def _read_value(self, final: bool) -> None:
+        container = self._containers[-1]
+        char = self._next_char()
+        if container == _TOP and self._key == "product" and char == "{":
+            self._pos += 1
+            self._has_product = True
+            self.product = {}
+            self._containers.append(_PRODUCT)
+            self._state = _KEY_OR_END
+            return
+        start = self._pos
+        try:
+            value, end = _decoder.raw_decode(self._text, start)
+            # A number or literal at the end of the buffer may continue in the next chunk
+            incomplete = end == len(self._text) and not final
+        except json.JSONDecodeError:
+            incomplete = True
+        if incomplete:
+            self._resume_at = len(self._text) + min(len(self._text) - start, RESUME_MAX_GAP)
+            self._closer = _CLOSERS.get(char, "")
+            raise _Incomplete
+        self._pos = end
+        self._state = _COMMA_OR_END
+        if container == _TOP:
+            if self._key == "status":
+                self.status = value
+            elif self._key == "product":
+                self.product = value
+                self._has_product = value is not None
+        elif self._key in self.fields:
+            self.product[self._key] = value
+            if self._wanted_fields_found():
+                self._finish()
+
+    def _close_container(self) -> None:
+        container = self._containers.pop()
+        self._state = _COMMA_OR_END
+        if container == _PRODUCT:
+            # Keep reading for a status that follows the product (it is small)
+            if self.status is not None:
+                self._finish()
+        elif not self._containers:
+            self._state = _FINISHED
+            self.done = True
+
+    def _finish(self) -> None:
+        """Every wanted field is known: stop parsing."""
+        if self.status is None and self._has_product:
+            self.status = 1
+        self._state = _FINISHED
+        self.done = True
@@ -0,0 +1,159 @@
+"""
+Offline product store importer.
+
+Streams a local Open Food Facts export into the local_products table so
+/scan can resolve barcodes without calling the Open Food Facts API.
+
+Supported inputs (optionally gzipped, detected from the file name):
+- JSONL / NDJSON product dumps (openfoodfacts-products.jsonl.gz)
+- CSV / TSV exports (en.openfoodfacts.org.products.csv.gz, tab-separated)
+
+Files are read one record at a time and written in batched transactions,
+so memory use is constant regardless of dump size.
+
+Usage:
+    python offline_import.py openfoodfacts-products.jsonl.gz
+    python offline_import.py en.openfoodfacts.org.products.csv.gz --batch-size 10000
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+from app import validate_barcode
+from db import init_db, upsert_local_products, LOCAL_PRODUCT_FIELDS
+
+DEFAULT_BATCH_SIZE = 5000
+PROGRESS_EVERY = 100_000
+# Longest CSV/TSV field accepted. Longer fields come from broken rows
+# (e.g. an unclosed quote in a comma-separated file) and are skipped
+# rather than read into memory.
+CSV_FIELD_SIZE_LIMIT = 1 << 20
+
+
+def open_dump(path: Path) -> IO[str]:
+    """Opens a dump as text, transparently decompressing .gz files."""
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def dump_format(path: Path) -> str:
+    """Returns "jsonl" or "csv" based on the file name."""
+    name = path.name.lower().removesuffix(".gz")
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith((".csv", ".tsv")):
+        return "csv"
+    raise ValueError(f"Unsupported dump format: {path.name}")
+
+
+def iter_jsonl_records(stream: IO[str]) -> Iterator[dict]:
+    """Yields one product dict per non-empty JSON line, skipping bad lines."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict):
+            yield record
+
+
+def iter_csv_records(stream: IO[str]) -> Iterator[dict]:
+    """
+    Yields one row dict per CSV/TSV record (delimiter taken from the header).
+
+    The Open Food Facts TSV export is not quoted, so quote characters in
+    tab-separated input are read as text; honouring them would let one
+    stray quote swallow the rest of the file. Rows that cannot be parsed
+    yield an empty dict, which the importer counts as skipped.
+    """
+    csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+    header = stream.readline()
+    delimiter = "\t" if "\t" in header else ","
+    quoting = csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL
+    fieldnames = next(csv.reader([header], delimiter=delimiter, quoting=quoting))
+    reader = csv.DictReader(stream, fieldnames=fieldnames, delimiter=delimiter, quoting=quoting)
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            yield {}
+
+
+def extract_product(record: dict) -> Optional[tuple]:
+    """
+    Pulls the fields /scan uses out of a dump record.
+    Returns None for records without a valid barcode or any ingredients text.
+    """
+    barcode = str(record.get("code") or "").strip()
+    if not validate_barcode(barcode):
+        return None
+    values = tuple((record.get(field) or None) for field in LOCAL_PRODUCT_FIELDS)
+    product_name, product_name_en, ingredients_text, ingredients_text_en = values
+    if not ingredients_text and not ingredients_text_en:
+        return None
+    return (barcode,) + values
+
+
+def import_dump(path: Path, batch_size: int = DEFAULT_BATCH_SIZE, progress: bool = False) -> dict:
+    """
+    Streams a dump into the offline product store.
+
+    Returns counts of records read, imported and skipped.
+    """
+    fmt = dump_format(path)
+    stats = {"read": 0, "imported": 0, "skipped": 0}
+    batch: list[tuple] = []
+    start = time.perf_counter()
+
+    with open_dump(path) as stream:
+        records = iter_jsonl_records(stream) if fmt == "jsonl" else iter_csv_records(stream)
+        for record in records:
+            stats["read"] += 1
+            product = extract_product(record)
+            if product is None:
+                stats["skipped"] += 1
+            else:
+                batch.append(product)
+            if len(batch) >= batch_size:
+                upsert_local_products(batch)
+                stats["imported"] += len(batch)
+                batch.clear()
+            if progress and stats["read"] % PROGRESS_EVERY == 0:
+                rate = stats["read"] / (time.perf_counter() - start)
+                print(f"  {stats['read']:,} read, {stats['imported']:,} imported ({rate:,.0f} records/s)")
+
+    if batch:
+        upsert_local_products(batch)
+        stats["imported"] += len(batch)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import an Open Food Facts dump into the offline product store.")
+    parser.add_argument("dump", type=Path, help="JSONL or CSV/TSV export, optionally .gz")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="records per transaction")
+    args = parser.parse_args()
+
+    init_db()
+    start = time.perf_counter()
+    stats = import_dump(args.dump, batch_size=args.batch_size, progress=True)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Imported {stats['imported']:,} products from {args.dump.name} "
+        f"({stats['read']:,} read, {stats['skipped']:,} skipped) in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Re-scores every stored product under the current rules.
+
+After a rules release (RULES_VERSION bump) stored products have no verdict
+for the new version. This job streams them out of SQLite in chunks, classifies
+them across a process pool and writes the verdicts back through the
+database writer thread, one transaction per chunk, so the cache is warm
+again in minutes instead of lazily over a day of traffic.
+
+Only products still missing a current verdict are selected, so an
+interrupted run simply picks up where it stopped when started again.
+
+Runs as a background task on server startup (SAFEEATS_RESCORE_ON_STARTUP)
+and from the command line:
+    python rescore.py
+    python rescore.py --workers 8 --chunk-size 1000
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional
+
+from db import init_db, get_products_without_verdict, cache_scans, run_on_writer_sync, shutdown_executors
+from rules import RULES_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Run the job in the background when the server starts
+RESCORE_ON_STARTUP = os.environ.get("SAFEEATS_RESCORE_ON_STARTUP", "1") == "1"
+# Products per chunk (one read query, one worker task, one write transaction)
+RESCORE_CHUNK_SIZE = int(os.environ.get("SAFEEATS_RESCORE_CHUNK_SIZE", 500))
+# Worker processes; 0 classifies in the calling process
+RESCORE_WORKERS = int(os.environ.get("SAFEEATS_RESCORE_WORKERS", os.cpu_count() or 1))
+
+
+def score_rows(rows: list[tuple]) -> list[tuple[str, Optional[dict]]]:
+    """
+    Classifies (barcode, product_name, ingredients_text) rows.
+    Returns (barcode, response) pairs; response is None when nothing parses.
+    """
+    # Imported here so worker processes load the classifier without the
+    # server importing this module in a cycle
+    from fastapi import HTTPException
+    from app import score_product
+
+    results = []
+    for barcode, product_name, ingredients_text in rows:
+        try:
+            results.append((barcode, score_product(product_name, ingredients_text)))
+        except HTTPException:
+            results.append((barcode, None))
+    return results
+
+
+class RescoreJob:
+    """One re-scoring pass over the products table."""
+
+    def __init__(
+        self,
+        rules_version: str = RULES_VERSION,
+        chunk_size: int = RESCORE_CHUNK_SIZE,
+        workers: int = RESCORE_WORKERS,
+        progress: Optional[Callable[[dict], None]] = None,
+    ):
+        self.rules_version = rules_version
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.progress = progress
+        self._stop = threading.Event()
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.read = 0
+        self.rescored = 0
+        self.skipped = 0
+
+    def stop(self) -> None:
+        """Asks the job to finish after the chunk being written."""
+        self._stop.set()
+
+    def stats(self) -> dict:
+        """Returns progress and throughput so far."""
+        if self._started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished_at or time.perf_counter()) - self._started_at
+        return {
+            "rules_version": self.rules_version,
+            "running": self._started_at is not None and self._finished_at is None,
+            "read": self.read,
+            "rescored": self.rescored,
+            "skipped": self.skipped,
+            "seconds": round(elapsed, 3),
+            "products_per_second": round(self.read / elapsed, 1) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+    def _chunks(self):
+        """Yields chunks of products without a current verdict, in barcode order."""
+        after = ""
+        while not self._stop.is_set():
+            rows = get_products_without_verdict(self.rules_version, after, self.chunk_size)
+            if not rows:
+                return
+            after = rows[-1][0]
+            yield rows
+
+    def _write(self, results: list[tuple[str, Optional[dict]]]) -> None:
+        responses = {barcode: response for barcode, response in results if response is not None}
+        if responses:
+            # Queued on the single writer thread, behind live cache writes;
+            # bulk re-scoring must not evict the traffic-driven hot cache
+            run_on_writer_sync(cache_scans, responses, hot=False)
+        self.read += len(results)
+        self.rescored += len(responses)
+        self.skipped += len(results) - len(responses)
+        if self.progress is not None:
+            self.progress(self.stats())
+
+    def run(self) -> dict:
+        """
+        Runs the pass to completion (or until stopped). Returns stats().
+        A failure ends the pass early and is logged and reported as
+        stats()["error"] rather than raised; chunks already written stay.
+        """
+        self._started_at = time.perf_counter()
+        self._finished_at = None
+        self.error = None
+        try:
+            if self.workers <= 0:
+                for rows in self._chunks():
+                    self._write(score_rows(rows))
+            else:
+                self._run_pool()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Re-scoring for rules %s failed", self.rules_version)
+        finally:
+            self._finished_at = time.perf_counter()
+        return self.stats()
+
+    def _run_pool(self) -> None:
+        chunks = self._chunks()
+        first = next(chunks, None)
+        if first is None:
+            return  # nothing to do, skip starting worker processes
+
+        # spawn: forking a process that runs an event loop and database
+        # threads can copy held locks into the children
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            # A couple of chunks per worker in flight keeps the pool busy
+            # while results are written back in order
+            pending: deque[Future] = deque([pool.submit(score_rows, first)])
+            for rows in chunks:
+                pending.append(pool.submit(score_rows, rows))
+                if len(pending) >= 2 * self.workers:
+                    self._write(pending.popleft().result())
+                    if self._stop.is_set():
+                        break
+            while pending and not self._stop.is_set():
+                self._write(pending.popleft().result())
+            for future in pending:
+                future.cancel()
+
+
+def _print_progress(stats: dict) -> None:
+    print(
+        f"  {stats['read']:,} read, {stats['rescored']:,} rescored, "
+        f"{stats['skipped']:,} skipped ({stats['products_per_second']:,.0f} products/s)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-score stored products under the current rules.")
+    parser.add_argument("--workers", type=int, default=RESCORE_WORKERS, help="worker processes (0 = in-process)")
+    parser.add_argument("--chunk-size", type=int, default=RESCORE_CHUNK_SIZE, help="products per chunk")
+    args = parser.parse_args()
+
+    init_db()
+    job = RescoreJob(chunk_size=args.chunk_size, workers=args.workers, progress=_print_progress)
+    try:
+        stats = job.run()
+    except KeyboardInterrupt:
+        stats = job.stats()
+        print("Interrupted; run again to resume.")
+    finally:
+        shutdown_executors()
+    print(
+        f"Rescored {stats['rescored']:,} products for rules {stats['rules_version']} "
+        f"({stats['read']:,} read, {stats['skipped']:,} skipped) in {stats['seconds']:.1f}s"
+    )
+    if stats["error"]:
+        raise SystemExit(f"Failed: {stats['error']}; run again to resume.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Admission control for upstream calls: a token-bucket rate limiter, a cap
+on calls in flight, a circuit breaker, and the deadline, retry and hedging
+helpers used around them.
+
+When Open Food Facts is degraded, every fetch would otherwise wait out the
+full timeout before failing, and those waiters pile up in the server. The
+breaker opens after consecutive failures so calls fail fast (or the app
+falls back to stale cached data), then lets a single probe through after a
+cool-down to find out whether upstream has recovered.
+
+Retries and hedged requests draw from a shared RetryBudget, so together
+they add at most a fixed fraction on top of the first attempts and cannot
+multiply load on an upstream that is already struggling.
+
+All state lives on one event loop; nothing here is thread-safe.
+"""
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterator, NamedTuple, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was refused before it was made."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        # "circuit_open", "rate_limited" or "overloaded"
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Whole seconds for a Retry-After header (at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+# =============================================================================
+# DEADLINES
+# =============================================================================
+
+# Monotonic time by which the current request must finish (None = no deadline).
+# Tasks started while a deadline is set (e.g. a shared single-flight fetch)
+# inherit it.
+_deadline: ContextVar[Optional[float]] = ContextVar("safeeats_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[None]:
+    """Gives upstream calls made inside the block seconds to finish (0 = no deadline)."""
+    token = _deadline.set(time.monotonic() + seconds if seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current deadline (may be negative), or None."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# =============================================================================
+# RETRIES AND HEDGING
+# =============================================================================
+
+class RetryPolicy(NamedTuple):
+    """How a failed or slow upstream call is repeated."""
+
+    retries: int  # extra attempts after the first
+    base_delay: float  # backoff before the first retry (upper bound, seconds)
+    max_delay: float  # cap on any backoff
+    hedge: bool  # send a second request when the first is slower than p95
+    hedge_min_delay: float  # never hedge sooner than this (seconds)
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Callable[[], float] = random.random) -> float:
+    """
+    Full-jitter exponential backoff: a uniform delay between 0 and
+    min(cap, base * 2**attempt) before retry number attempt (0-based).
+    """
+    return rng() * min(cap, base * 2 ** attempt)
+
+
+class RetryBudget:
+    """
+    Caps retries and hedges at ratio times the first attempts: every first
+    attempt deposits ratio tokens (up to max_tokens) and every retry or
+    hedge spends one.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self.exhausted = 0
+
+    def record_request(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self, keep: float = 0.0) -> bool:
+        """Spends a token if at least keep tokens would be left."""
+        if self._tokens - 1 >= keep:
+            self._tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class LatencyWindow:
+    """Recent upstream latencies, for percentile-based hedge delays."""
+
+    # Re-sort the window after this many new samples rather than every read
+    RESORT_EVERY = 16
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+        self._sorted: list[float] = []
+        self._unsorted = 0
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._unsorted += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-quantile (0-1) of the window, or None with too few samples."""
+        if len(self._samples) < self.min_samples:
+            return None
+        if self._unsorted >= self.RESORT_EVERY or len(self._sorted) < self.min_samples:
+            self._sorted = sorted(self._samples)
+            self._unsorted = 0
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+# =============================================================================
+# ADMISSION CONTROL
+# =============================================================================
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average with bursts of up to burst.
+
+    Callers over the rate are delayed until their token is due, as long as
+    that is within max_wait seconds; later ones are refused. A rate of 0
+    disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int, max_wait: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, returning how long to wait before using it.
+        Raises UpstreamUnavailable if that would be longer than max_wait.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Tokens go negative while callers queue for future ones
+        wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        if wait > self.max_wait:
+            raise UpstreamUnavailable("rate_limited", wait)
+        self._tokens -= 1
+        return wait
+
+    def has_token(self) -> bool:
+        """Whether a call now would go through without waiting."""
+        if self.rate <= 0:
+            return True
+        return min(self.burst, self._tokens + (self._clock() - self._updated) * self.rate) >= 1
+
+    async def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through; failure_threshold consecutive failures open it.
+    Open: calls are refused until reset_timeout seconds have passed.
+    Half-open: one probe call goes through; success closes the breaker,
+    failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    def before_call(self) -> bool:
+        """
+        Raises UpstreamUnavailable unless a call may be made now.
+        Returns True when the call is the half-open probe.
+        """
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and not self._probe_in_flight:
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        retry_after = max(0.0, self._opened_at + self.reset_timeout - self._clock())
+        raise UpstreamUnavailable("circuit_open", retry_after)
+
+    def record_success(self) -> None:
+        self._failures = 0
+        if self._state == HALF_OPEN:
+            self._state = CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            self._state = OPEN
+            self._opened_at = self._clock()
+            self._probe_in_flight = False
+            self.trips += 1
+
+    def release_probe(self) -> None:
+        """Lets another probe through if one ended without an outcome (e.g. cancelled)."""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        state = self.state
+        retry_in = self._opened_at + self.reset_timeout - self._clock() if state == OPEN else 0.0
+        return {
+            "state": state,
+            "consecutive_failures": self._failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_in_seconds": round(max(0.0, retry_in), 3),
+        }
+
+
+class UpstreamGuard:
+    """
+    Breaker, rate limit and in-flight cap applied to every upstream call,
+    plus the retry budget and latency window shared by its callers.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        bucket: TokenBucket,
+        max_in_flight: int,
+        queue_timeout: float,
+        retry_policy: RetryPolicy,
+        retry_budget: RetryBudget,
+        latency: LatencyWindow,
+    ):
+        self.breaker = breaker
+        self.bucket = bucket
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.retry_policy = retry_policy
+        self.retry_budget = retry_budget
+        self.latency = latency
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.rejected = {"circuit_open": 0, "rate_limited": 0, "overloaded": 0}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def has_spare_capacity(self) -> bool:
+        """
+        Whether an extra (hedged) call would be admitted straight away: the
+        breaker is closed, a slot is free and the rate limit has a token.
+        """
+        return self.breaker.state == CLOSED and not self._slots.locked() and self.bucket.has_token()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Admits one upstream call. Raises UpstreamUnavailable when the breaker
+        is open, the rate limit is exhausted, or no slot frees up within
+        queue_timeout. Record the outcome with the breaker inside the block.
+        """
+        try:
+            probe = self.breaker.before_call()
+            try:
+                await self.bucket.acquire()
+                if not self._slots.locked():
+                    await self._slots.acquire()  # free slot: skip wait_for's extra task
+                else:
+                    try:
+                        await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+                    except asyncio.TimeoutError:
+                        raise UpstreamUnavailable("overloaded", self.queue_timeout)
+            except BaseException:
+                if probe:
+                    self.breaker.release_probe()
+                raise
+        except UpstreamUnavailable as e:
+            self.rejected[e.reason] += 1
+            raise
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            # A probe that recorded neither outcome must not block the next one
+            if probe and self.breaker.state == HALF_OPEN:
+                self.breaker.release_probe()
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.stats(),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rate_limit_per_second": self.bucket.rate,
+            "rejected": dict(self.rejected),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "deadline_exceeded": self.deadline_exceeded,
+            "latency_p95_seconds": self.latency.percentile(0.95),
+        }
@@ -22,15 +22,16 @@ we use the following priority order (higher = more authoritative):
 """
 
 
-from typing import TypedDict, Optional
+import sys
+from typing import Iterable, NamedTuple, TypedDict, Optional
 
 
 # =============================================================================
 # VERSION INFORMATION
 # =============================================================================
 
-RULES_VERSION = "1.0.0"
-RULES_LAST_UPDATED = "2024-12-24"
+RULES_VERSION = "1.1.0"
+RULES_LAST_UPDATED = "2026-10-17"
 
 RULES_METADATA = {
     "version": RULES_VERSION,
@@ -139,6 +140,18 @@ RISK_RULES: dict[str, RiskRule] = {
         "iarc_group": "Group 2A",
         "notes": "Converts to nitrite in the body. Used in cured meats."
     },
+    "potassium nitrite": {
+        "risk": "high",
+        "source": "IARC_GROUP_2A",
+        "iarc_group": "Group 2A",
+        "notes": "Same as sodium nitrite - preservative (E249) in cured meats."
+    },
+    "potassium nitrate": {
+        "risk": "high",
+        "source": "IARC_GROUP_2A",
+        "iarc_group": "Group 2A",
+        "notes": "Same as sodium nitrate - preservative (E252) in cured meats."
+    },
     "erythrosine": {
         "risk": "high",
         "source": "PROP65_CARCINOGEN",
@@ -339,6 +352,64 @@ DEFAULT_RISK = "safe"
 DEFAULT_SOURCE = "NONE"
 
 
+# =============================================================================
+# COMPILED RULES TABLE
+# =============================================================================
+
+# Risk levels in ascending order; a level's index is its integer risk code
+RISK_LEVELS = ("safe", "low", "moderate", "high", "critical")
+RISK_CODES = {level: code for code, level in enumerate(RISK_LEVELS)}
+
+# Integer source codes, in SOURCE_PRIORITY order
+SOURCES = tuple(SOURCE_PRIORITY)
+SOURCE_CODES = {source: code for code, source in enumerate(SOURCES)}
+
+
+class CompiledRule(NamedTuple):
+    """A rule precompiled for lookups: integer codes plus the ready-made result tuple."""
+    rule_id: int
+    risk_code: int
+    source_code: int
+    result: tuple[str, str, Optional[str]]
+
+
+_DEFAULT_RESULT = (DEFAULT_RISK, DEFAULT_SOURCE, None)
+
+# Canonical name (interned, lowercase) -> CompiledRule, and each rule's
+# result indexed by rule_id. Rebuilt by compile_rules().
+_RULE_TABLE: dict[str, CompiledRule] = {}
+_RULE_RESULTS: tuple[tuple[str, str, Optional[str]], ...] = ()
+
+
+def compile_rules(rules: Optional[dict[str, RiskRule]] = None) -> None:
+    """
+    Compiles RISK_RULES (or the given rules) into the lookup table.
+    
+    Runs at import; call again after editing or reloading the rules. The
+    new table is built aside and swapped in with a single assignment, so
+    concurrent lookups never see a half-built table.
+    """
+    global _RULE_TABLE, _RULE_RESULTS
+    
+    table = {}
+    results = []
+    for rule_id, (name, rule) in enumerate((rules if rules is not None else RISK_RULES).items()):
+        risk = sys.intern(rule["risk"])
+        source = sys.intern(rule["source"])
+        result = (risk, source, rule.get("notes"))
+        table[sys.intern(name.lower())] = CompiledRule(
+            rule_id=rule_id,
+            risk_code=RISK_CODES[risk],
+            source_code=SOURCE_CODES[source],
+            result=result,
+        )
+        results.append(result)
+    _RULE_TABLE, _RULE_RESULTS = table, tuple(results)
+
+
+compile_rules()
+
+
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
@@ -353,10 +424,7 @@ def get_risk(canonical_name: str) -> str:
     Returns:
         Risk level string: "safe", "low", "moderate", "high", or "critical"
     """
-    rule = RISK_RULES.get(canonical_name.lower())
-    if rule:
-        return rule["risk"]
-    return DEFAULT_RISK
+    return get_risk_with_source(canonical_name)[0]
 
 
 def get_risk_with_source(canonical_name: str) -> tuple[str, str, Optional[str]]:
@@ -372,10 +440,10 @@ def get_risk_with_source(canonical_name: str) -> tuple[str, str, Optional[str]]:
     Returns:
         Tuple of (risk_level, source, notes)
     """
-    rule = RISK_RULES.get(canonical_name.lower())
-    if rule:
-        return rule["risk"], rule["source"], rule.get("notes")
-    return DEFAULT_RISK, DEFAULT_SOURCE, None
+    compiled = _RULE_TABLE.get(canonical_name) or _RULE_TABLE.get(canonical_name.lower())
+    if compiled is None:
+        return _DEFAULT_RESULT
+    return compiled[3]
 
 
 def get_overall_risk(risks: list[str]) -> str:
@@ -394,9 +462,52 @@ def get_overall_risk(risks: list[str]) -> str:
     if not risks:
         return DEFAULT_RISK
     
-    risk_order = {"safe": 0, "low": 1, "moderate": 2, "high": 3, "critical": 4}
-    max_risk = max(risks, key=lambda r: risk_order.get(r, 0))
-    return max_risk
+    return RISK_LEVELS[max(RISK_CODES.get(r, 0) for r in risks)]
+
+
+def classify_many(canonical_names: Iterable[str]) -> tuple[list[tuple[str, str, Optional[str]]], str]:
+    """
+    Classifies a batch of canonical ingredient names in one pass.
+    
+    Args:
+        canonical_names: Normalized ingredient names
+        
+    Returns:
+        Tuple of (per-name (risk_level, source, notes) results, overall risk).
+        The overall risk is a running max over integer risk codes.
+    """
+    table = _RULE_TABLE
+    results = []
+    top = 0
+    for name in canonical_names:
+        compiled = table.get(name) or table.get(name.lower())
+        if compiled is None:
+            results.append(_DEFAULT_RESULT)
+            continue
+        results.append(compiled[3])
+        if compiled[1] > top:
+            top = compiled[1]
+    return results, RISK_LEVELS[top]
+
+
+def get_rule_id(canonical_name: str) -> Optional[int]:
+    """
+    Returns the rule ID (position in RISK_RULES) for a canonical ingredient
+    name, or None if no rule matches. IDs are only stable within one
+    rules version.
+    """
+    compiled = _RULE_TABLE.get(canonical_name) or _RULE_TABLE.get(canonical_name.lower())
+    return None if compiled is None else compiled[0]
+
+
+def get_rule_result(rule_id: int) -> tuple[str, str, Optional[str]]:
+    """
+    Returns the (risk_level, source, notes) of a rule by ID.
+    
+    Raises:
+        IndexError: If no rule has this ID
+    """
+    return _RULE_RESULTS[rule_id]
 
 
 def get_rules_version() -> str:
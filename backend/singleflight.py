@@ -0,0 +1,47 @@
+"""
+In-flight request coalescing ("single-flight") keyed by barcode.
+
+When many concurrent callers ask for the same key, only the first one runs
+the work; the rest await the same task and receive the same result or the
+same exception.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Registry of in-flight tasks, one per key."""
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs fn() once per key at a time and shares its outcome with every waiter.
+
+        The work runs in its own task and each waiter is shielded, so a
+        cancelled caller (e.g. a disconnected client) does not cancel the
+        work for everyone else.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -6,17 +6,53 @@ Tests cover:
 2. /health endpoint
 3. /rules/metadata endpoint
 4. Ingredient normalization
+5. Shared upstream HTTP client lifecycle
+6. Single-flight coalescing of concurrent scans
+7. /scan/batch endpoint
+8. /scan/stream endpoint
+9. Stale-while-revalidate serving of expired cache entries
+10. Negative caching of not-found and no-ingredient products
+11. Pre-serialized (and gzipped) responses for hot-cache hits
+12. ETags and conditional GET (/scan/{barcode}, /rules/metadata)
+13. /metrics endpoint
+14. Upstream circuit breaker and stale fallback
+15. Deadlines, retries and hedged upstream requests
+16. Field-restricted upstream requests and incremental body parsing
 """
 
 
+import asyncio
+import json
 import sys
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app import validate_barcode, normalize_ingredient, parse_ingredients
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from pytest_httpx import IteratorStream
+
+import app as app_module
+import db
+import metrics
+import upstream
+from rules import RULES_VERSION
+from app import app, scan, scan_batch, ScanRequest, BatchScanRequest, BATCH_MAX_SIZE, validate_barcode, normalize_ingredient, parse_ingredients, accepts_gzip, etag_matches, classify_ingredient, score_product
+from db import init_db
+
+
+def off_url(barcode: str) -> str:
+    """The Open Food Facts URL a scan requests: the product, restricted to the fields it reads."""
+    return (
+        f"https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+        "?fields=product_name,product_name_en,ingredients_text,ingredients_text_en"
+    )
 
 
 class TestBarcodeValidation:
@@ -115,6 +151,24 @@ class TestIngredientParsing:
         result = parse_ingredients("sugar, water, sugar, salt, water")
         sugar_count = sum(1 for i in result if i == "sugar")
         assert sugar_count == 1
+    
+    def test_preserves_first_seen_order(self):
+        """Ingredients should come back in label order, deterministically."""
+        result = parse_ingredients("sugar, water, sugar, salt, water, aspartame")
+        assert result == ["sugar", "water", "salt", "aspartame"]
+    
+    def test_removes_nested_parentheses(self):
+        """Nested parenthetical and bracketed info should be removed entirely."""
+        result = parse_ingredients(
+            "flavourings (contains celery (with traces of mustard)), "
+            "chocolate [cocoa (40%), sugar], salt"
+        )
+        assert result == ["flavourings", "chocolate", "salt"]
+    
+    def test_unclosed_parenthesis_is_kept(self):
+        """An unbalanced bracket should not swallow the rest of the list."""
+        result = parse_ingredients("sugar (beet, salt")
+        assert "salt" in result
 
 
 class TestScanEndpoint:
@@ -139,7 +193,7 @@ class TestScanEndpoint:
     def test_product_not_found_returns_404(self, client, httpx_mock):
         """Product not in Open Food Facts should return 404."""
         httpx_mock.add_response(
-            url="https://world.openfoodfacts.org/api/v2/product/1234567890128.json",
+            url=off_url("1234567890128"),
             json={"status": 0, "product": None},
             status_code=200  # The API itself returns 200 even for not found
         )
@@ -151,7 +205,7 @@ class TestScanEndpoint:
     def test_open_food_facts_api_error_returns_502(self, client, httpx_mock):
         """A 500 error from Open Food Facts should return 502."""
         httpx_mock.add_response(
-            url="https://world.openfoodfacts.org/api/v2/product/1234567890128.json",
+            url=off_url("1234567890128"),
             status_code=500
         )
         
@@ -215,7 +269,7 @@ class TestScanResponseFormat:
     def test_successful_scan_response_format(self, client, httpx_mock):
         """A successful scan should return the correct response format."""
         httpx_mock.add_response(
-            url="https://world.openfoodfacts.org/api/v2/product/1234567890128.json",
+            url=off_url("1234567890128"),
             json={
                 "status": 1,
                 "product": {
@@ -237,4 +291,821 @@ class TestScanResponseFormat:
         
         aspartame_result = next(i for i in data["ingredients"] if i["raw"] == "aspartame")
         assert aspartame_result["risk"] == "moderate"
-        assert aspartame_result["source"] == "IARC_GROUP_2B"
\ No newline at end of file
+        assert aspartame_result["source"] == "IARC_GROUP_2B"
+    
+    def test_repeat_scan_is_served_from_cache(self, client, httpx_mock):
+        """A repeat scan should be served from cache without an upstream call."""
+        httpx_mock.add_response(
+            url=off_url("1234567890128"),
+            json={
+                "status": 1,
+                "product": {
+                    "product_name": "Test Product",
+                    "ingredients_text": "water, sugar, aspartame"
+                }
+            }
+        )
+        
+        first = client.post("/scan", json={"barcode": "1234567890128"}).json()
+        second = client.post("/scan", json={"barcode": "1234567890128"}).json()
+        
+        assert len(httpx_mock.get_requests()) == 1
+        assert second["cached"] is True
+        assert second["ingredients"] == first["ingredients"]
+        assert client.get("/cache/stats").json()["hot_cache"]["hits"] == 1
+    
+    def test_rules_change_recomputes_from_stored_product(self, client, httpx_mock):
+        """A verdict missing for the current rules should be recomputed without refetching."""
+        db.cache_scan(
+            "1234567890128",
+            {"product_name": "Test Product", "ingredients": [], "overall_risk": "safe", "rules_version": "0.9.0"},
+            "water, sugar, aspartame"
+        )
+        db._hot_cache.clear()
+        
+        response = client.post("/scan", json={"barcode": "1234567890128"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["cached"] is False
+        assert data["rules_version"] == RULES_VERSION
+        assert data["overall_risk"] == "moderate"
+        assert httpx_mock.get_requests() == []
+    
+    def test_batch_scoring_matches_single_ingredients(self):
+        """Scoring a product in one pass should agree with classifying each ingredient."""
+        text = "water, preservative: sodium benzoate, sodium benzoat, e150d, wheat flour"
+        data = score_product("Test Product", text)
+        expected = [classify_ingredient(raw).model_dump() for raw in parse_ingredients(text)]
+        assert data["ingredients"] == expected
+        assert data["overall_risk"] == "moderate"
+
+class TestUpstreamClient:
+    """Tests for the shared Open Food Facts HTTP client."""
+    
+    def test_lifespan_creates_and_closes_shared_client(self):
+        """The lifespan should own one client and close it on shutdown."""
+        with TestClient(app):
+            client = upstream.get_http_client()
+            assert client is upstream.get_http_client()
+            assert not client.is_closed
+        assert client.is_closed
+    
+    def test_failed_rescore_does_not_stop_shutdown(self, monkeypatch):
+        """A startup rescore failure should be reported and the client still closed."""
+        init_db()
+        
+        def failing_read(*args):
+            raise RuntimeError("database is gone")
+        
+        monkeypatch.setattr(app_module, "RESCORE_ON_STARTUP", True)
+        monkeypatch.setattr("rescore.get_products_without_verdict", failing_read)
+        with TestClient(app) as c:
+            client = upstream.get_http_client()
+            assert wait_for(lambda: c.get("/cache/stats").json()["rescore"]["error"] is not None)
+        assert client.is_closed
+    
+    def test_client_uses_configured_limits(self):
+        """The client should carry the configured per-phase timeouts."""
+        client = upstream.create_http_client()
+        assert client.timeout.connect == upstream.UPSTREAM_CONNECT_TIMEOUT
+        assert client.timeout.read == upstream.UPSTREAM_READ_TIMEOUT
+        assert client.timeout.pool == upstream.UPSTREAM_POOL_TIMEOUT
+
+
+def slow_response(payload: dict, delay: float = 0.1):
+    """Returns an async pytest-httpx callback that answers after a delay."""
+    async def callback(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=payload)
+    return callback
+
+
+class TestSingleFlight:
+    """Tests for coalescing concurrent scans of the same barcode."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_fetch(self, httpx_mock):
+        """Concurrent scans of an uncached barcode should fetch upstream once."""
+        init_db()
+        httpx_mock.add_callback(
+            slow_response({
+                "status": 1,
+                "product": {"product_name": "Viral Product", "ingredients_text": "water, aspartame"}
+            }),
+            url=off_url("1234567890128"),
+        )
+        
+        await upstream.start_http_client()
+        try:
+            results = await asyncio.gather(
+                *(scan(ScanRequest(barcode="1234567890128")) for _ in range(10))
+            )
+        finally:
+            await upstream.close_http_client()
+        
+        assert len(httpx_mock.get_requests()) == 1
+        assert all(r.product_name == "Viral Product" for r in results)
+        assert all(r.overall_risk == "moderate" for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_error(self, httpx_mock):
+        """Every waiter should receive the same error from the single fetch."""
+        init_db()
+        httpx_mock.add_callback(
+            slow_response({"status": 0, "product": None}),
+            url=off_url("1234567890128"),
+        )
+        
+        await upstream.start_http_client()
+        try:
+            results = await asyncio.gather(
+                *(scan(ScanRequest(barcode="1234567890128")) for _ in range(5)),
+                return_exceptions=True
+            )
+        finally:
+            await upstream.close_http_client()
+        
+        assert len(httpx_mock.get_requests()) == 1
+        assert all(isinstance(r, HTTPException) and r.status_code == 404 for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_scan_and_batch_share_one_fetch(self, httpx_mock):
+        """A batch arriving during a /scan miss should join its fetch."""
+        init_db()
+        httpx_mock.add_callback(
+            slow_response({
+                "status": 1,
+                "product": {"product_name": "Viral Product", "ingredients_text": "water, aspartame"}
+            }),
+            url=off_url("1234567890128"),
+        )
+        
+        await upstream.start_http_client()
+        try:
+            single, batch = await asyncio.gather(
+                scan(ScanRequest(barcode="1234567890128")),
+                scan_batch(BatchScanRequest(barcodes=["1234567890128"])),
+            )
+        finally:
+            await upstream.close_http_client()
+        
+        assert len(httpx_mock.get_requests()) == 1
+        assert single.product_name == "Viral Product"
+        assert batch.results[0].status == 200
+        assert batch.results[0].result.product_name == "Viral Product"
+
+
+class TestBatchScanEndpoint:
+    """Tests for the /scan/batch endpoint."""
+    
+    def test_mixed_batch_returns_per_barcode_results(self, client, httpx_mock):
+        """Each barcode should get its own result or error, in request order."""
+        httpx_mock.add_response(
+            url=off_url("1234567890128"),
+            json={
+                "status": 1,
+                "product": {"product_name": "Found Product", "ingredients_text": "water, aspartame"}
+            }
+        )
+        httpx_mock.add_response(
+            url=off_url("12345678"),
+            json={"status": 0, "product": None}
+        )
+        
+        response = client.post(
+            "/scan/batch", json={"barcodes": ["1234567890128", "abc", "12345678"]}
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        
+        assert [r["barcode"] for r in results] == ["1234567890128", "abc", "12345678"]
+        assert results[0]["status"] == 200
+        assert results[0]["result"]["overall_risk"] == "moderate"
+        assert results[1]["status"] == 400
+        assert results[2]["status"] == 404
+        assert "Product not found" in results[2]["error"]
+    
+    def test_batch_serves_cached_results_and_fetches_once(self, client, httpx_mock):
+        """Duplicates fetch once and later batches are served from cache."""
+        httpx_mock.add_response(
+            url=off_url("1234567890128"),
+            json={
+                "status": 1,
+                "product": {"product_name": "Found Product", "ingredients_text": "water, sugar"}
+            }
+        )
+        
+        first = client.post("/scan/batch", json={"barcodes": ["1234567890128", "1234567890128"]})
+        second = client.post("/scan/batch", json={"barcodes": ["1234567890128"]})
+        
+        assert len(httpx_mock.get_requests()) == 1
+        assert [r["result"]["cached"] for r in first.json()["results"]] == [False, False]
+        assert second.json()["results"][0]["result"]["cached"] is True
+    
+    def test_empty_batch_returns_422(self, client):
+        """An empty barcode list should be rejected."""
+        response = client.post("/scan/batch", json={"barcodes": []})
+        assert response.status_code == 422
+    
+    def test_oversized_batch_returns_422(self, client):
+        """Batches above BATCH_MAX_SIZE should be rejected."""
+        barcodes = [str(10000000 + i) for i in range(BATCH_MAX_SIZE + 1)]
+        response = client.post("/scan/batch", json={"barcodes": barcodes})
+        assert response.status_code == 422
+
+
+class TestStreamScanEndpoint:
+    """Tests for the streaming NDJSON /scan/stream endpoint."""
+    
+    def _mock_product(self, httpx_mock):
+        httpx_mock.add_response(
+            url=off_url("1234567890128"),
+            json={
+                "status": 1,
+                "product": {"product_name": "Found Product", "ingredients_text": "water, aspartame"}
+            }
+        )
+    
+    def test_json_body_streams_one_line_per_barcode(self, client, httpx_mock):
+        """A JSON barcode list should produce one NDJSON line per barcode."""
+        self._mock_product(httpx_mock)
+        
+        response = client.post("/scan/stream", json={"barcodes": ["1234567890128", "abc"]})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        by_barcode = {line["barcode"]: line for line in lines}
+        assert len(lines) == 2
+        assert by_barcode["1234567890128"]["status"] == 200
+        assert by_barcode["1234567890128"]["result"]["overall_risk"] == "moderate"
+        assert by_barcode["abc"]["status"] == 400
+    
+    def test_line_delimited_body(self, client, httpx_mock):
+        """A streamed body with one barcode (or object) per line should be accepted."""
+        self._mock_product(httpx_mock)
+        
+        def body():
+            yield b"1234567890128\n"
+            yield b'{"barcode": "1234567890128"}\n123'
+            yield b"\n"
+        
+        response = client.post(
+            "/scan/stream", content=body(), headers={"content-type": "application/x-ndjson"}
+        )
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["status"] for line in lines].count(200) == 2
+        assert [line["status"] for line in lines].count(400) == 1
+    
+    def test_invalid_json_body_returns_422(self, client):
+        """A JSON body without a barcode list should be rejected up front."""
+        response = client.post("/scan/stream", json={"barcodes": "1234567890128"})
+        assert response.status_code == 422
+    
+    def test_malformed_json_body_returns_422(self, client):
+        """A body that is not valid JSON should get the same 422, not a server error."""
+        response = client.post(
+            "/scan/stream", content=b'{"barcodes": ["1234567890128"', headers={"content-type": "application/json"}
+        )
+        assert response.status_code == 422
+
+
+STALE_BARCODE = "1234567890128"
+STALE_URL = off_url(STALE_BARCODE)
+STALE_PRODUCT = {"status": 1, "product": {"product_name": "Fresh Product", "ingredients_text": "water, aspartame"}}
+
+
+def store_expired_scan(hours_past_ttl: float) -> None:
+    """Caches a verdict for STALE_BARCODE that expired the given hours ago."""
+    db.cache_scan(STALE_BARCODE, {
+        "product_name": "Old Product",
+        "ingredients": [],
+        "overall_risk": "safe",
+        "rules_version": RULES_VERSION,
+    })
+    updated_at = datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS + hours_past_ttl)
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE verdicts SET updated_at = ?", (updated_at.isoformat(),))
+    db._hot_cache.clear()
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    """Polls condition until it is true or the timeout passes."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestStaleWhileRevalidate:
+    """Tests for serving expired entries while they refresh in the background."""
+    
+    def test_stale_entry_is_served_then_refreshed(self, client, httpx_mock):
+        """An expired entry should be returned flagged stale and replaced in the background."""
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        store_expired_scan(hours_past_ttl=1)
+        
+        first = client.post("/scan", json={"barcode": STALE_BARCODE}).json()
+        assert first["stale"] is True
+        assert first["cached"] is True
+        assert first["product_name"] == "Old Product"
+        
+        assert wait_for(lambda: client.get("/cache/stats").json()["stale"]["refreshes"] == 1)
+        second = client.post("/scan", json={"barcode": STALE_BARCODE}).json()
+        assert second["stale"] is False
+        assert second["product_name"] == "Fresh Product"
+    
+    def test_concurrent_stale_hits_share_one_refresh(self, client, httpx_mock):
+        """Repeated stale hits during a refresh should not start more fetches."""
+        httpx_mock.add_callback(slow_response(STALE_PRODUCT, delay=0.2), url=STALE_URL)
+        store_expired_scan(hours_past_ttl=1)
+        
+        for _ in range(3):
+            assert client.post("/scan", json={"barcode": STALE_BARCODE}).json()["stale"] is True
+        
+        assert wait_for(lambda: client.get("/cache/stats").json()["stale"]["refreshes"] == 1)
+        assert len(httpx_mock.get_requests()) == 1
+        assert client.get("/cache/stats").json()["stale"]["served"] == 3
+    
+    def test_entry_past_max_staleness_blocks(self, client, httpx_mock):
+        """Entries older than the max staleness should be refetched inline."""
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        store_expired_scan(hours_past_ttl=db.CACHE_MAX_STALE_HOURS + 1)
+        
+        data = client.post("/scan", json={"barcode": STALE_BARCODE}).json()
+        assert data["stale"] is False
+        assert data["cached"] is False
+        assert data["product_name"] == "Fresh Product"
+    
+    def test_failed_refresh_keeps_serving_stale(self, client, httpx_mock):
+        """An upstream failure during refresh should leave the stale entry in place."""
+        httpx_mock.add_exception(httpx.ConnectError("down"), url=STALE_URL)
+        store_expired_scan(hours_past_ttl=1)
+        
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).json()["stale"] is True
+        assert wait_for(lambda: client.get("/cache/stats").json()["stale"]["refresh_failures"] == 1)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).json()["stale"] is True
+
+
+NEGATIVE_BARCODE = "1234567890128"
+NEGATIVE_URL = off_url(NEGATIVE_BARCODE)
+
+
+class TestNegativeCache:
+    """Tests for caching not-found and no-ingredient outcomes."""
+    
+    def test_not_found_is_served_from_negative_cache(self, client, httpx_mock):
+        """A repeat scan of an unknown barcode should return 404 without calling upstream."""
+        httpx_mock.add_response(url=NEGATIVE_URL, json={"status": 0, "product": None})
+        
+        first = client.post("/scan", json={"barcode": NEGATIVE_BARCODE})
+        second = client.post("/scan", json={"barcode": NEGATIVE_BARCODE})
+        
+        assert first.status_code == second.status_code == 404
+        assert second.json() == first.json()
+        assert len(httpx_mock.get_requests()) == 1
+        stats = client.get("/cache/stats").json()["negative_cache"]
+        assert (stats["hits"], stats["stores"]) == (1, 1)
+    
+    def test_no_ingredients_is_served_from_negative_cache(self, client, httpx_mock):
+        """A repeat scan of an ingredient-less product should return 422 from cache."""
+        httpx_mock.add_response(url=NEGATIVE_URL, json={"status": 1, "product": {"product_name": "Mystery"}})
+        
+        for _ in range(2):
+            response = client.post("/scan", json={"barcode": NEGATIVE_BARCODE})
+            assert response.status_code == 422
+            assert response.json()["detail"] == "Product has no ingredient information"
+        assert len(httpx_mock.get_requests()) == 1
+    
+    def test_upstream_failures_are_not_cached(self, client, httpx_mock):
+        """502s are transient and should be retried on the next scan."""
+        httpx_mock.add_response(url=NEGATIVE_URL, status_code=500)
+        
+        for _ in range(2):
+            assert client.post("/scan", json={"barcode": NEGATIVE_BARCODE}).status_code == 502
+        assert len(httpx_mock.get_requests()) == 2
+    
+    def test_expired_negative_entry_is_refetched(self, client, httpx_mock, monkeypatch):
+        """Once the negative TTL passes the product should be looked up again."""
+        httpx_mock.add_response(url=NEGATIVE_URL, json={"status": 0, "product": None})
+        monkeypatch.setattr(db, "NEGATIVE_CACHE_TTL_MINUTES", 0)
+        
+        for _ in range(2):
+            assert client.post("/scan", json={"barcode": NEGATIVE_BARCODE}).status_code == 404
+        assert len(httpx_mock.get_requests()) == 2
+    
+    def test_batch_uses_negative_cache(self, client, httpx_mock):
+        """Batch scans should read and fill the same negative cache."""
+        httpx_mock.add_response(url=NEGATIVE_URL, json={"status": 0, "product": None})
+        
+        assert client.post("/scan", json={"barcode": NEGATIVE_BARCODE}).status_code == 404
+        results = client.post("/scan/batch", json={"barcodes": [NEGATIVE_BARCODE]}).json()["results"]
+        
+        assert results[0]["status"] == 404
+        assert len(httpx_mock.get_requests()) == 1
+
+
+HOT_BARCODE = "1234567890128"
+HOT_URL = off_url(HOT_BARCODE)
+HOT_PRODUCT = {
+    "status": 1,
+    "product": {
+        "product_name": "Hot Product",
+        "ingredients_text": "water, sugar, aspartame, sodium nitrite, citric acid, salt, e150d",
+    },
+}
+
+
+class TestHotCacheFastPath:
+    """Tests for serving hot-cache hits from pre-serialized bytes."""
+    
+    def test_hit_matches_model_response(self, client, httpx_mock):
+        """The stored body should equal the validated response apart from the cached flag."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        
+        miss = client.post("/scan", json={"barcode": HOT_BARCODE}, headers={"Accept-Encoding": "identity"})
+        hit = client.post("/scan", json={"barcode": HOT_BARCODE}, headers={"Accept-Encoding": "identity"})
+        
+        assert "content-encoding" not in hit.headers
+        assert hit.headers["content-type"] == "application/json"
+        assert hit.json() == dict(miss.json(), cached=True)
+        assert len(httpx_mock.get_requests()) == 1
+    
+    def test_gzip_variant_served_when_accepted(self, client, httpx_mock):
+        """Clients accepting gzip should get the precompressed body."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        
+        miss = client.post("/scan", json={"barcode": HOT_BARCODE})
+        hit = client.post("/scan", json={"barcode": HOT_BARCODE}, headers={"Accept-Encoding": "gzip"})
+        
+        assert hit.headers["content-encoding"] == "gzip"
+        assert hit.headers["vary"] == "Accept-Encoding"
+        assert hit.json() == dict(miss.json(), cached=True)
+    
+    def test_other_rules_version_is_not_served(self, client, httpx_mock):
+        """A hot entry written under other rules should fall through to a recompute."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        client.post("/scan", json={"barcode": HOT_BARCODE})
+        
+        assert db.get_hot_encoded_scan(HOT_BARCODE) is not None
+        assert db.get_hot_encoded_scan(HOT_BARCODE, rules_version="0.0.0") is None
+    
+    def test_cold_scan_counts_one_miss(self, client, httpx_mock):
+        """A scan that misses the hot cache should look it up, and count the miss, only once."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        client.post("/scan", json={"barcode": HOT_BARCODE})
+        
+        assert client.get("/cache/stats").json()["hot_cache"]["misses"] == 1
+    
+    def test_accept_encoding_parsing(self):
+        """gzip should be used only when allowed with a non-zero quality."""
+        assert accepts_gzip("gzip, deflate, br") is True
+        assert accepts_gzip("br;q=1.0, gzip;q=0.8") is True
+        assert accepts_gzip("*") is True
+        assert accepts_gzip("gzip;q=0, *") is False
+        assert accepts_gzip("identity") is False
+        assert accepts_gzip(None) is False
+
+
+class TestConditionalRequests:
+    """Tests for ETags and If-None-Match handling."""
+    
+    def test_repeat_get_is_not_modified(self, client, httpx_mock):
+        """A GET carrying the current ETag should get an empty 304."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        
+        first = client.get(f"/scan/{HOT_BARCODE}")
+        assert first.status_code == 200
+        assert first.json()["product_name"] == "Hot Product"
+        assert first.headers["cache-control"] == "private, no-cache"
+        
+        second = client.get(f"/scan/{HOT_BARCODE}", headers={"If-None-Match": first.headers["etag"]})
+        assert second.status_code == 304
+        assert second.content == b""
+        assert second.headers["etag"] == first.headers["etag"]
+        assert len(httpx_mock.get_requests()) == 1
+    
+    def test_etag_is_stable_across_paths(self, client, httpx_mock):
+        """Misses, hot hits, POST and GET should all report the same tag."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        identity = {"Accept-Encoding": "identity"}
+        
+        miss = client.post("/scan", json={"barcode": HOT_BARCODE}, headers=identity)
+        hot_post = client.post("/scan", json={"barcode": HOT_BARCODE}, headers=identity)
+        db._hot_cache.clear()  # SQLite hit
+        sqlite_get = client.get(f"/scan/{HOT_BARCODE}", headers=identity)
+        hot_get = client.get(f"/scan/{HOT_BARCODE}", headers=identity)
+        
+        etags = {r.headers["etag"] for r in (miss, hot_post, sqlite_get, hot_get)}
+        assert len(etags) == 1
+        assert etags.pop().startswith('"')
+    
+    def test_gzip_variant_tag_revalidates(self, client, httpx_mock):
+        """The gzip body has its own tag, which still matches on revalidation."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        client.get(f"/scan/{HOT_BARCODE}")
+        
+        gzipped = client.get(f"/scan/{HOT_BARCODE}", headers={"Accept-Encoding": "gzip"})
+        assert gzipped.headers["content-encoding"] == "gzip"
+        assert gzipped.headers["etag"].endswith('-gzip"')
+        
+        revalidated = client.get(f"/scan/{HOT_BARCODE}", headers={"If-None-Match": gzipped.headers["etag"]})
+        assert revalidated.status_code == 304
+    
+    def test_changed_result_gets_new_etag(self, client, httpx_mock):
+        """A different verdict for the barcode should not revalidate the old tag."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        old = client.get(f"/scan/{HOT_BARCODE}")
+        
+        changed = dict(old.json(), product_name="Renamed Product")
+        db.cache_scan(HOT_BARCODE, changed)
+        
+        response = client.get(f"/scan/{HOT_BARCODE}", headers={"If-None-Match": old.headers["etag"]})
+        assert response.status_code == 200
+        assert response.json()["product_name"] == "Renamed Product"
+        assert response.headers["etag"] != old.headers["etag"]
+    
+    def test_get_validates_barcode(self, client):
+        """The GET form should reject invalid barcodes like POST /scan."""
+        assert client.get("/scan/12ab").status_code == 400
+    
+    def test_rules_metadata_not_modified(self, client):
+        """/rules/metadata should return 304 for its current ETag."""
+        first = client.get("/rules/metadata")
+        second = client.get("/rules/metadata", headers={"If-None-Match": first.headers["etag"]})
+        assert second.status_code == 304
+        assert client.get("/rules/metadata", headers={"If-None-Match": '"other"'}).status_code == 200
+    
+    def test_if_none_match_parsing(self):
+        """Lists, weak tags and * should be handled."""
+        assert etag_matches('"a", W/"b"', '"b"') is True
+        assert etag_matches("*", '"b"') is True
+        assert etag_matches('"b-gzip"', '"b"') is True
+        assert etag_matches('"c"', '"b"') is False
+        assert etag_matches(None, '"b"') is False
+
+
+def set_retry_policy(**changes) -> None:
+    """Overrides retry settings on the running app's upstream guard."""
+    guard = upstream.get_upstream_guard()
+    guard.retry_policy = guard.retry_policy._replace(**changes)
+
+
+class TestMetricsEndpoint:
+    """Tests for the Prometheus /metrics endpoint."""
+    
+    def test_scan_pipeline_is_recorded(self, client, httpx_mock):
+        """A miss then a hot hit should show up in stages, lookups and upstream statuses."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        client.post("/scan", json={"barcode": HOT_BARCODE})
+        client.post("/scan", json={"barcode": HOT_BARCODE})
+        
+        response = client.get("/metrics")
+        assert response.headers["content-type"] == metrics.CONTENT_TYPE
+        text = response.text
+        for stage in ("validate", "cache_lookup", "fetch", "parse", "classify", "cache_write"):
+            assert f'safeeats_scan_stage_seconds_count{{stage="{stage}"}} 1' in text
+        assert 'safeeats_cache_lookups_total{result="miss"} 1' in text
+        assert 'safeeats_cache_lookups_total{result="hot"} 1' in text
+        assert 'safeeats_upstream_responses_total{status="200"} 1' in text
+        assert 'safeeats_scan_seconds_count{outcome="miss"} 1' in text
+        assert 'safeeats_scan_seconds_count{outcome="hot"} 1' in text
+        assert "safeeats_scans_in_flight 0" in text
+        assert "safeeats_upstream_requests_in_flight 0" in text
+    
+    def test_upstream_failures_are_counted(self, client, httpx_mock):
+        """Upstream error statuses and transport errors should be counted separately."""
+        set_retry_policy(retries=0)
+        httpx_mock.add_response(url=HOT_URL, status_code=503)
+        httpx_mock.add_exception(httpx.ConnectError("down"), url=HOT_URL)
+        for _ in range(2):
+            assert client.post("/scan", json={"barcode": HOT_BARCODE}).status_code == 502
+        
+        assert metrics.UPSTREAM_RESPONSES.get("503") == 1
+        assert metrics.UPSTREAM_RESPONSES.get("error") == 1
+        assert metrics.SCAN_SECONDS.get_count("error") == 2
+    
+    def test_batch_lookups_are_counted(self, client, httpx_mock):
+        """Batch cache hits and misses should use the same counters."""
+        httpx_mock.add_response(url=HOT_URL, json=HOT_PRODUCT)
+        client.post("/scan/batch", json={"barcodes": [HOT_BARCODE]})
+        client.post("/scan/batch", json={"barcodes": [HOT_BARCODE]})
+        
+        assert metrics.CACHE_LOOKUPS.get("miss") == 1
+        assert metrics.CACHE_LOOKUPS.get("hit") == 1
+
+
+class TestUpstreamResilience:
+    """Tests for the circuit breaker and stale fallback in front of Open Food Facts."""
+    
+    def trip_breaker(self, client) -> None:
+        for _ in range(upstream.UPSTREAM_BREAKER_FAILURES):
+            assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 502
+    
+    def test_open_breaker_fails_fast(self, client, httpx_mock):
+        """After consecutive failures scans should get 503 without calling upstream."""
+        httpx_mock.add_response(url=STALE_URL, status_code=500)
+        self.trip_breaker(client)
+        
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 503
+        assert "circuit_open" in response.json()["detail"]
+        assert int(response.headers["retry-after"]) >= 1
+        assert len(httpx_mock.get_requests()) == upstream.UPSTREAM_BREAKER_FAILURES
+        
+        stats = client.get("/cache/stats").json()["upstream"]
+        assert stats["circuit"]["state"] == "open"
+        assert stats["rejected"]["circuit_open"] == 1
+        assert "safeeats_upstream_circuit_state 2" in client.get("/metrics").text
+    
+    def test_not_found_does_not_trip_breaker(self, client, httpx_mock):
+        """Answers from a healthy upstream (404 product) should keep the breaker closed."""
+        httpx_mock.add_response(url=STALE_URL, json={"status": 0, "product": None})
+        client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert upstream.get_upstream_guard().breaker.state == "closed"
+    
+    def test_half_open_probe_recovers(self, client, httpx_mock):
+        """Once the reset timeout passes, a successful probe should close the breaker."""
+        httpx_mock.add_response(url=STALE_URL, status_code=500)
+        self.trip_breaker(client)
+        httpx_mock.reset(assert_all_responses_were_requested=False)
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        
+        upstream.get_upstream_guard().breaker.reset_timeout = 0
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 200
+        assert response.json()["product_name"] == "Fresh Product"
+        assert client.get("/cache/stats").json()["upstream"]["circuit"]["state"] == "closed"
+    
+    def test_expired_entry_is_served_when_upstream_fails(self, client, httpx_mock):
+        """A miss past the max staleness should fall back to the expired entry on upstream failure."""
+        httpx_mock.add_response(url=STALE_URL, status_code=500)
+        store_expired_scan(hours_past_ttl=db.CACHE_MAX_STALE_HOURS + 1)
+        
+        data = client.post("/scan", json={"barcode": STALE_BARCODE}).json()
+        assert data["stale"] is True
+        assert data["product_name"] == "Old Product"
+        results = client.post("/scan/batch", json={"barcodes": [STALE_BARCODE]}).json()["results"]
+        assert results[0]["status"] == 200
+        assert results[0]["result"]["stale"] is True
+        assert client.get("/cache/stats").json()["stale"]["fallbacks"] == 2
+    
+    def test_no_fallback_without_cached_entry(self, client, httpx_mock):
+        """Without any cached entry the upstream error should be returned."""
+        httpx_mock.add_exception(httpx.ConnectError("down"), url=STALE_URL)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 502
+
+
+class TestDeadlinesAndRetries:
+    """Tests for the scan deadline, upstream retries and hedged requests."""
+    
+    def test_dropped_connection_is_retried(self, client, httpx_mock):
+        """A connection dropped before the response should be retried transparently."""
+        set_retry_policy(base_delay=0.01)
+        httpx_mock.add_exception(httpx.RemoteProtocolError("Server disconnected"), url=STALE_URL)
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 200
+        assert len(httpx_mock.get_requests()) == 2
+        assert client.get("/cache/stats").json()["upstream"]["retries"] == 1
+        assert metrics.UPSTREAM_RETRIES.get() == 1
+    
+    def test_retries_are_bounded(self, client, httpx_mock):
+        """A gateway error that persists should give up after the configured retries."""
+        set_retry_policy(retries=2, base_delay=0.01)
+        httpx_mock.add_response(url=STALE_URL, status_code=503)
+        
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 502
+        assert len(httpx_mock.get_requests()) == 3
+    
+    def test_non_retryable_failures_are_not_retried(self, client, httpx_mock):
+        """500s and read timeouts should fail on the first attempt."""
+        set_retry_policy(base_delay=0.01)
+        httpx_mock.add_response(url=STALE_URL, status_code=500)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 502
+        httpx_mock.reset(assert_all_responses_were_requested=False)
+        httpx_mock.add_exception(httpx.ReadTimeout("slow"), url=STALE_URL)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 502
+        assert len(httpx_mock.get_requests()) == 1
+    
+    def test_deadline_exceeded_returns_504(self, client, httpx_mock, monkeypatch):
+        """An upstream slower than the remaining budget should be cut off with 504."""
+        monkeypatch.setattr(app_module, "SCAN_DEADLINE_SECONDS", 0.1)
+        httpx_mock.add_callback(slow_response(STALE_PRODUCT, delay=1), url=STALE_URL)
+        
+        start = time.monotonic()
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 504
+        assert time.monotonic() - start < 0.8
+        assert client.get("/cache/stats").json()["upstream"]["deadline_exceeded"] == 1
+    
+    def test_batch_deadline_starts_when_fetch_starts(self, client, httpx_mock, monkeypatch):
+        """Barcodes queued behind the fetch concurrency limit should still get their full deadline."""
+        monkeypatch.setattr(app_module, "SCAN_DEADLINE_SECONDS", 0.3)
+        monkeypatch.setattr(app_module, "BATCH_FETCH_CONCURRENCY", 1)
+        barcodes = [str(10000000 + i) for i in range(4)]
+        for barcode in barcodes:
+            httpx_mock.add_callback(slow_response(STALE_PRODUCT, delay=0.15), url=off_url(barcode))
+        
+        results = client.post("/scan/batch", json={"barcodes": barcodes}).json()["results"]
+        assert [r["status"] for r in results] == [200] * 4
+        assert len(httpx_mock.get_requests()) == 4
+    
+    def test_deadline_exceeded_falls_back_to_expired_entry(self, client, httpx_mock, monkeypatch):
+        """A timed-out miss should be answered from an expired entry when one is stored."""
+        monkeypatch.setattr(app_module, "SCAN_DEADLINE_SECONDS", 0.1)
+        httpx_mock.add_callback(slow_response(STALE_PRODUCT, delay=1), url=STALE_URL)
+        store_expired_scan(hours_past_ttl=db.CACHE_MAX_STALE_HOURS + 1)
+        
+        data = client.post("/scan", json={"barcode": STALE_BARCODE}).json()
+        assert data["stale"] is True
+        assert data["product_name"] == "Old Product"
+    
+    def test_slow_request_is_hedged(self, client, httpx_mock):
+        """With hedging on, a request slower than p95 should be raced by a second one."""
+        set_retry_policy(hedge=True, hedge_min_delay=0.01)
+        guard = upstream.get_upstream_guard()
+        for _ in range(guard.latency.min_samples):
+            guard.latency.observe(0.01)
+        calls = []
+        
+        async def first_slow(request: httpx.Request) -> httpx.Response:
+            calls.append(request)
+            await asyncio.sleep(1 if len(calls) == 1 else 0)
+            return httpx.Response(200, json=STALE_PRODUCT)
+        
+        httpx_mock.add_callback(first_slow, url=STALE_URL)
+        start = time.monotonic()
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 200
+        assert time.monotonic() - start < 0.8
+        assert len(calls) == 2
+        stats = client.get("/cache/stats").json()["upstream"]
+        assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+    
+    def test_no_hedge_without_latency_history(self, client, httpx_mock):
+        """Hedging should wait until there are enough samples to estimate p95."""
+        set_retry_policy(hedge=True, hedge_min_delay=0.01)
+        httpx_mock.add_callback(slow_response(STALE_PRODUCT, delay=0.05), url=STALE_URL)
+        
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 200
+        assert len(httpx_mock.get_requests()) == 1
+
+
+class TestProductFields:
+    """Tests for field-restricted Open Food Facts requests and incremental parsing."""
+    
+    def test_only_needed_fields_are_requested(self, client, httpx_mock):
+        """The upstream request should ask for the name and ingredients fields only."""
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 200
+        
+        fields = httpx_mock.get_requests()[0].url.params["fields"].split(",")
+        assert fields == ["product_name", "product_name_en", "ingredients_text", "ingredients_text_en"]
+        assert metrics.UPSTREAM_RESPONSE_BYTES.get() == len(json.dumps(STALE_PRODUCT))
+        assert metrics.STAGE_SECONDS.get_count("decode") == 1
+    
+    def test_full_document_when_fields_are_disabled(self, client, httpx_mock, monkeypatch):
+        """An empty field list should request the whole product document."""
+        monkeypatch.setattr(app_module, "OPEN_FOOD_FACTS_FIELDS", "")
+        httpx_mock.add_response(url=f"https://world.openfoodfacts.org/api/v2/product/{STALE_BARCODE}.json", json=STALE_PRODUCT)
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).status_code == 200
+    
+    def test_large_body_stops_at_wanted_fields(self, client, httpx_mock):
+        """A streamed body should be read only until the name and ingredients are known."""
+        product = {
+            "ingredients_text": "water, aspartame",
+            "nutriments": {f"n{i}": i for i in range(100)},
+            "product_name": "Streamed Product",
+        }
+        body = json.dumps({"code": STALE_BARCODE, "product": product}).encode()
+        # Never reached: the body is cut off (and malformed) after the product name
+        chunks = [body[i:i + 64] for i in range(0, len(body) - 1, 64)] + [b"<truncated"]
+        httpx_mock.add_response(url=STALE_URL, stream=IteratorStream(chunks))
+        
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 200
+        assert response.json()["product_name"] == "Streamed Product"
+        assert metrics.STAGE_SECONDS.get_count("decode") == 1
+    
+    def test_large_body_is_parsed_incrementally(self, client, httpx_mock, monkeypatch):
+        """Bodies over the stream threshold should give the same result as a full decode."""
+        monkeypatch.setattr(app_module, "UPSTREAM_STREAM_THRESHOLD", 0)
+        httpx_mock.add_response(url=STALE_URL, json=STALE_PRODUCT)
+        httpx_mock.add_response(url=off_url("12345678"), json={"status": 0, "product": None})
+        assert client.post("/scan", json={"barcode": STALE_BARCODE}).json()["product_name"] == "Fresh Product"
+        assert client.post("/scan", json={"barcode": "12345678"}).status_code == 404
+    
+    def test_unreadable_body_returns_502(self, client, httpx_mock):
+        """A truncated product document should be an upstream failure, not a server error."""
+        set_retry_policy(retries=0)
+        httpx_mock.add_response(url=STALE_URL, stream=IteratorStream([b'{"status": 1, "product": {"product_']))
+        
+        response = client.post("/scan", json={"barcode": STALE_BARCODE})
+        assert response.status_code == 502
+        assert "unreadable product document" in response.json()["detail"]
+        assert metrics.UPSTREAM_RESPONSES.get("error") == 1
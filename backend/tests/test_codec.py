@@ -0,0 +1,89 @@
+"""
+Tests for the compact verdict encoding.
+
+Tests cover:
+1. Lossless round trip of scan responses
+2. Rule notes stored by reference
+3. Responses for other rules versions
+4. Rule references checked against the stored canonical name
+"""
+
+
+import json
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import codec
+from app import score_product
+from codec import encode_response, decode_response
+from rules import RISK_RULES, RULES_VERSION
+
+
+def make_response() -> dict:
+    response = score_product("Test Product", "water, sugar, aspartame, sodium benzoat, e150d")
+    del response["cached"]
+    return response
+
+
+class TestRoundTrip:
+    """Tests for encode/decode."""
+    
+    def test_round_trip_is_lossless(self):
+        """Decoding should reproduce the stored response exactly."""
+        response = make_response()
+        assert decode_response(encode_response(response)) == response
+    
+    def test_per_request_flags_are_not_stored(self):
+        """cached and stale belong to a request, not to the stored verdict."""
+        response = dict(make_response(), cached=True, stale=True)
+        decoded = decode_response(encode_response(response))
+        assert "cached" not in decoded and "stale" not in decoded
+    
+    def test_smaller_than_text_json(self):
+        """The encoded blob should be much smaller than the JSON text."""
+        response = make_response()
+        assert len(encode_response(response)) < len(json.dumps(response)) / 2
+    
+    def test_unknown_format_is_rejected(self):
+        """Blobs with an unknown format byte should raise ValueError."""
+        with pytest.raises(ValueError):
+            decode_response(b"\x7f" + zlib.compress(b"[]"))
+
+
+class TestRuleReferences:
+    """Tests for storing rule prose by reference."""
+    
+    def test_notes_are_not_stored(self):
+        """Rule notes should be rehydrated from the rules, not stored."""
+        blob = encode_response(make_response())
+        payload = zlib.decompress(blob[1:]).decode()
+        assert RISK_RULES["aspartame"]["notes"] not in payload
+    
+    def test_other_rules_version_is_stored_inline(self):
+        """Responses under other rules keep their own notes and still round trip."""
+        response = dict(make_response(), rules_version="0.9.0")
+        response["ingredients"][2]["notes"] = "Old wording."
+        blob = encode_response(response)
+        assert "Old wording." in zlib.decompress(blob[1:]).decode()
+        assert decode_response(blob) == response
+    
+    def test_references_from_other_rules_version_are_rejected(self, monkeypatch):
+        """Rule IDs written under one rules version must not be read under another."""
+        blob = encode_response(make_response())
+        monkeypatch.setattr(codec, "RULES_VERSION", RULES_VERSION + "-next")
+        with pytest.raises(ValueError):
+            decode_response(blob)
+    
+    def test_references_must_match_canonical_name(self, monkeypatch):
+        """A rule ID that now belongs to another rule should be rejected, not rehydrated."""
+        blob = encode_response(make_response())
+        rule_id = codec.get_rule_id
+        monkeypatch.setattr(codec, "get_rule_id", lambda name: None if rule_id(name) is None else rule_id(name) + 1)
+        with pytest.raises(ValueError):
+            decode_response(blob)
@@ -0,0 +1,298 @@
+"""
+Tests for the SQLite cache layer.
+
+Tests cover:
+1. Sync cache round trip
+2. Async API runs on database threads
+3. Pooled connections and pragmas
+4. Bulk lookup and write
+5. Raw product and per-rules-version verdict storage
+6. Stale entries past the TTL
+7. Verdicts whose rule references no longer match the rules
+"""
+
+
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import codec
+import db
+from rules import RULES_VERSION, get_risk_with_source
+from db import init_db, cache_scan, get_cached_scan, cache_scan_async, get_cached_scan_async
+
+
+RESPONSE = {
+    "product_name": "Test Product",
+    "ingredients": [
+        {"raw": "water", "canonical": "water", "risk": "safe", "source": None, "notes": None}
+    ],
+    "overall_risk": "safe",
+    "cached": False,
+    "rules_version": RULES_VERSION,
+}
+
+
+class TestSyncCache:
+    """Tests for the synchronous cache functions."""
+    
+    def test_round_trip(self):
+        """A cached scan should be returned on the next lookup."""
+        init_db()
+        cache_scan("12345678", RESPONSE)
+        assert get_cached_scan("12345678")["product_name"] == "Test Product"
+    
+    def test_miss_returns_none(self):
+        """Unknown barcodes should return None."""
+        init_db()
+        assert get_cached_scan("87654321") is None
+
+
+class TestAsyncCache:
+    """Tests for the async cache API."""
+    
+    @pytest.mark.asyncio
+    async def test_round_trip(self):
+        """Async write then async read should return the response."""
+        init_db()
+        await cache_scan_async("12345678", RESPONSE)
+        db._hot_cache.clear()  # force the SQLite path
+        cached = await get_cached_scan_async("12345678")
+        assert cached["overall_risk"] == "safe"
+        db.shutdown_executors()
+    
+    @pytest.mark.asyncio
+    async def test_sqlite_work_runs_off_the_event_loop(self, monkeypatch):
+        """SQLite reads and writes should not run on the event loop thread."""
+        init_db()
+        loop_thread = threading.current_thread()
+        threads = []
+        
+        original_connect = db.get_connection
+        
+        def recording_connection():
+            threads.append(threading.current_thread())
+            return original_connect()
+        
+        monkeypatch.setattr(db, "get_connection", recording_connection)
+        await cache_scan_async("12345678", RESPONSE)
+        db._hot_cache.clear()
+        await get_cached_scan_async("12345678")
+        db.shutdown_executors()
+        
+        assert len(threads) == 2
+        assert all(t is not loop_thread for t in threads)
+        assert threads[0].name.startswith("safeeats-db-write")
+        assert threads[1].name.startswith("safeeats-db-read")
+
+
+class TestConnectionPool:
+    """Tests for pooled per-thread connections."""
+    
+    def test_connection_is_reused_within_a_thread(self):
+        """The same thread should get the same connection back."""
+        init_db()
+        assert db.get_connection() is db.get_connection()
+    
+    def test_threads_get_their_own_connection(self):
+        """Different threads should not share a connection."""
+        init_db()
+        main_conn = db.get_connection()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(db.get_connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not main_conn
+    
+    def test_wal_and_pragmas_enabled(self):
+        """Connections should use WAL with synchronous=NORMAL."""
+        init_db()
+        conn = db.get_connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -db.SQLITE_CACHE_SIZE_KIB
+    
+    def test_init_db_resets_test_database(self):
+        """init_db should give each test a fresh database and connection."""
+        init_db()
+        cache_scan("12345678", RESPONSE)
+        old_conn = db.get_connection()
+        init_db()
+        assert db.get_connection() is not old_conn
+        assert get_cached_scan("12345678") is None
+
+
+class TestBulkCache:
+    """Tests for get_cached_scans / cache_scans."""
+    
+    def test_bulk_round_trip(self):
+        """Bulk writes should be returned by a bulk lookup."""
+        init_db()
+        db.cache_scans({"12345678": RESPONSE, "87654321": RESPONSE})
+        db._hot_cache.clear()  # force the SQLite path
+        found = db.get_cached_scans(["12345678", "87654321", "11111111"])
+        assert set(found) == {"12345678", "87654321"}
+    
+    def test_bulk_lookup_chunks_large_lists(self, monkeypatch):
+        """Lists longer than the IN (...) chunk size should still resolve."""
+        init_db()
+        monkeypatch.setattr(db, "SQLITE_MAX_IN_PARAMS", 2)
+        db.cache_scans({str(10000000 + i): RESPONSE for i in range(5)})
+        db._hot_cache.clear()
+        found = db.get_cached_scans([str(10000000 + i) for i in range(5)])
+        assert len(found) == 5
+
+
+class TestProductsAndVerdicts:
+    """Tests for the split raw product / verdict tables."""
+    
+    def test_verdicts_are_keyed_by_rules_version(self):
+        """A verdict under other rules should not be served for the current rules."""
+        init_db()
+        cache_scan("12345678", dict(RESPONSE, rules_version="0.9.0"))
+        db._hot_cache.clear()
+        assert get_cached_scan("12345678") is None
+        assert get_cached_scan("12345678", rules_version="0.9.0")["rules_version"] == "0.9.0"
+    
+    def test_fetched_ingredients_are_stored_as_raw_product(self):
+        """Passing the ingredients text should store the raw product with its hash."""
+        init_db()
+        cache_scan("12345678", RESPONSE, "Water")
+        stored = db.get_stored_product("12345678")
+        assert stored["product_name"] == "Test Product"
+        assert stored["ingredients_text"] == "Water"
+        assert stored["content_hash"] == db.product_content_hash("Test Product", "Water")
+    
+    def test_recomputed_verdict_inherits_fetch_time(self):
+        """A verdict recomputed from stored data should expire with that data."""
+        init_db()
+        fetched_at = (datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS + 1)).isoformat()
+        conn = db.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO products VALUES (?, ?, ?, ?, ?)",
+                ("12345678", "Test Product", "Water", fetched_at, "hash")
+            )
+        assert db.get_stored_product("12345678") is None
+        cache_scan("12345678", RESPONSE)
+        db._hot_cache.clear()
+        assert get_cached_scan("12345678") is None
+    
+    def test_recomputed_verdict_is_hot_cached_with_its_age(self):
+        """The hot cache should expire a recomputed verdict with its stored data, not a full TTL later."""
+        init_db()
+        fetched_at = datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS) + timedelta(seconds=60)
+        conn = db.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO products VALUES (?, ?, ?, ?, ?)",
+                ("12345678", "Test Product", "Water", fetched_at.isoformat(), "hash")
+            )
+        cache_scan("12345678", RESPONSE)
+        db.cache_scans({"87654321": RESPONSE}, {"87654321": "Water"})
+        expires_in = {b: entry[0] - time.monotonic() for b, entry in db._hot_cache._entries.items()}
+        assert 0 < expires_in["12345678"] <= 60
+        assert expires_in["87654321"] > 60
+    
+    def test_migrates_old_scan_cache_table(self):
+        """Rows in the old scan_cache table should move to verdicts."""
+        init_db()
+        conn = db.get_connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE scan_cache (barcode TEXT PRIMARY KEY, response_json TEXT NOT NULL, updated_at TIMESTAMP)"
+            )
+            conn.execute(
+                "INSERT INTO scan_cache VALUES (?, ?, ?)",
+                ("12345678", json.dumps(RESPONSE), datetime.now().isoformat())
+            )
+        db._migrate_scan_cache(conn)
+        conn.commit()
+        assert get_cached_scan("12345678")["product_name"] == "Test Product"
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert "scan_cache" not in tables
+    
+    def test_migrates_text_json_verdicts_to_encoded(self):
+        """A verdicts table storing TEXT JSON should be rewritten in the compact encoding."""
+        init_db()
+        conn = db.get_connection()
+        now = datetime.now().isoformat()
+        with conn:
+            conn.execute("DROP TABLE verdicts")
+            conn.execute(
+                "CREATE TABLE verdicts (barcode TEXT NOT NULL, rules_version TEXT NOT NULL, "
+                "response_json TEXT NOT NULL, content_hash TEXT, updated_at TIMESTAMP NOT NULL, "
+                "PRIMARY KEY (barcode, rules_version)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "INSERT INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                ("12345678", RULES_VERSION, json.dumps(RESPONSE), None, now)
+            )
+        db._migrate_verdicts_accessed_at(conn)
+        db._migrate_verdicts_to_blob(conn)
+        conn.commit()
+        
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(verdicts)")}
+        assert "response" in columns and "response_json" not in columns
+        assert get_cached_scan("12345678")["ingredients"][0]["raw"] == "water"
+
+
+class TestStaleEntries:
+    """Tests for reading entries past the TTL."""
+    
+    def expire(self, hours_past_ttl: float) -> None:
+        updated_at = datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS + hours_past_ttl)
+        conn = db.get_connection()
+        with conn:
+            conn.execute("UPDATE verdicts SET updated_at = ?", (updated_at.isoformat(),))
+        db._hot_cache.clear()
+    
+    def test_stale_entries_need_allow_stale(self):
+        """Expired entries should only be returned, flagged stale, with allow_stale."""
+        init_db()
+        cache_scan("12345678", RESPONSE)
+        self.expire(hours_past_ttl=1)
+        assert get_cached_scan("12345678") is None
+        assert get_cached_scan("12345678", allow_stale=True)["stale"] is True
+        assert db.get_cached_scans(["12345678"], allow_stale=True)["12345678"]["stale"] is True
+        assert len(db._hot_cache) == 0
+    
+    def test_entries_past_max_staleness_are_misses(self):
+        """Entries older than TTL + max staleness should never be returned."""
+        init_db()
+        cache_scan("12345678", RESPONSE)
+        self.expire(hours_past_ttl=db.CACHE_MAX_STALE_HOURS + 1)
+        assert get_cached_scan("12345678", allow_stale=True) is None
+
+
+class TestStaleRuleReferences:
+    """Tests for verdicts stored with rule IDs that no longer fit the rules."""
+    
+    def store_aspartame_verdict(self) -> None:
+        risk, source, notes = get_risk_with_source("aspartame")
+        ingredient = {"raw": "aspartame", "canonical": "aspartame", "risk": risk, "source": source, "notes": notes, "confidence": 1.0}
+        init_db()
+        cache_scan("12345678", dict(RESPONSE, rules_version=RULES_VERSION, overall_risk=risk, ingredients=[ingredient]))
+        db._hot_cache.clear()
+    
+    def test_shifted_rule_ids_are_misses(self, monkeypatch):
+        """A rule inserted ahead of a stored one (without a version bump) should not change its verdict."""
+        self.store_aspartame_verdict()
+        rule_id = codec.get_rule_id
+        monkeypatch.setattr(codec, "get_rule_id", lambda name: rule_id(name) + 1)
+        assert get_cached_scan("12345678") is None
+        assert db.get_cached_scans(["12345678"]) == {}
+    
+    def test_removed_rules_are_misses(self, monkeypatch):
+        """A stored reference to a rule that no longer exists should read as a miss, not raise."""
+        self.store_aspartame_verdict()
+        monkeypatch.setattr(codec, "get_rule_id", lambda name: None)
+        assert get_cached_scan("12345678") is None
@@ -0,0 +1,101 @@
+"""
+Tests for fuzzy ingredient resolution.
+
+Tests cover:
+1. Bounded edit distance
+2. Trigram index lookups and thresholds
+3. Memoization
+4. Misspelled ingredients classified through the app
+5. Real words not mistaken for typos ("sodium citrate" is not "sodium nitrate")
+"""
+
+
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fuzzy import FuzzyIndex, bounded_levenshtein
+from app import classify_ingredient, parse_ingredients, FUZZY_INDEX
+from rules import get_overall_risk
+
+
+class TestBoundedLevenshtein:
+    """Tests for the edit distance with early exit."""
+    
+    def test_exact_distance_within_bound(self):
+        """Distances up to the bound should be exact."""
+        assert bounded_levenshtein("aspartame", "aspartame", 2) == 0
+        assert bounded_levenshtein("aspartam", "aspartame", 2) == 1
+        assert bounded_levenshtein("kitten", "sitting", 3) == 3
+    
+    def test_stops_beyond_bound(self):
+        """Distances over the bound should be reported as bound + 1."""
+        assert bounded_levenshtein("kitten", "sitting", 2) == 3
+        assert bounded_levenshtein("msg", "monosodium glutamate", 2) == 3
+
+
+class TestFuzzyIndex:
+    """Tests for the trigram index."""
+    
+    def test_resolves_close_misspellings(self):
+        """Names within the thresholds should map to their canonical name."""
+        index = FuzzyIndex({"aspartame": "aspartame", "e951": "aspartame", "tartrazine": "tartrazine"})
+        assert index.lookup("aspartam") == ("aspartame", 0.889)
+        assert index.lookup("tartrazin") == ("tartrazine", 0.9)
+    
+    def test_rejects_distant_and_short_names(self):
+        """Dissimilar or short names should not match."""
+        index = FuzzyIndex({"aspartame": "aspartame", "e951": "aspartame"})
+        assert index.lookup("asparagus") is None
+        assert index.lookup("e952") is None
+        assert len(index) == 1
+    
+    def test_threshold_is_configurable(self):
+        """A stricter similarity threshold should reject looser matches."""
+        index = FuzzyIndex({"aspartame": "aspartame"}, min_similarity=0.9)
+        assert index.lookup("aspartam") is None
+    
+    def test_lookups_are_memoized(self):
+        """Repeated lookups should be served from the bounded cache."""
+        index = FuzzyIndex({"aspartame": "aspartame"}, cache_size=2)
+        index.lookup("aspartam")
+        index.lookup("aspartam")
+        info = index.cache_info()
+        assert (info.hits, info.misses, info.maxsize) == (1, 1, 2)
+    
+    def test_rejects_match_on_a_known_word(self):
+        """A differing word that is a real word should not be treated as a typo."""
+        index = FuzzyIndex({"sodium nitrate": "sodium nitrate"})
+        assert index.lookup("sodium citrate") is None
+        assert index.lookup("sodium nitrat") == ("sodium nitrate", 0.929)
+
+
+class TestFuzzyClassification:
+    """Tests for misspellings going through classify_ingredient."""
+    
+    def test_misspelled_ingredient_gets_rule(self):
+        """A typo of a known additive should get its risk and a confidence below 1."""
+        result = classify_ingredient("sodium benzoat")
+        assert result.canonical == "sodium benzoate"
+        assert result.risk == "moderate"
+        assert 0.85 <= result.confidence < 1.0
+    
+    def test_exact_and_unknown_confidence(self):
+        """Exact matches report 1.0 and unknown ingredients report no confidence."""
+        assert classify_ingredient("e951").confidence == 1.0
+        unknown = classify_ingredient("wheat flour")
+        assert (unknown.risk, unknown.confidence) == ("safe", None)
+    
+    def test_index_covers_map_and_rules(self):
+        """The app index should be built from the ingredient map and rule names."""
+        assert FUZZY_INDEX.lookup("high fructose corn syrop")[0] == "high fructose corn syrup"
+    
+    def test_citrates_are_not_nitrates(self):
+        """Common citrate salts should stay safe rather than fuzz into sodium nitrate."""
+        for salt in ("sodium citrate", "calcium citrate", "potassium citrate"):
+            result = classify_ingredient(salt)
+            assert (result.canonical, result.risk) == (salt, "safe")
+        risks = [classify_ingredient(i).risk for i in parse_ingredients("water, sugar, sodium citrate, citric acid")]
+        assert get_overall_risk(risks) not in ("high", "critical")
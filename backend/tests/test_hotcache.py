@@ -0,0 +1,168 @@
+"""
+Tests for the in-process hot cache.
+
+Tests cover:
+1. Packing and unpacking responses
+2. Byte-bounded LRU eviction
+3. TTL expiry
+4. Counters
+5. Pre-serialized and gzipped response bodies
+6. ETags
+"""
+
+
+import gzip
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from hotcache import HotCache, pack_response, unpack_response, response_etag
+
+
+def make_response(name: str = "Test Product") -> dict:
+    return {
+        "product_name": name,
+        "ingredients": [
+            {"raw": "water", "canonical": "water", "risk": "safe", "source": None, "notes": None, "confidence": None},
+            {
+                "raw": "e951",
+                "canonical": "aspartame",
+                "risk": "moderate",
+                "source": "IARC_GROUP_2B",
+                "notes": "Artificial sweetener (E951).",
+                "confidence": 1.0,
+            },
+        ],
+        "overall_risk": "moderate",
+        "rules_version": "1.0.0",
+    }
+
+
+class TestPacking:
+    """Tests for the compact entry format."""
+    
+    def test_round_trip(self):
+        """Unpacking a packed response should reproduce it."""
+        response = make_response()
+        assert unpack_response(pack_response(response)) == response
+    
+    def test_drops_cached_flag(self):
+        """The per-request cached flag should not be stored."""
+        response = make_response()
+        response["cached"] = False
+        assert "cached" not in unpack_response(pack_response(response))
+    
+    def test_unpack_returns_fresh_dict(self):
+        """Callers may mutate the result without corrupting the cache."""
+        packed = pack_response(make_response())
+        first = unpack_response(packed)
+        first["cached"] = True
+        first["ingredients"][0]["raw"] = "changed"
+        assert unpack_response(packed) == make_response()
+
+
+class TestHotCache:
+    """Tests for HotCache behaviour."""
+    
+    def test_hit_and_miss_counters(self):
+        """Hits and misses should be counted."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        assert cache.get("12345678") is None
+        cache.put("12345678", make_response())
+        assert cache.get("12345678")["product_name"] == "Test Product"
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+    
+    def test_evicts_least_recently_used_by_bytes(self):
+        """Exceeding the byte budget should evict the least recently used entry."""
+        probe = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        probe.put("1", make_response("A"))
+        entry_size = probe.stats()["bytes"]
+        cache = HotCache(max_bytes=entry_size * 2 + entry_size // 2, ttl_seconds=60)
+        cache.put("1", make_response("A"))
+        cache.put("2", make_response("B"))
+        cache.get("1")  # "2" is now least recently used
+        cache.put("3", make_response("C"))
+        
+        assert cache.get("2") is None
+        assert cache.get("1") is not None
+        assert cache.get("3") is not None
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= cache.max_bytes
+    
+    def test_expired_entries_are_misses(self):
+        """Entries past their TTL should not be served."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        cache.put("1", make_response(), age_seconds=61)
+        assert cache.get("1") is None
+        cache.put("2", make_response(), age_seconds=0)
+        cache._entries["2"] = (0.0,) + cache._entries["2"][1:]
+        assert cache.get("2") is None
+        assert cache.stats()["expirations"] == 1
+    
+    def test_replacing_entry_keeps_byte_count(self):
+        """Overwriting a barcode should not double count its size."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        cache.put("1", make_response())
+        size = cache.stats()["bytes"]
+        cache.put("1", make_response())
+        assert cache.stats()["bytes"] == size
+        assert len(cache) == 1
+
+
+class TestEncodedResponses:
+    """Tests for the pre-serialized response bodies."""
+    
+    def test_body_is_the_cached_response(self):
+        """The stored body should be the response flagged cached and not stale."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        cache.put("1", make_response())
+        encoded = cache.get_encoded("1")
+        assert encoded.rules_version == "1.0.0"
+        assert json.loads(encoded.body) == dict(make_response(), cached=True, stale=False)
+        assert cache.stats()["hits"] == 1
+    
+    def test_gzip_copy_above_threshold(self):
+        """Bodies at or above the threshold should keep a gzip copy of the same bytes."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60, gzip_min_bytes=100)
+        cache.put("1", make_response())
+        encoded = cache.get_encoded("1")
+        assert gzip.decompress(encoded.gzip_body) == encoded.body
+    
+    def test_no_gzip_copy_below_threshold(self):
+        """Small bodies should not be compressed."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60, gzip_min_bytes=100_000)
+        cache.put("1", make_response())
+        assert cache.get_encoded("1").gzip_body is None
+    
+    def test_expired_entries_are_misses(self):
+        """get_encoded should apply the same TTL as get."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        cache.put("1", make_response(), age_seconds=61)
+        assert cache.get_encoded("1") is None
+
+
+class TestETags:
+    """Tests for scan result ETags."""
+    
+    def test_stored_etag_matches_response_etag(self):
+        """The pre-computed tag should equal one computed from the response dict."""
+        cache = HotCache(max_bytes=1_000_000, ttl_seconds=60)
+        cache.put("1", make_response())
+        assert cache.get_encoded("1").etag == response_etag("1", make_response())
+    
+    def test_flags_do_not_change_etag(self):
+        """cached/stale are per-request flags, not part of the result."""
+        flagged = dict(make_response(), cached=True, stale=True)
+        assert response_etag("1", flagged) == response_etag("1", make_response())
+    
+    def test_barcode_and_content_change_etag(self):
+        """Different barcodes, verdicts or rules versions should get different tags."""
+        etag = response_etag("1", make_response())
+        assert response_etag("2", make_response()) != etag
+        assert response_etag("1", make_response("Other")) != etag
+        assert response_etag("1", dict(make_response(), rules_version="2.0.0")) != etag
@@ -0,0 +1,222 @@
+"""
+Tests for periodic cache maintenance.
+
+Tests cover:
+1. Batched deletion of rows that can no longer be served
+2. LRU eviction to row and byte budgets
+3. Incremental vacuum
+4. Indexes used by the sweeps
+5. The background loop surviving failed runs
+"""
+
+
+import asyncio
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import db
+import maintenance
+from db import init_db, cache_scan, get_cached_scan
+from maintenance import maintenance_loop, run_maintenance, rows_over_budget
+from rules import RULES_VERSION
+
+
+RESPONSE = {
+    "product_name": "Test Product",
+    "ingredients": [
+        {"raw": "water", "canonical": "water", "risk": "safe", "source": None, "notes": None}
+    ],
+    "overall_risk": "safe",
+    "rules_version": RULES_VERSION,
+}
+
+
+def barcode(i: int) -> str:
+    return str(10000000 + i)
+
+
+def set_column(table: str, column: str, when: datetime, barcodes: list[str]) -> None:
+    conn = db.get_connection()
+    placeholders = ",".join("?" * len(barcodes))
+    with conn:
+        conn.execute(
+            f"UPDATE {table} SET {column} = ? WHERE barcode IN ({placeholders})",
+            [when.isoformat(), *barcodes]
+        )
+
+
+def count(table: str) -> int:
+    return db.get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+async def maintain(**kwargs) -> dict:
+    try:
+        return await run_maintenance(**kwargs)
+    finally:
+        db.shutdown_executors()
+
+
+class TestExpiry:
+    """Tests for deleting rows that can no longer be served."""
+    
+    @pytest.mark.asyncio
+    async def test_deletes_unservable_rows_in_batches(self):
+        """Rows past TTL + max staleness should be deleted, several batches if needed."""
+        init_db()
+        for i in range(7):
+            cache_scan(barcode(i), RESPONSE, "water")
+        expired = [barcode(i) for i in range(5)]
+        long_ago = datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS + db.CACHE_MAX_STALE_HOURS + 1)
+        set_column("verdicts", "updated_at", long_ago, expired)
+        set_column("products", "fetched_at", long_ago, expired)
+        
+        report = await maintain(batch_size=2, max_rows=0)
+        
+        assert report["expired"]["verdicts"] == 5
+        assert report["expired"]["products"] == 5
+        assert count("verdicts") == count("products") == 2
+    
+    @pytest.mark.asyncio
+    async def test_keeps_stale_but_servable_rows(self):
+        """Rows past the TTL but within the max staleness are still served, so kept."""
+        init_db()
+        cache_scan(barcode(0), RESPONSE)
+        set_column("verdicts", "updated_at", datetime.now() - timedelta(hours=db.CACHE_TTL_HOURS + 1), [barcode(0)])
+        
+        report = await maintain(max_rows=0)
+        
+        assert report["expired"]["verdicts"] == 0
+        assert count("verdicts") == 1
+    
+    @pytest.mark.asyncio
+    async def test_deletes_old_rules_verdicts_and_negative_entries(self):
+        """Verdicts for other rules versions and expired negative entries should go."""
+        init_db()
+        cache_scan(barcode(0), dict(RESPONSE, rules_version="0.9.0"))
+        cache_scan(barcode(0), RESPONSE)
+        db.cache_negative_scan(barcode(1), 404, "Product not found in Open Food Facts")
+        set_column(
+            "negative_cache", "updated_at",
+            datetime.now() - timedelta(minutes=db.NEGATIVE_CACHE_TTL_MINUTES + 1), [barcode(1)]
+        )
+        
+        report = await maintain(max_rows=0)
+        
+        assert report["expired"] == {"verdicts": 1, "products": 0, "negative_cache": 1}
+        assert get_cached_scan(barcode(0)) is not None
+
+
+class TestEviction:
+    """Tests for LRU eviction to the cache budgets."""
+    
+    @pytest.mark.asyncio
+    async def test_evicts_least_recently_used_to_row_budget(self):
+        """Over the row budget, barcodes not served recently should be evicted first."""
+        init_db()
+        barcodes = [barcode(i) for i in range(5)]
+        for b in barcodes:
+            cache_scan(b, RESPONSE, "water")
+        set_column("verdicts", "accessed_at", datetime.now() - timedelta(hours=1), barcodes)
+        db._hot_cache.clear()
+        get_cached_scan(barcodes[0])
+        get_cached_scan(barcodes[3])
+        
+        report = await maintain(batch_size=2, max_rows=2)
+        
+        assert report["accessed_flushed"] == 2
+        assert report["evicted"] == 3
+        remaining = {row[0] for row in db.get_connection().execute("SELECT barcode FROM verdicts")}
+        assert remaining == {barcodes[0], barcodes[3]}
+        assert count("products") == 2
+    
+    def test_byte_budget_converts_to_rows(self):
+        """A byte budget should translate to rows by average row size."""
+        size = {"verdicts": 100, "cache_bytes": 100_000, "used_bytes": 5_000_000, "free_bytes": 0}
+        assert rows_over_budget(size, max_rows=0, max_db_bytes=80_000) == 20
+        assert rows_over_budget(size, max_rows=50, max_db_bytes=80_000) == 50
+        assert rows_over_budget(size, max_rows=0, max_db_bytes=0) == 0
+    
+    @pytest.mark.asyncio
+    async def test_byte_budget_ignores_offline_store(self):
+        """A large offline product store should not make the cache evict its verdicts."""
+        init_db()
+        db.cache_scans({barcode(i): RESPONSE for i in range(10)})
+        db.upsert_local_products([
+            (f"9{i:012d}", "Local Product", None, "water " * 200, None) for i in range(500)
+        ])
+        size = db.get_cache_size()
+        assert size["cache_bytes"] < 100_000 < size["used_bytes"]
+        
+        report = await maintain(max_rows=0, max_db_bytes=size["cache_bytes"] + 1)
+        assert report["evicted"] == 0
+    
+    def test_cache_bytes_estimated_without_dbstat(self):
+        """Without the dbstat table the cache size should be estimated from stored values."""
+        init_db()
+        db.cache_scans({barcode(i): RESPONSE for i in range(10)}, {barcode(i): "water" for i in range(10)})
+        
+        class NoDbstat:
+            def __init__(self, conn):
+                self.conn = conn
+            
+            def execute(self, sql, *args):
+                if "dbstat" in sql:
+                    raise sqlite3.OperationalError("no such table: dbstat")
+                return self.conn.execute(sql, *args)
+        
+        assert 10 * 100 < db._evictable_bytes(NoDbstat(db.get_connection())) < 10_000
+
+
+class TestVacuumAndIndexes:
+    """Tests for incremental vacuum and sweep indexes."""
+    
+    @pytest.mark.asyncio
+    async def test_incremental_vacuum_returns_freed_pages(self):
+        """Pages freed by deletions should be returned to the OS."""
+        init_db()
+        assert db.get_connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        big = dict(RESPONSE, product_name="x" * 4000)
+        db.cache_scans({barcode(i): big for i in range(200)})
+        
+        report = await maintain(max_rows=10)
+        
+        assert report["evicted"] == 190
+        assert report["vacuumed_pages"] > 0
+        assert report["free_bytes"] == 0
+    
+    def test_sweep_indexes_exist(self):
+        """Expiry and LRU queries should be backed by indexes."""
+        init_db()
+        indexes = {row[0] for row in db.get_connection().execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"verdicts_updated_at", "verdicts_accessed_at", "products_fetched_at", "negative_cache_updated_at"} <= indexes
+
+
+class TestMaintenanceLoop:
+    """Tests for the periodic background task."""
+    
+    @pytest.mark.asyncio
+    async def test_failed_run_is_reported_and_loop_continues(self, monkeypatch):
+        """A run raising a non-SQLite error should be reported without ending the loop."""
+        runs = []
+        recovered = asyncio.Event()
+        
+        async def flaky_run():
+            runs.append(maintenance.get_last_report())
+            if len(runs) == 1:
+                raise RuntimeError("boom")
+            recovered.set()
+        
+        monkeypatch.setattr(maintenance, "run_maintenance", flaky_run)
+        monkeypatch.setattr(maintenance, "_last_report", None)
+        task = asyncio.create_task(maintenance_loop(0.01))
+        await asyncio.wait_for(recovered.wait(), timeout=2)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert runs[:2] == [None, {"error": "RuntimeError: boom"}]
@@ -0,0 +1,143 @@
+"""
+Tests for the Aho-Corasick substance matcher.
+
+Tests cover:
+1. Automaton correctness (overlapping patterns, failure links)
+2. Word boundaries
+3. Matcher built from the ingredient map, rules and carcinogen aliases
+4. Generic names ("sugar alcohol"), "free" claims and negations not matched
+5. Generic and broad aliases matched only as whole ingredients
+"""
+
+
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from matcher import AhoCorasick, build_substance_matcher, load_carcinogen_terms
+from app import classify_ingredient, find_substance, INGREDIENT_MAP
+from rules import RISK_RULES
+
+
+class TestAhoCorasick:
+    """Tests for the automaton itself."""
+    
+    def test_finds_overlapping_patterns(self):
+        """Patterns sharing suffixes should all be reported."""
+        ac = AhoCorasick([("he", "he"), ("she", "she"), ("hers", "hers"), ("his", "his")])
+        assert ac.find_all("she hers his") == [(0, 3, "she"), (4, 8, "hers"), (9, 12, "his")]
+    
+    def test_respects_word_boundaries(self):
+        """Matches inside longer words should be ignored."""
+        ac = AhoCorasick([("msg", "monosodium glutamate")])
+        assert ac.find_all("msgx") == []
+        assert ac.find_all("xmsg") == []
+        assert ac.find_all("enhancer: msg.") == [(10, 13, "monosodium glutamate")]
+    
+    def test_multiword_and_punctuated_patterns(self):
+        """Patterns with spaces and punctuation should match as written."""
+        ac = AhoCorasick([("fd&c red no. 40", "allura red"), ("red 40", "allura red")])
+        values = [v for _, _, v in ac.find_all("colour (fd&c red no. 40)")]
+        assert values == ["allura red"]
+
+
+class TestSubstanceMatcher:
+    """Tests for the matcher built from the app's data."""
+    
+    def test_carcinogen_aliases_map_to_rules(self):
+        """Carcinogen aliases should resolve to the rule they describe."""
+        matcher = build_substance_matcher(INGREDIENT_MAP, RISK_RULES, load_carcinogen_terms())
+        values = {v for _, _, v in matcher.find_all("benzoate of soda")}
+        assert values == {"sodium benzoate"}
+    
+    def test_carcinogens_without_rules_are_skipped(self):
+        """Carcinogens the backend rules do not cover should not be matched."""
+        matcher = build_substance_matcher({}, ["aspartame"], [["benzene", "benzol"], ["aspartame", "e951"]])
+        assert matcher.find_all("benzol") == []
+        assert [v for _, _, v in matcher.find_all("e951")] == ["aspartame"]
+    
+    def test_ambiguous_aliases_are_skipped(self):
+        """Everyday words used as brand aliases should not match."""
+        assert find_substance("equal parts water") is None
+
+
+class TestClassifyIngredient:
+    """Tests for substance matching in classification."""
+    
+    def test_finds_substance_after_label(self):
+        """Labelled ingredients should be classified by the named substance."""
+        result = classify_ingredient("preservative: sodium benzoate")
+        assert result.canonical == "sodium benzoate"
+        assert result.risk == "moderate"
+    
+    def test_finds_e_number_inside_text(self):
+        """E-numbers inside free text should resolve through the ingredient map."""
+        result = classify_ingredient("colour e150d")
+        assert result.canonical == "caramel color"
+        assert result.source == "PROP65_CARCINOGEN"
+    
+    def test_picks_riskiest_substance(self):
+        """When several substances appear, the riskiest should win."""
+        result = classify_ingredient("sweeteners: sucralose and aspartame")
+        assert result.canonical == "aspartame"
+    
+    def test_unknown_ingredient_stays_safe(self):
+        """Ingredients without any known substance should keep their name."""
+        result = classify_ingredient("whole grain oats")
+        assert result.canonical == "whole grain oats"
+        assert result.risk == "safe"
+        assert result.source is None
+    
+    def test_compound_alcohols_are_not_ethanol(self):
+        """Polyols and fatty alcohols should not be classified as alcohol."""
+        for ingredient in ("sugar alcohol", "benzyl alcohol", "cetyl alcohol", "sweetener: sugar alcohol"):
+            result = classify_ingredient(ingredient)
+            assert result.risk == "safe", ingredient
+        assert classify_ingredient("alcohol").risk == "critical"
+    
+    def test_generic_aliases_match_whole_ingredients(self):
+        """'ethyl alcohol' on its own should be alcohol, like 'ethanol' is."""
+        for ingredient in ("ethyl alcohol", "Ethyl Alcohol.", "ethanol"):
+            assert classify_ingredient(ingredient).risk == "critical", ingredient
+    
+    def test_broad_aliases_match_whole_ingredients(self):
+        """Meat names should only count as red meat when they are the whole ingredient."""
+        for ingredient in ("lamb's lettuce", "vegan beef style pieces", "pork gelatin"):
+            assert classify_ingredient(ingredient).risk == "safe", ingredient
+        result = classify_ingredient("beef")
+        assert (result.canonical, result.risk) == ("red meat", "high")
+    
+    def test_aliases_keep_their_own_substance(self):
+        """A carcinogen alias with its own rule should not be reported as another substance."""
+        for ingredient in ("potassium nitrate", "e252", "cured with potassium nitrate"):
+            result = classify_ingredient(ingredient)
+            assert (result.canonical, result.risk) == ("potassium nitrate", "high"), ingredient
+        assert classify_ingredient("potassium nitrite").canonical == "potassium nitrite"
+    
+    def test_free_claims_are_not_matches(self):
+        """'alcohol free' and 'msg-free' state an absence rather than an ingredient."""
+        for ingredient in ("alcohol free", "alcohol-free", "msg-free"):
+            assert classify_ingredient(ingredient).risk == "safe", ingredient
+        assert classify_ingredient("freeze-dried aspartame").canonical == "aspartame"
+    
+    def test_negated_claims_are_not_matches(self):
+        """Label phrases saying a substance is absent should not flag it."""
+        for ingredient in (
+            "no msg",
+            "no added msg",
+            "contains no aspartame",
+            "without aspartame",
+            "not made with msg",
+            "no nitrates or nitrites added except those naturally occurring in celery powder",
+            "uncured (no nitrates added)",
+        ):
+            result = classify_ingredient(ingredient)
+            assert (result.risk, result.confidence) == ("safe", None), ingredient
+    
+    def test_negation_scope_ends_at_clause(self):
+        """Substances after the negated clause, or under a quantity limit, should still match."""
+        assert classify_ingredient("no msg but contains aspartame").canonical == "aspartame"
+        assert classify_ingredient("not more than 2% sodium benzoate").canonical == "sodium benzoate"
+        assert classify_ingredient("colour (fd&c red no. 3) and aspartame").canonical == "erythrosine"
@@ -0,0 +1,121 @@
+"""
+Tests for the in-process Prometheus metrics.
+
+Tests cover:
+1. Counters and gauges
+2. Histogram buckets and timing
+3. Text exposition format
+"""
+
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import metrics
+from metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry(monkeypatch):
+    """Keeps test metrics out of the app's registry."""
+    monkeypatch.setattr(metrics, "_registry", [])
+
+
+class TestCountersAndGauges:
+    """Tests for Counter and Gauge."""
+    
+    def test_counter_per_label(self):
+        """Each label combination should count separately."""
+        counter = Counter("test_total", "Test.", ("result",))
+        counter.inc("hit")
+        counter.inc("hit", amount=2)
+        counter.inc("miss")
+        assert counter.get("hit") == 3
+        assert counter.get("miss") == 1
+    
+    def test_gauge_goes_up_and_down(self):
+        """inc/dec should move an unlabelled gauge, starting at 0."""
+        gauge = Gauge("test_in_flight", "Test.")
+        assert gauge.get() == 0
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        assert gauge.get() == 1
+    
+    def test_gauge_set(self):
+        """set should replace the current value."""
+        gauge = Gauge("test_state", "Test.")
+        gauge.inc()
+        gauge.set(2)
+        assert gauge.get() == 2
+    
+    def test_disabled_metrics_record_nothing(self, monkeypatch):
+        """SAFEEATS_METRICS=0 should turn recording into a no-op."""
+        monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+        counter = Counter("test_total", "Test.", ("result",))
+        histogram = Histogram("test_seconds", "Test.", ("stage",))
+        counter.inc("hit")
+        histogram.observe(0.1, "fetch")
+        assert counter.get("hit") == 0
+        assert histogram.get_count("fetch") == 0
+
+
+class TestHistogram:
+    """Tests for Histogram."""
+    
+    def test_buckets_are_cumulative(self):
+        """Each le bucket should count every observation up to its bound."""
+        histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value, "fetch")
+        text = "\n".join(histogram.render())
+        assert 'test_seconds_bucket{stage="fetch",le="0.1"} 2' in text
+        assert 'test_seconds_bucket{stage="fetch",le="1.0"} 3' in text
+        assert 'test_seconds_bucket{stage="fetch",le="+Inf"} 4' in text
+        assert 'test_seconds_count{stage="fetch"} 4' in text
+        assert 'test_seconds_sum{stage="fetch"} 5.65' in text
+    
+    def test_time_records_on_error(self):
+        """The timing context manager should observe even when the block raises."""
+        histogram = Histogram("test_seconds", "Test.", ("stage",))
+        with pytest.raises(ValueError):
+            with histogram.time("parse"):
+                raise ValueError
+        assert histogram.get_count("parse") == 1
+
+
+class TestExposition:
+    """Tests for the Prometheus text output."""
+    
+    def test_help_type_and_samples(self):
+        """Every metric should have HELP and TYPE lines followed by its samples."""
+        counter = Counter("test_total", "Test counter.", ("status",))
+        counter.inc("200")
+        Gauge("test_in_flight", "Test gauge.")
+        lines = metrics.render_metrics().splitlines()
+        assert lines == [
+            "# HELP test_total Test counter.",
+            "# TYPE test_total counter",
+            'test_total{status="200"} 1',
+            "# HELP test_in_flight Test gauge.",
+            "# TYPE test_in_flight gauge",
+            "test_in_flight 0",
+        ]
+    
+    def test_label_values_are_escaped(self):
+        """Quotes, backslashes and newlines in label values should be escaped."""
+        counter = Counter("test_total", "Test.", ("status",))
+        counter.inc('a"b\\c\nd')
+        assert 'test_total{status="a\\"b\\\\c\\nd"} 1' in metrics.render_metrics()
+    
+    def test_reset_clears_series(self):
+        """reset_metrics should drop every recorded series."""
+        counter = Counter("test_total", "Test.", ("status",))
+        counter.inc("200")
+        metrics.reset_metrics()
+        assert counter.get("200") == 0
@@ -0,0 +1,104 @@
+"""
+Tests for incremental extraction of product fields from Open Food Facts responses.
+
+Tests cover:
+1. Same fields as a full decode, whatever the chunk size
+2. Stopping once the preferred fields are known
+3. Not-found documents and implied status
+4. Malformed and truncated bodies
+"""
+
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from offjson import ProductFieldReader
+
+
+FIELD_GROUPS = (("product_name", "product_name_en"), ("ingredients_text", "ingredients_text_en"))
+WANTED = {field for group in FIELD_GROUPS for field in group}
+
+# Keys sorted as Open Food Facts sends them, with bulky fields around the wanted ones
+FULL_DOCUMENT = {
+    "code": "3017620422003",
+    "product": {
+        "images": {str(i): {"sizes": {"400": {"h": 400, "w": 300}}} for i in range(30)},
+        "ingredients": [{"id": f"en:ingredient-{i}", "percent_estimate": i / 3} for i in range(30)],
+        "ingredients_text": "sucre, huile de palme, noisettes 13%, lait écrémé en poudre",
+        "ingredients_text_en": "sugar, palm oil, hazelnuts 13%, skimmed milk powder",
+        "nutriments": {f"nutrient_{i}_100g": i * 1.5 for i in range(50)},
+        "product_name": "Nutella",
+        "product_name_en": "Nutella",
+        "selected_images": {"front": {"display": {"en": "https://example.org/front.jpg"}}},
+        "states_tags": [f"en:state-{i}" for i in range(200)],
+    },
+    "status": 1,
+    "status_verbose": "product found",
+}
+
+
+def read(document, chunk_size: int) -> tuple[dict, int]:
+    """Feeds a document's bytes to a reader; returns its result and how many bytes it took."""
+    body = json.dumps(document, ensure_ascii=False).encode() if not isinstance(document, bytes) else document
+    reader = ProductFieldReader(FIELD_GROUPS)
+    fed = 0
+    for start in range(0, len(body), chunk_size):
+        fed = min(len(body), start + chunk_size)
+        if reader.feed(body[start:start + chunk_size]):
+            break
+    return reader.result(), fed
+
+
+class TestProductFieldReader:
+    """Tests for ProductFieldReader."""
+
+    @pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1000, 1_000_000])
+    def test_matches_full_decode(self, chunk_size):
+        """Any chunking should give the wanted fields a full decode would."""
+        result, _ = read(FULL_DOCUMENT, chunk_size)
+        assert result["status"] == 1
+        product = result["product"]
+        assert product["product_name"] == "Nutella"
+        assert product["ingredients_text"] == FULL_DOCUMENT["product"]["ingredients_text"]
+        assert set(product) <= WANTED
+
+    def test_stops_after_preferred_fields(self):
+        """Reading should stop soon after product_name, well before the end of the body."""
+        body = json.dumps(FULL_DOCUMENT, ensure_ascii=False).encode()
+        _, fed = read(body, 16)
+        assert body.index(b'"product_name"') < fed < len(body) - 2000
+
+    def test_waits_for_fallback_when_preferred_is_empty(self):
+        """An empty preferred field should leave the reader looking for the fallback."""
+        document = {"product": {"ingredients_text": "water", "product_name": "", "product_name_en": "Water"}, "status": 1}
+        result, _ = read(document, 5)
+        assert result["product"] == {"ingredients_text": "water", "product_name": "", "product_name_en": "Water"}
+
+    def test_not_found_document(self):
+        """A document without a product should keep its status and have no product."""
+        result, _ = read({"code": "1", "status": 0, "status_verbose": "product not found"}, 4)
+        assert result == {"status": 0}
+        assert read({"status": 1, "product": None}, 4)[0] == {"status": 1}
+
+    def test_status_after_product(self):
+        """A status following a complete product should still be reported."""
+        result, _ = read({"product": {"product_name": "A"}, "status": 0}, 4)
+        assert result == {"status": 0, "product": {"product_name": "A"}}
+
+    @pytest.mark.parametrize("body", [
+        b"",
+        b"[1, 2]",
+        b'{"status" 1}',
+        b'{"status": 1, "product": {"product_name": "x"',
+        b'{"product": {"nutriments": tru',
+    ])
+    def test_malformed_body_raises(self, body):
+        """Malformed or truncated bodies should raise ValueError."""
+        with pytest.raises(ValueError):
+            read(body, 3)
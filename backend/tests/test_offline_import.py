@@ -0,0 +1,150 @@
+"""
+Tests for the offline product store importer.
+
+Tests cover:
+1. JSONL and CSV/TSV dumps, plain and gzipped
+2. Record filtering
+3. /scan served from the offline store
+4. Stray quotes and oversized fields in CSV/TSV dumps
+"""
+
+
+import gzip
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import offline_import
+from db import init_db, get_local_product
+from offline_import import import_dump, extract_product
+
+
+RECORDS = [
+    {"code": "1234567890128", "product_name": "Diet Cola", "ingredients_text": "water, aspartame"},
+    {"code": "12345678", "product_name_en": "Crackers", "ingredients_text_en": "wheat flour, salt"},
+    {"code": "87654321", "product_name": "No Ingredients"},
+    {"code": "not-a-barcode", "ingredients_text": "sugar"},
+]
+
+
+def write_jsonl(path: Path, records: list[dict]) -> None:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.write("not json\n")
+
+
+def write_tsv(path: Path, records: list[dict]) -> None:
+    columns = ["code", "product_name", "ingredients_text", "brands"]
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.write("\t".join(columns) + "\n")
+        for record in records:
+            f.write("\t".join(record.get(c, "") for c in columns) + "\n")
+
+
+class TestExtractProduct:
+    """Tests for record filtering."""
+    
+    def test_keeps_records_with_barcode_and_ingredients(self):
+        """Valid records should produce a product tuple."""
+        product = extract_product(RECORDS[0])
+        assert product[0] == "1234567890128"
+        assert product[3] == "water, aspartame"
+    
+    def test_skips_records_without_ingredients(self):
+        """Records without any ingredients text should be skipped."""
+        assert extract_product(RECORDS[2]) is None
+    
+    def test_skips_invalid_barcodes(self):
+        """Records with invalid barcodes should be skipped."""
+        assert extract_product(RECORDS[3]) is None
+
+
+class TestImportDump:
+    """Tests for streaming dump imports."""
+    
+    def test_gzipped_jsonl_import(self, tmp_path):
+        """A gzipped JSONL dump should load valid products in batches."""
+        init_db()
+        dump = tmp_path / "products.jsonl.gz"
+        write_jsonl(dump, RECORDS)
+        
+        stats = import_dump(dump, batch_size=1)
+        
+        assert stats == {"read": 4, "imported": 2, "skipped": 2}
+        assert get_local_product("1234567890128")["ingredients_text"] == "water, aspartame"
+        assert get_local_product("12345678")["product_name_en"] == "Crackers"
+        assert get_local_product("87654321") is None
+    
+    def test_tsv_import(self, tmp_path):
+        """A tab-separated export should be detected and imported."""
+        init_db()
+        dump = tmp_path / "en.openfoodfacts.org.products.csv"
+        write_tsv(dump, RECORDS)
+        
+        stats = import_dump(dump)
+        
+        assert stats["imported"] == 1
+        assert get_local_product("1234567890128")["product_name"] == "Diet Cola"
+    
+    def test_tsv_stray_quote_does_not_swallow_rows(self, tmp_path):
+        """An unmatched quote in an unquoted TSV export should stay in its own field."""
+        init_db()
+        dump = tmp_path / "en.openfoodfacts.org.products.csv"
+        records = [dict(RECORDS[0], product_name='"Diet Cola'), {"code": "12345670", "ingredients_text": "sugar"}]
+        write_tsv(dump, records)
+        
+        stats = import_dump(dump)
+        
+        assert stats == {"read": 2, "imported": 2, "skipped": 0}
+        assert get_local_product("1234567890128")["product_name"] == '"Diet Cola'
+        assert get_local_product("12345670")["ingredients_text"] == "sugar"
+    
+    def test_oversized_csv_field_is_skipped(self, tmp_path, monkeypatch):
+        """A quoted CSV field running past the size limit should skip that row, not stop the import."""
+        init_db()
+        monkeypatch.setattr(offline_import, "CSV_FIELD_SIZE_LIMIT", 64)
+        dump = tmp_path / "products.csv"
+        dump.write_text(
+            "code,product_name,ingredients_text\n"
+            f'1234567890128,"{"x" * 100},water\n'
+            "12345670,Sugar,sugar\n"
+        )
+        
+        stats = import_dump(dump)
+        
+        assert stats == {"read": 2, "imported": 1, "skipped": 1}
+        assert get_local_product("12345670")["product_name"] == "Sugar"
+    
+    def test_reimport_updates_products(self, tmp_path):
+        """Importing again should update existing products."""
+        init_db()
+        dump = tmp_path / "products.jsonl"
+        write_jsonl(dump, RECORDS[:1])
+        import_dump(dump)
+        write_jsonl(dump, [{"code": "1234567890128", "ingredients_text": "water, sugar"}])
+        import_dump(dump)
+        
+        assert get_local_product("1234567890128")["ingredients_text"] == "water, sugar"
+
+
+class TestScanUsesOfflineStore:
+    """Tests for /scan reading from the offline store."""
+    
+    def test_scan_served_without_network(self, client, tmp_path, httpx_mock):
+        """An imported barcode should be classified without calling Open Food Facts."""
+        dump = tmp_path / "products.jsonl"
+        write_jsonl(dump, RECORDS[:1])
+        import_dump(dump)
+        
+        response = client.post("/scan", json={"barcode": "1234567890128"})
+        
+        assert response.status_code == 200
+        assert response.json()["product_name"] == "Diet Cola"
+        assert response.json()["overall_risk"] == "moderate"
+        assert httpx_mock.get_requests() == []
@@ -0,0 +1,143 @@
+"""
+Tests for the background re-scoring job.
+
+Tests cover:
+1. Re-scoring stored products under the current rules
+2. Resuming after an interrupted run
+3. Process pool execution
+4. Failures reported in the job's stats
+"""
+
+
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import db
+import rescore
+from db import init_db, get_cached_scan
+from rescore import RescoreJob
+
+
+def store_products(count: int, ingredients_text: str = "water, sugar, aspartame") -> None:
+    conn = db.get_connection()
+    now = datetime.now().isoformat()
+    with conn:
+        conn.executemany(
+            "INSERT INTO products VALUES (?, ?, ?, ?, ?)",
+            [
+                (str(10000000 + i), f"Product {i}", ingredients_text, now, db.product_content_hash(f"Product {i}", ingredients_text))
+                for i in range(count)
+            ]
+        )
+
+
+def verdict_count() -> int:
+    return db.get_connection().execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+
+class TestRescoreJob:
+    """Tests for in-process re-scoring."""
+    
+    def test_rescores_products_missing_a_verdict(self):
+        """Every stored product should get a verdict for the current rules."""
+        init_db()
+        store_products(5)
+        stats = RescoreJob(workers=0, chunk_size=2).run()
+        assert (stats["read"], stats["rescored"], stats["skipped"]) == (5, 5, 0)
+        verdict = get_cached_scan("10000003")
+        assert verdict["product_name"] == "Product 3"
+        assert verdict["overall_risk"] == "moderate"
+    
+    def test_skips_products_with_current_verdict(self):
+        """A second pass should find nothing left to do."""
+        init_db()
+        store_products(3)
+        RescoreJob(workers=0).run()
+        assert RescoreJob(workers=0).run()["read"] == 0
+    
+    def test_unparseable_products_are_skipped(self):
+        """Products whose ingredients parse to nothing should be counted, not stored."""
+        init_db()
+        store_products(2, ingredients_text="., ;")
+        stats = RescoreJob(workers=0).run()
+        assert (stats["read"], stats["rescored"], stats["skipped"]) == (2, 0, 2)
+        assert verdict_count() == 0
+    
+    def test_does_not_fill_hot_cache(self):
+        """Bulk re-scoring should leave the hot cache to live traffic."""
+        init_db()
+        store_products(3)
+        RescoreJob(workers=0).run()
+        assert len(db._hot_cache) == 0
+    
+    def test_writes_run_on_the_writer_thread(self, monkeypatch):
+        """Chunk writes should be serialized with the server's cache writes."""
+        init_db()
+        store_products(3)
+        threads = []
+        
+        def recording_cache_scans(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return db.cache_scans(*args, **kwargs)
+        
+        monkeypatch.setattr(rescore, "cache_scans", recording_cache_scans)
+        RescoreJob(workers=0, chunk_size=2).run()
+        assert len(threads) == 2
+        assert all(t.name.startswith("safeeats-db-write") for t in threads)
+        assert verdict_count() == 3
+
+
+class TestFailures:
+    """Tests for a pass that fails part way."""
+    
+    def test_failure_is_reported_not_raised(self, monkeypatch):
+        """An error should end the pass and show up in stats() with the work done so far."""
+        init_db()
+        store_products(4)
+        chunks = iter([rescore.get_products_without_verdict])
+        
+        def failing_read(*args):
+            read = next(chunks, None)
+            if read is None:
+                raise RuntimeError("database is gone")
+            return read(*args)
+        
+        monkeypatch.setattr(rescore, "get_products_without_verdict", failing_read)
+        stats = RescoreJob(workers=0, chunk_size=2).run()
+        assert stats["error"] == "RuntimeError: database is gone"
+        assert (stats["running"], stats["rescored"]) == (False, 2)
+        assert verdict_count() == 2
+
+
+class TestResume:
+    """Tests for interrupting and resuming a run."""
+    
+    def test_stopped_run_resumes_where_it_left_off(self):
+        """A stopped job should commit its chunks and a new job should finish the rest."""
+        init_db()
+        store_products(6)
+        first = RescoreJob(workers=0, chunk_size=2)
+        first.progress = lambda stats: first.stop()
+        assert first.run()["rescored"] == 2
+        assert verdict_count() == 2
+        
+        second = RescoreJob(workers=0, chunk_size=2).run()
+        assert second["rescored"] == 4
+        assert verdict_count() == 6
+
+
+class TestProcessPool:
+    """Tests for re-scoring across worker processes."""
+    
+    def test_pool_matches_in_process_results(self):
+        """Worker processes should produce the same verdicts as in-process scoring."""
+        init_db()
+        store_products(4)
+        stats = RescoreJob(workers=1, chunk_size=2).run()
+        assert stats["rescored"] == 4
+        assert get_cached_scan("10000000")["overall_risk"] == "moderate"
@@ -0,0 +1,293 @@
+"""
+Tests for upstream admission control.
+
+Tests cover:
+1. Token-bucket rate limiting
+2. Circuit breaker state transitions
+3. UpstreamGuard in-flight cap and probe handling
+4. Deadlines, backoff, retry budget and latency percentiles
+"""
+
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from resilience import (
+    CircuitBreaker,
+    LatencyWindow,
+    RetryBudget,
+    RetryPolicy,
+    TokenBucket,
+    UpstreamGuard,
+    UpstreamUnavailable,
+    backoff_delay,
+    deadline_scope,
+    remaining_budget,
+    CLOSED,
+    OPEN,
+    HALF_OPEN,
+)
+
+
+class FakeClock:
+    """Manually advanced monotonic clock."""
+    
+    def __init__(self):
+        self.now = 100.0
+    
+    def __call__(self) -> float:
+        return self.now
+    
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def make_guard(max_in_flight: int = 4, queue_timeout: float = 0.05, clock=None) -> UpstreamGuard:
+    clock = clock or FakeClock()
+    return UpstreamGuard(
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock),
+        bucket=TokenBucket(rate=0, burst=1, max_wait=0, clock=clock),
+        max_in_flight=max_in_flight,
+        queue_timeout=queue_timeout,
+        retry_policy=RetryPolicy(retries=2, base_delay=0.1, max_delay=1, hedge=False, hedge_min_delay=0.05),
+        retry_budget=RetryBudget(ratio=0.1, max_tokens=10),
+        latency=LatencyWindow(),
+    )
+
+
+class TestTokenBucket:
+    """Tests for TokenBucket."""
+    
+    def test_burst_then_waits(self):
+        """Calls past the burst should be told to wait for the next token."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, max_wait=5, clock=clock)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.5)
+        assert bucket.reserve() == pytest.approx(1.0)
+    
+    def test_tokens_refill_over_time(self):
+        """Tokens should come back at the configured rate, up to the burst."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, max_wait=5, clock=clock)
+        bucket.reserve()
+        bucket.reserve()
+        clock.advance(60)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() > 0
+    
+    def test_wait_past_max_is_refused(self):
+        """A call that would wait longer than max_wait should be refused without taking a token."""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, burst=1, max_wait=0.5, clock=clock)
+        bucket.reserve()
+        with pytest.raises(UpstreamUnavailable) as exc:
+            bucket.reserve()
+        assert exc.value.reason == "rate_limited"
+        assert exc.value.retry_after_header == "1"
+        clock.advance(1)
+        assert bucket.reserve() == 0
+    
+    def test_zero_rate_disables_limit(self):
+        """rate=0 should never delay or refuse."""
+        bucket = TokenBucket(rate=0, burst=1, max_wait=0)
+        assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker."""
+    
+    def test_opens_after_consecutive_failures(self):
+        """failure_threshold failures in a row should open the breaker."""
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=FakeClock())
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        with pytest.raises(UpstreamUnavailable) as exc:
+            breaker.before_call()
+        assert exc.value.reason == "circuit_open"
+        assert exc.value.retry_after == 10
+        assert breaker.stats()["rejected"] == 1
+    
+    def test_half_open_allows_one_probe(self):
+        """After the reset timeout exactly one call should get through."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.advance(10)
+        assert breaker.state == HALF_OPEN
+        assert breaker.before_call() is True
+        with pytest.raises(UpstreamUnavailable):
+            breaker.before_call()
+    
+    def test_successful_probe_closes(self):
+        """A successful probe should close the breaker."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.advance(10)
+        breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        assert breaker.before_call() is False
+    
+    def test_failed_probe_reopens(self):
+        """A failed probe should open the breaker for another reset timeout."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.advance(10)
+        breaker.before_call()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.stats()["trips"] == 2
+        assert breaker.stats()["retry_in_seconds"] == 10
+
+
+class TestUpstreamGuard:
+    """Tests for UpstreamGuard."""
+    
+    @pytest.mark.asyncio
+    async def test_in_flight_cap(self):
+        """Calls past max_in_flight should be refused once the queue timeout passes."""
+        guard = make_guard(max_in_flight=1)
+        release = asyncio.Event()
+        
+        async def hold():
+            async with guard.slot():
+                await release.wait()
+        
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert guard.in_flight == 1
+        with pytest.raises(UpstreamUnavailable) as exc:
+            async with guard.slot():
+                pass
+        assert exc.value.reason == "overloaded"
+        release.set()
+        await holder
+        assert guard.stats()["rejected"]["overloaded"] == 1
+        assert guard.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_queued_call_gets_freed_slot(self):
+        """A call waiting for a slot should proceed when one frees up in time."""
+        guard = make_guard(max_in_flight=1, queue_timeout=1)
+        
+        async def call(delay):
+            async with guard.slot():
+                await asyncio.sleep(delay)
+        
+        await asyncio.gather(call(0.01), call(0))
+        assert guard.stats()["rejected"]["overloaded"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_open_breaker_refuses_slot(self):
+        """An open breaker should refuse calls and count them."""
+        guard = make_guard()
+        guard.breaker.record_failure()
+        guard.breaker.record_failure()
+        with pytest.raises(UpstreamUnavailable):
+            async with guard.slot():
+                pass
+        stats = guard.stats()
+        assert stats["circuit"]["state"] == OPEN
+        assert stats["rejected"]["circuit_open"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_probe_without_outcome_is_released(self):
+        """A probe that ends without recording an outcome should let the next probe through."""
+        clock = FakeClock()
+        guard = make_guard(clock=clock)
+        guard.breaker.record_failure()
+        guard.breaker.record_failure()
+        clock.advance(10)
+        with pytest.raises(RuntimeError):
+            async with guard.slot():
+                raise RuntimeError("cancelled mid-request")
+        async with guard.slot():
+            guard.breaker.record_success()
+        assert guard.breaker.state == CLOSED
+    
+    @pytest.mark.asyncio
+    async def test_spare_capacity(self):
+        """Hedges should only be admitted while the breaker is closed and a slot is free."""
+        guard = make_guard(max_in_flight=1)
+        assert guard.has_spare_capacity()
+        async with guard.slot():
+            assert not guard.has_spare_capacity()
+        guard.breaker.record_failure()
+        guard.breaker.record_failure()
+        assert not guard.has_spare_capacity()
+
+
+class TestDeadlinesAndRetries:
+    """Tests for deadlines, backoff, the retry budget and latency percentiles."""
+    
+    def test_deadline_scope(self):
+        """remaining_budget should count down inside a scope and be None outside."""
+        assert remaining_budget() is None
+        with deadline_scope(5):
+            assert 4.9 < remaining_budget() <= 5
+            with deadline_scope(0):
+                assert remaining_budget() is None
+        assert remaining_budget() is None
+    
+    @pytest.mark.asyncio
+    async def test_tasks_inherit_deadline(self):
+        """Work started as a task inside a scope should see the same deadline."""
+        with deadline_scope(5):
+            expected = time.monotonic() + 5
+            inherited = await asyncio.ensure_future(asyncio.sleep(0, remaining_budget()))
+        assert inherited == pytest.approx(expected - time.monotonic(), abs=0.1)
+    
+    def test_backoff_is_jittered_and_capped(self):
+        """Delays should grow exponentially up to the cap, scaled by the jitter."""
+        assert backoff_delay(0, 0.1, 1.0, rng=lambda: 1.0) == pytest.approx(0.1)
+        assert backoff_delay(2, 0.1, 1.0, rng=lambda: 1.0) == pytest.approx(0.4)
+        assert backoff_delay(10, 0.1, 1.0, rng=lambda: 1.0) == 1.0
+        assert backoff_delay(3, 0.1, 1.0, rng=lambda: 0.5) == pytest.approx(0.4)
+        assert 0 <= backoff_delay(1, 0.1, 1.0) <= 0.2
+    
+    def test_retry_budget_limits_extra_requests(self):
+        """Retries should be capped at the ratio of first attempts once the reserve is spent."""
+        budget = RetryBudget(ratio=0.25, max_tokens=2)
+        assert budget.try_spend() and budget.try_spend()
+        assert not budget.try_spend()
+        for _ in range(4):
+            budget.record_request()
+        assert budget.try_spend()
+        assert not budget.try_spend()
+        assert budget.exhausted == 2
+    
+    def test_retry_budget_reserve(self):
+        """try_spend(keep=...) should leave the reserved tokens untouched."""
+        budget = RetryBudget(ratio=0.1, max_tokens=4)
+        assert budget.try_spend(keep=2) and budget.try_spend(keep=2)
+        assert not budget.try_spend(keep=2)
+        assert budget.try_spend()
+    
+    def test_latency_percentiles(self):
+        """Percentiles need min_samples and should track the window."""
+        window = LatencyWindow(size=100, min_samples=10)
+        for ms in range(9):
+            window.observe(ms / 1000)
+        assert window.percentile(0.95) is None
+        for ms in range(9, 100):
+            window.observe(ms / 1000)
+        assert window.percentile(0.95) == pytest.approx(0.095)
+        assert window.percentile(0.5) == pytest.approx(0.05)
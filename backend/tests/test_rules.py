@@ -6,6 +6,7 @@ Tests cover:
 2. Overall risk calculation
 3. Source tracking and conflict resolution
 4. Version information
+5. Compiled rules table and batch classification
 """
 
 
@@ -21,8 +22,12 @@ from rules import (
     get_overall_risk,
     get_rules_version,
     get_rules_metadata,
+    classify_many,
+    compile_rules,
     RULES_VERSION,
     RISK_RULES,
+    RISK_LEVELS,
+    RISK_CODES,
 )
 
 
@@ -204,4 +209,35 @@ class TestConflictResolution:
         # Aspartame is classified by both IARC (2B) and Prop 65
         # Our rules use IARC classification
         risk, source, _ = get_risk_with_source("aspartame")
-        assert "IARC" in source, "IARC should be the source for aspartame"
\ No newline at end of file
+        assert "IARC" in source, "IARC should be the source for aspartame"
+
+class TestCompiledRules:
+    """Tests for the compiled rules table and classify_many()."""
+    
+    def test_risk_codes_are_ordered(self):
+        """Integer risk codes should follow the risk hierarchy."""
+        assert [RISK_CODES[level] for level in RISK_LEVELS] == [0, 1, 2, 3, 4]
+    
+    def test_classify_many_matches_single_lookups(self):
+        """Batch results should equal per-name get_risk_with_source()."""
+        names = ["water", "aspartame", "Processed Meat", "sucralose"]
+        results, overall = classify_many(names)
+        assert results == [get_risk_with_source(n) for n in names]
+        assert overall == "critical"
+    
+    def test_classify_many_empty_is_safe(self):
+        """An empty batch should be safe."""
+        assert classify_many([]) == ([], "safe")
+    
+    def test_compile_rules_swaps_table(self):
+        """Recompiling with new rules should change lookups, and restoring should undo it."""
+        try:
+            compile_rules({
+                "water": {"risk": "low", "source": "NONE", "iarc_group": None, "notes": "Test rule."}
+            })
+            assert get_risk("water") == "low"
+            assert get_risk("aspartame") == "safe"
+        finally:
+            compile_rules()
+        assert get_risk("water") == "safe"
+        assert get_risk("aspartame") == "moderate"
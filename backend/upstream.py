@@ -0,0 +1,199 @@
+"""
+Shared HTTP client for Open Food Facts requests.
+
+A single long-lived httpx.AsyncClient is created when the app starts and
+closed when it shuts down, so cache misses reuse pooled keep-alive
+connections instead of paying for a new TCP+TLS handshake every time.
+
+Requests also pass through an UpstreamGuard (see resilience.py): a rate
+limit, a cap on requests in flight and a circuit breaker that fails fast
+while Open Food Facts is down. Failed requests that are safe to repeat are
+retried with jittered backoff, and slow ones can optionally be hedged.
+
+Every setting can be overridden with a SAFEEATS_UPSTREAM_* environment variable.
+"""
+
+import os
+from typing import Optional
+
+import httpx
+
+from resilience import CircuitBreaker, LatencyWindow, RetryBudget, RetryPolicy, TokenBucket, UpstreamGuard
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+# Connection pool
+UPSTREAM_MAX_CONNECTIONS = _env_int("SAFEEATS_UPSTREAM_MAX_CONNECTIONS", 100)
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = _env_int("SAFEEATS_UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20)
+UPSTREAM_KEEPALIVE_EXPIRY = _env_float("SAFEEATS_UPSTREAM_KEEPALIVE_EXPIRY", 30.0)
+
+# HTTP/2 multiplexing (requires the optional `h2` package: pip install "httpx[http2]")
+UPSTREAM_HTTP2 = os.environ.get("SAFEEATS_UPSTREAM_HTTP2") == "1"
+
+# Per-phase timeouts in seconds
+UPSTREAM_CONNECT_TIMEOUT = _env_float("SAFEEATS_UPSTREAM_CONNECT_TIMEOUT", 5.0)
+UPSTREAM_READ_TIMEOUT = _env_float("SAFEEATS_UPSTREAM_READ_TIMEOUT", 10.0)
+UPSTREAM_WRITE_TIMEOUT = _env_float("SAFEEATS_UPSTREAM_WRITE_TIMEOUT", 5.0)
+UPSTREAM_POOL_TIMEOUT = _env_float("SAFEEATS_UPSTREAM_POOL_TIMEOUT", 5.0)
+
+# Token-bucket rate limit in requests per second (0 = off; Open Food Facts
+# asks for at most ~100 product reads per minute, i.e. 1.6/s), the burst it
+# allows and how long a request may wait for a token before it is refused
+UPSTREAM_RATE_LIMIT = _env_float("SAFEEATS_UPSTREAM_RATE_LIMIT", 0.0)
+UPSTREAM_RATE_BURST = _env_int("SAFEEATS_UPSTREAM_RATE_BURST", 10)
+UPSTREAM_RATE_MAX_WAIT = _env_float("SAFEEATS_UPSTREAM_RATE_MAX_WAIT", 2.0)
+
+# Requests in flight at once, and how long a request queues for a free slot
+UPSTREAM_MAX_IN_FLIGHT = _env_int("SAFEEATS_UPSTREAM_MAX_IN_FLIGHT", 64)
+UPSTREAM_QUEUE_TIMEOUT = _env_float("SAFEEATS_UPSTREAM_QUEUE_TIMEOUT", 2.0)
+
+# Circuit breaker: consecutive failures (errors, 5xx, 429) that open it and
+# how long it stays open before a probe request is let through
+UPSTREAM_BREAKER_FAILURES = _env_int("SAFEEATS_UPSTREAM_BREAKER_FAILURES", 5)
+UPSTREAM_BREAKER_RESET_SECONDS = _env_float("SAFEEATS_UPSTREAM_BREAKER_RESET_SECONDS", 30.0)
+
+# Retries of a failed request (connection failures and 502/503/504 only),
+# with full-jitter exponential backoff between base and max delay seconds
+UPSTREAM_RETRIES = _env_int("SAFEEATS_UPSTREAM_RETRIES", 2)
+UPSTREAM_RETRY_BASE_DELAY = _env_float("SAFEEATS_UPSTREAM_RETRY_BASE_DELAY", 0.1)
+UPSTREAM_RETRY_MAX_DELAY = _env_float("SAFEEATS_UPSTREAM_RETRY_MAX_DELAY", 1.0)
+
+# Retries and hedges together may add at most this fraction of extra requests
+UPSTREAM_RETRY_BUDGET_RATIO = _env_float("SAFEEATS_UPSTREAM_RETRY_BUDGET_RATIO", 0.1)
+
+# Hedging: when a request has not answered after the recent p95 latency
+# (at least the minimum delay), send a second one and use whichever answers
+# first. Off unless SAFEEATS_UPSTREAM_HEDGE=1.
+UPSTREAM_HEDGE = os.environ.get("SAFEEATS_UPSTREAM_HEDGE") == "1"
+UPSTREAM_HEDGE_MIN_DELAY = _env_float("SAFEEATS_UPSTREAM_HEDGE_MIN_DELAY", 0.05)
+
+# Product responses at least this many bytes long (or of unknown length)
+# are parsed as they download, and reading stops once the wanted fields
+# are known; smaller ones are read whole and decoded in one go
+UPSTREAM_STREAM_THRESHOLD = _env_int("SAFEEATS_UPSTREAM_STREAM_THRESHOLD", 16 * 1024)
+
+# Upstream statuses worth retrying: gateway errors and overload. Other 5xx
+# are unlikely to change on a retry, and 429 asks us to slow down.
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+USER_AGENT = "SafeEats-Backend/1.0"
+
+_client: Optional[httpx.AsyncClient] = None
+_guard: Optional[UpstreamGuard] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Builds an AsyncClient configured from the UPSTREAM_* settings."""
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=UPSTREAM_CONNECT_TIMEOUT,
+        read=UPSTREAM_READ_TIMEOUT,
+        write=UPSTREAM_WRITE_TIMEOUT,
+        pool=UPSTREAM_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=UPSTREAM_HTTP2 and _http2_available(),
+        headers={"User-Agent": USER_AGENT},
+    )
+
+
+def create_upstream_guard() -> UpstreamGuard:
+    """Builds an UpstreamGuard configured from the UPSTREAM_* settings."""
+    return UpstreamGuard(
+        breaker=CircuitBreaker(UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET_SECONDS),
+        bucket=TokenBucket(UPSTREAM_RATE_LIMIT, UPSTREAM_RATE_BURST, UPSTREAM_RATE_MAX_WAIT),
+        max_in_flight=UPSTREAM_MAX_IN_FLIGHT,
+        queue_timeout=UPSTREAM_QUEUE_TIMEOUT,
+        retry_policy=RetryPolicy(
+            retries=UPSTREAM_RETRIES,
+            base_delay=UPSTREAM_RETRY_BASE_DELAY,
+            max_delay=UPSTREAM_RETRY_MAX_DELAY,
+            hedge=UPSTREAM_HEDGE,
+            hedge_min_delay=UPSTREAM_HEDGE_MIN_DELAY,
+        ),
+        retry_budget=RetryBudget(UPSTREAM_RETRY_BUDGET_RATIO, max_tokens=10),
+        latency=LatencyWindow(),
+    )
+
+
+def is_retryable_error(error: httpx.HTTPError) -> bool:
+    """
+    Whether a failed GET is worth sending again: the connection could not
+    be made, or was dropped before a response arrived. Read timeouts are
+    not retried (upstream is slow, not unreachable; hedging covers those),
+    and neither are local errors such as pool timeouts.
+    """
+    return isinstance(error, (
+        httpx.ConnectError,
+        httpx.ConnectTimeout,
+        httpx.ReadError,
+        httpx.WriteError,
+        httpx.RemoteProtocolError,
+    ))
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """
+    Creates the shared client and guard. Called from the app lifespan on
+    startup. Always builds fresh ones so they belong to the running event
+    loop (and the breaker starts closed).
+    """
+    global _client, _guard
+
+    _client = create_http_client()
+    _guard = create_upstream_guard()
+    return _client
+
+
+async def close_http_client() -> None:
+    """Closes the shared client and its pooled connections. Called on shutdown."""
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client.
+    Falls back to creating one if the lifespan has not run (e.g. scripts).
+    """
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+def get_upstream_guard() -> UpstreamGuard:
+    """
+    Returns the shared guard.
+    Falls back to creating one if the lifespan has not run (e.g. scripts).
+    """
+    global _guard
+
+    if _guard is None:
+        _guard = create_upstream_guard()
+    return _guard